@@ -0,0 +1,202 @@
+import os
+import json
+import argparse
+import datetime
+import numpy as np
+
+CROP_DIR = "./data_crop"
+ANALYTICS_DIR = "./analytics"
+CONF_BINS = 20   # histogram độ tin cậy 0.05/bin -> trả lời được mọi ngưỡng "độ tin cậy thấp"
+OVERLAP_NS = 60 * 10**9   # cửa sổ chồng lấn sau watermark: file ghi trễ vài giây so với lượt quét trước
+
+class SalesSummary:
+    """Bảng tổng hợp dạng cột theo (ngày, món): số lượng, tổng độ tin cậy, histogram độ tin cậy"""
+
+    def __init__(self):
+        self._rows = {}   # (day, class) -> [count, conf_sum, hist]
+
+    def add(self, day, class_name, confidence, quantity=1):
+        row = self._rows.get((day, class_name))
+        if row is None:
+            row = self._rows[(day, class_name)] = [0, 0.0, np.zeros(CONF_BINS, np.int64)]
+        row[0] += quantity
+        row[1] += confidence * quantity
+        row[2][min(int(confidence * CONF_BINS), CONF_BINS - 1)] += quantity
+
+    def columns(self):
+        '''Trả về các cột numpy: day, class, count, conf_sum, conf_hist'''
+        keys = sorted(self._rows)
+        return {
+            "day": np.array([k[0] for k in keys], dtype="U10"),
+            "class": np.array([k[1] for k in keys], dtype="U64"),
+            "count": np.array([self._rows[k][0] for k in keys], dtype=np.int64),
+            "conf_sum": np.array([self._rows[k][1] for k in keys], dtype=np.float64),
+            "conf_hist": np.array([self._rows[k][2] for k in keys], dtype=np.int64).reshape(-1, CONF_BINS),
+        }
+
+    def save(self, path, state=None):
+        '''Lưu bảng tổng hợp; state (dict) được ghi cùng file để hai phần luôn khớp nhau'''
+        np.savez_compressed(path + ".tmp.npz", state=np.array(json.dumps(state or {}, ensure_ascii=False)),
+                            **self.columns())
+        os.replace(path + ".tmp.npz", path)
+
+    @classmethod
+    def load(cls, path):
+        summary = cls()
+        if os.path.exists(path):
+            with np.load(path) as data:
+                for day, name, count, conf_sum, hist in zip(data["day"], data["class"], data["count"],
+                                                            data["conf_sum"], data["conf_hist"]):
+                    summary._rows[(str(day), str(name))] = [int(count), float(conf_sum), hist.astype(np.int64)]
+        return summary
+
+def load_state(summary_path):
+    '''Trạng thái quét được lưu kèm trong summary.npz; None nếu chưa có (file cũ hoặc chưa quét lần nào)'''
+    if not os.path.exists(summary_path):
+        return None
+    with np.load(summary_path) as data:
+        return json.loads(str(data["state"])) if "state" in data.files else None
+
+def _bill_rows(record, fallback_day):
+    '''Lấy (ngày, món, độ tin cậy, số lượng) từ một bản ghi {"predictions", "bill"}'''
+    bill = record.get("bill") or {}
+    day = str(bill.get("timestamp", ""))[:10] or fallback_day
+    items = bill.get("items") or [{"class": p.get("predicted_class"), "confidence": p.get("confidence", 0.0)}
+                                  for p in record.get("predictions", [])]
+    for it in items:
+        if it.get("class"):
+            yield day, it["class"], float(it.get("confidence") or 0.0), int(it.get("quantity", 1))
+
+class ArchiveScanner:
+    """Quét tăng dần kho predictions.json (data_crop/crop_*) và file JSONL, nhớ watermark đã xử lý"""
+
+    def __init__(self, out_dir=ANALYTICS_DIR):
+        self.out_dir = out_dir
+        self.summary_path = os.path.join(out_dir, "summary.npz")
+        # recent: {đường dẫn: [dấu thời gian, mtime_ns, size]} của các file trong cửa sổ chồng lấn
+        self.state = {"watermark_ns": 0, "recent": {}, "jsonl_offsets": {}}
+        self.state.update(load_state(self.summary_path) or {})
+        self.summary = SalesSummary.load(self.summary_path)
+
+    def scan_crop_dir(self, crop_dir=CROP_DIR):
+        '''Xử lý các predictions.json mới hoặc bị ghi đè kể từ watermark, đọc từng file một
+
+        Dấu thời gian = max(mtime, ctime): file chép đến muộn giữ mtime cũ nhưng ctime là lúc chép,
+        file bị ghi đè (thư mục crop_ trùng tên) có mtime mới. Chỉ nhớ (mtime, size) của các file trong
+        cửa sổ OVERLAP_NS trước watermark, nên trạng thái không lớn dần theo kho.
+        '''
+        watermark = self.state["watermark_ns"]
+        recent = self.state["recent"]
+        new_mark, n_files = watermark, 0
+        if not os.path.isdir(crop_dir):
+            return 0
+
+        with os.scandir(crop_dir) as entries:
+            for entry in entries:
+                path = os.path.join(entry.path, "predictions.json")
+                if not entry.is_dir() or not os.path.exists(path):
+                    continue
+                st = os.stat(path)
+                mtime = st.st_mtime_ns
+                stamp = max(mtime, st.st_ctime_ns)
+                if stamp < watermark - OVERLAP_NS or recent.get(path, [None])[1:] == [mtime, st.st_size]:
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        record = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                fallback_day = datetime.date.fromtimestamp(mtime / 1e9).isoformat()
+                for row in _bill_rows(record, fallback_day):
+                    self.summary.add(*row)
+                n_files += 1
+                recent[path] = [stamp, mtime, st.st_size]
+                new_mark = max(new_mark, stamp)
+
+        self.state["watermark_ns"] = new_mark
+        self.state["recent"] = {p: v for p, v in recent.items() if v[0] >= new_mark - OVERLAP_NS}
+        return n_files
+
+    def scan_jsonl(self, path):
+        '''Đọc tiếp file JSONL (batch_process.py) từ vị trí byte đã xử lý lần trước'''
+        offsets = self.state["jsonl_offsets"]
+        key = os.path.abspath(path)
+        offset = offsets.get(key, 0)
+        if os.path.getsize(path) < offset:
+            offset = 0   # file đã được ghi lại từ đầu
+
+        n_records = 0
+        fallback_day = datetime.date.fromtimestamp(os.path.getmtime(path)).isoformat()
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break   # dòng đang ghi dở, để lần sau
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                for row in _bill_rows(record, fallback_day):
+                    self.summary.add(*row)
+                n_records += 1
+        offsets[key] = offset
+        return n_records
+
+    def commit(self):
+        '''Lưu bảng tổng hợp cùng trạng thái quét trong một lần os.replace (dừng giữa chừng không bị cộng trùng)'''
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.summary.save(self.summary_path, self.state)
+
+def report(summary_path, menu_path="menu.json", start="0000", end="9999", low_conf=0.6):
+    '''Thống kê theo món từ bảng tổng hợp: số lượng, doanh thu theo menu bất kỳ, tỷ lệ độ tin cậy thấp'''
+    cols = SalesSummary.load(summary_path).columns()
+    with open(menu_path, "r", encoding="utf-8") as f:
+        menu = json.load(f)
+
+    mask = (cols["day"] >= start) & (cols["day"] < end)
+    low_bins = int(round(low_conf * CONF_BINS))
+    rows = []
+    for name in np.unique(cols["class"][mask]):
+        m = mask & (cols["class"] == name)
+        count = int(cols["count"][m].sum())
+        low = int(cols["conf_hist"][m][:, :low_bins].sum())
+        rows.append({
+            "class": str(name),
+            "count": count,
+            "revenue": count * int(menu.get(str(name), 0)),
+            "avg_confidence": float(cols["conf_sum"][m].sum() / count),
+            "low_conf_rate": low / count
+        })
+    return sorted(rows, key=lambda r: -r["revenue"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Thống kê doanh số từ kho kết quả dự đoán (tăng dần, ít bộ nhớ)")
+    parser.add_argument("--out", default=ANALYTICS_DIR, help="Thư mục lưu bảng tổng hợp + trạng thái quét")
+    sub = parser.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("update", help="Quét phần mới của kho và cập nhật bảng tổng hợp")
+    up.add_argument("--crop-dir", default=CROP_DIR)
+    up.add_argument("--jsonl", nargs="*", default=[], help="Các file JSONL từ batch_process.py")
+    rp = sub.add_parser("report", help="Báo cáo từ bảng tổng hợp (không quét lại kho)")
+    rp.add_argument("--menu", default="menu.json", help="Bảng giá dùng để tính doanh thu")
+    rp.add_argument("--start", default="0000", help="Từ ngày YYYY-MM-DD")
+    rp.add_argument("--end", default="9999", help="Đến trước ngày YYYY-MM-DD")
+    rp.add_argument("--low-conf", type=float, default=0.6, help="Ngưỡng độ tin cậy thấp")
+    args = parser.parse_args()
+
+    if args.command == "update":
+        scanner = ArchiveScanner(args.out)
+        n_files = scanner.scan_crop_dir(args.crop_dir)
+        n_lines = sum(scanner.scan_jsonl(p) for p in args.jsonl)
+        scanner.commit()
+        print(f"✅ Đã cập nhật: {n_files} predictions.json mới, {n_lines} dòng JSONL mới")
+        return
+
+    rows = report(os.path.join(args.out, "summary.npz"), args.menu, args.start, args.end, args.low_conf)
+    print(f"{'Món':<22}{'Số lượng':>10}{'Doanh thu':>14}{'TB tin cậy':>12}{'Tin cậy thấp':>14}")
+    for r in rows:
+        print(f"{r['class']:<22}{r['count']:>10}{r['revenue']:>14,}{r['avg_confidence']:>12.1%}{r['low_conf_rate']:>14.1%}")
+    print(f"{'TỔNG':<22}{sum(r['count'] for r in rows):>10}{sum(r['revenue'] for r in rows):>14,}")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,21 @@
 import os
-import tempfile
+import hashlib
+import datetime
+from collections import OrderedDict
 import cv2
 import streamlit as st
 from PIL import Image
 import numpy as np
-from detect_tray import perspective_tray, crop_cell
-from cnn_classification import CNNFoodClassifier
-from infer_bill import BillGenerator
+import metrics
+from detect_tray import load_image
+from empty_cell import load_detector
+from ledger import SalesLedger
+from pipeline import TrayPipeline, DiskSink, BILL_DIR
 
 # Cấu hình kích thước hiển thị
 ORIGINAL_MAX_WIDTH = 500   # tối đa width cho ảnh gốc khi hiển thị
 FIXED_MAX_WIDTH = 500      # tối đa width cho ảnh sau khi chỉnh phối cảnh
+MAX_CACHED_TRAYS = 8       # số khay giữ lại kết quả trong phiên (LRU)
 
 # Hàm hỗ trợ resize ảnh để hiển thị (giữ tỉ lệ)
 def pil_resize_for_display(pil_img: Image.Image, max_width: int) -> Image.Image:
@@ -48,26 +53,54 @@ st.markdown("---")
 
 # Tải mô hình
 @st.cache_resource
-def load_models():
-    classifier = CNNFoodClassifier()
-    bill_gen = BillGenerator()
-    return classifier, bill_gen
-
-classifier, bill_gen = load_models()
+def load_pipeline():
+    # Chỉ lưu hóa đơn PDF ra đĩa; ảnh tải lên và các ô cắt được xử lý trong bộ nhớ
+    return TrayPipeline(sink=DiskSink(bill_dir=BILL_DIR), empty_detector=load_detector(),
+                        ledger=SalesLedger(batch_size=1))
+
+pipeline = load_pipeline()
+
+def run_cached(img_bytes: bytes):
+    """Chạy pipeline một lần cho mỗi ảnh (khóa theo hash nội dung), tái sử dụng khi Streamlit chạy lại script.
+
+    Trả về (ảnh gốc thu nhỏ để hiển thị, kết quả pipeline); ảnh chỉ được giải mã một lần, ở độ phân giải giảm.
+    """
+    cache = st.session_state.setdefault("tray_cache", OrderedDict())
+    key = hashlib.sha1(img_bytes).hexdigest()
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    raw = load_image(img_bytes)
+    if raw is None:
+        return None, None
+    display = pil_resize_for_display(cv2_to_pil(raw), ORIGINAL_MAX_WIDTH)
+    result = pipeline.run(raw)
+    if result is not None:
+        # Tạo sẵn bytes PDF trên luồng nền, không chặn giao diện; chỉ lưu và ghi sổ khi bấm xuất hóa đơn
+        result["pdf_future"] = pipeline.submit_pdf(result["bill"], issue=False)
+    cache[key] = (display, result)
+    while len(cache) > MAX_CACHED_TRAYS:
+        cache.popitem(last=False)   # bỏ khay cũ nhất
+    return display, result
+
+# Số liệu hiệu năng từng stage: cờ dùng chung cho cả tiến trình nên chỉ bật phía máy chủ
+# (FOOD_METRICS=1 streamlit run app_streamlit.py), giao diện chỉ đọc trạng thái
+show_metrics = metrics.ENABLED
+if not show_metrics:
+    st.sidebar.caption("📊 Số liệu hiệu năng đang tắt (bật bằng biến môi trường FOOD_METRICS=1).")
 
 # Chọn nguồn ảnh: upload hoặc webcam
 st.subheader("Chọn nguồn ảnh")
 mode = st.radio("Nguồn ảnh", ("Tải ảnh lên", "Webcam"))
 
-img_path = None
+img_bytes = None
 
 if mode == "Tải ảnh lên":
     st.info("Tải ảnh khay cơm lên với định dạng .jpg/.jpeg/.png, đảm bảo ảnh chụp rõ nét, đủ sáng và ít nhất 3 góc khay nằm trong khung.")
     uploaded_file = st.file_uploader("📁 Tải ảnh khay cơm:", type=["jpg", "jpeg", "png"])
     if uploaded_file:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            tmp.write(uploaded_file.read())
-            img_path = tmp.name
+        img_bytes = uploaded_file.getvalue()
 
 else:  # Webcam
     st.info("Sử dụng webcam: Chụp ảnh khay cơm rõ nét, đủ sáng và ít nhất 3 góc khay nằm trong khung.")
@@ -89,27 +122,25 @@ else:  # Webcam
     )
     cam_file = st.camera_input("📷 Chụp ảnh khay bằng webcam")
     if cam_file:
-        # cam_file giống file-like; lưu tạm để dùng chung pipeline
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            tmp.write(cam_file.getvalue())
-            img_path = tmp.name
+        # cam_file giống file-like; dùng chung pipeline với bytes trong bộ nhớ
+        img_bytes = cam_file.getvalue()
 
 # Nếu có ảnh thì xử lý pipeline như trước
-if img_path:
-    # Hiển thị ảnh gốc (đã resize)
-    try:
-        pil_orig = Image.open(img_path).convert("RGB")
-        pil_small = pil_resize_for_display(pil_orig, ORIGINAL_MAX_WIDTH)
-        st.image(pil_small, caption="Ảnh khay gốc", use_container_width=False)
-    except Exception:
-        st.image(img_path, caption="Ảnh khay gốc", use_container_width=True)
-
-    # Bước 1: Phát hiện & chỉnh phối cảnh
+if img_bytes:
+    # Bước 1-3: Phát hiện khay, cắt 5 ô và phân loại (một lượt pipeline, có cache theo ảnh)
+    pil_small, result = run_cached(img_bytes)
+    if pil_small is None:
+        st.error("❌ Không thể đọc ảnh đầu vào.")
+        st.stop()
+
+    # Hiển thị ảnh gốc (dùng lại ảnh đã giải mã cho pipeline)
+    st.image(pil_small, caption="Ảnh khay gốc", use_container_width=False)
+
     st.subheader("1️⃣ Nhận diện khay cơm")
-    fixed_img = perspective_tray(img_path)
-    if fixed_img is None:
+    if result is None:
         st.error("❌ Không thể nhận diện được khay. Vui lòng thử lại ảnh khác.")
         st.stop()
+    fixed_img = result["tray"]
 
     # Chuyển OpenCV -> PIL và resize trước khi hiển thị
     pil_fixed = cv2_to_pil(fixed_img)
@@ -118,10 +149,7 @@ if img_path:
 
     # Bước 2: Cắt 5 ô
     st.subheader("2️⃣ Cắt các ô thức ăn")
-    crops = crop_cell(fixed_img)
-    if not crops:
-        st.error("❌ Không thể cắt được 5 ô. Hãy chụp lại ảnh rõ khay hơn.")
-        st.stop()
+    crops = result["crops"]
 
     cols = st.columns(5)
     for i, (name, crop) in enumerate(crops.items()):
@@ -130,37 +158,42 @@ if img_path:
 
     # Bước 3: Phân loại từng ô
     st.subheader("3️⃣ Kết quả phân loại món ăn bằng mô hình CNN")
-    results = []
     result_cols = st.columns(5)
 
-    for i, (name, crop) in enumerate(crops.items()):
-        tmp_crop = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-        cv2.imwrite(tmp_crop.name, crop)
-        pred = classifier.predict_image(tmp_crop.name)
-        results.append(pred)
-
+    for i, (crop, pred) in enumerate(zip(crops.values(), result["predictions"])):
         with result_cols[i % 5]:
             st.image(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB), caption=f"{pred['predicted_class']}", use_container_width=True)
             st.metric("Độ tin cậy", f"{pred['confidence']*100:.1f}%")
 
     # Bước 4: Tạo hóa đơn PDF
     st.subheader("4️⃣ Tạo hóa đơn thanh toán")
+    st.metric("Tổng cộng", f"{result['bill']['total']:,} VND")
 
     if st.button("🧾 Tạo & tải hóa đơn PDF"):
         with st.spinner("Đang tạo hóa đơn..."):
-            bill, pdf_path = bill_gen.generate_bill_from_predictions(results)
-            with open(pdf_path, "rb") as f:
-                pdf_bytes = f.read()
+            pdf_bytes, _ = result["pdf_future"].result()
+            if "pdf_path" not in result:
+                # Mỗi khay chỉ xuất (lưu file + ghi sổ) một lần dù bấm lại nhiều lần
+                result["pdf_path"] = pipeline.issue_bill(result["bill"], pdf_bytes)
+            pdf_path = result["pdf_path"]
+            file_name = os.path.basename(pdf_path) if pdf_path else \
+                f"bill_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
 
             st.success("✅ Hóa đơn đã được tạo thành công!")
             st.download_button(
                 label="📥 Tải hóa đơn PDF",
                 data=pdf_bytes,
-                file_name=os.path.basename(pdf_path),
+                file_name=file_name,
                 mime="application/pdf"
             )
 
             st.info("Hóa đơn cũng được lưu trong thư mục `bills/` của dự án.")
 
+if show_metrics:
+    with st.expander("📊 Số liệu hiệu năng từng stage"):
+        st.json(metrics.snapshot())
+        st.download_button("📥 Tải số liệu (Prometheus)", data=metrics.to_prometheus(),
+                           file_name="metrics.prom", mime="text/plain")
+
 st.markdown("---")
 st.caption("© 2025 UEH Smart Canteen | Đồ án môn Trí tuệ nhân tạo của nhóm sinh viên 3I")
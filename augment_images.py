@@ -1,52 +1,172 @@
 import os
-from tensorflow.keras.preprocessing.image import ImageDataGenerator, img_to_array, load_img
+import json
+import zlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
 
-# Cấu hình các tham số augment
-datagen = ImageDataGenerator(
+# Cấu hình các tham số augment (giống ImageDataGenerator trước đây)
+AUG_PARAMS = dict(
     rotation_range=20,
     width_shift_range=0.2,
     height_shift_range=0.2,
     shear_range=0.15,
     zoom_range=0.1,
     horizontal_flip=True,
-    fill_mode='nearest'
 )
 
-# Đường dẫn dữ liệu gốc và nơi lưu ảnh mới
-base_dir = './data'
-output_dir = './data_augmented'
-os.makedirs(output_dir, exist_ok=True)
-
-# Lặp qua từng lớp (folder con)
-for class_name in os.listdir(base_dir):
-    class_path = os.path.join(base_dir, class_name)
-    if not os.path.isdir(class_path):
-        continue  # bỏ qua file lạ nếu có
-    
-    # Tạo folder đích cho lớp đó
-    save_path = os.path.join(output_dir, class_name)
-    os.makedirs(save_path, exist_ok=True)
-    
-    # Duyệt qua từng ảnh trong lớp
-    for img_name in os.listdir(class_path):
-        if not img_name.lower().endswith(('.jpg', '.jpeg', '.png')):
+IMG_SIZE = (128, 128)
+PER_IMAGE = 5          # số ảnh mới cho mỗi ảnh gốc
+SEED = 123
+SHARD_SIZE = 2048      # số ảnh mỗi shard .npy
+INDEX_FILE = "index.json"
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+
+def random_transform(img, rng, params=AUG_PARAMS):
+    '''Biến đổi affine ngẫu nhiên (xoay, dịch, trượt, zoom, lật) bằng OpenCV, viền lấp kiểu "nearest"'''
+    h, w = img.shape[:2]
+    theta = np.deg2rad(rng.uniform(-params['rotation_range'], params['rotation_range']))
+    tx = rng.uniform(-params['width_shift_range'], params['width_shift_range']) * w
+    ty = rng.uniform(-params['height_shift_range'], params['height_shift_range']) * h
+    shear = np.deg2rad(rng.uniform(-params['shear_range'], params['shear_range']))
+    zx, zy = rng.uniform(1 - params['zoom_range'], 1 + params['zoom_range'], 2)
+    flip = params['horizontal_flip'] and rng.random() < 0.5
+
+    # Ma trận tổng hợp quanh tâm ảnh: dịch * xoay * trượt * zoom
+    rotate = np.array([[np.cos(theta), -np.sin(theta), 0], [np.sin(theta), np.cos(theta), 0], [0, 0, 1]])
+    shift = np.array([[1, 0, tx], [0, 1, ty], [0, 0, 1]])
+    shear_m = np.array([[1, -np.sin(shear), 0], [0, np.cos(shear), 0], [0, 0, 1]])
+    zoom = np.array([[zx, 0, 0], [0, zy, 0], [0, 0, 1]])
+    center = np.array([[1, 0, w / 2], [0, 1, h / 2], [0, 0, 1]])
+    uncenter = np.array([[1, 0, -w / 2], [0, 1, -h / 2], [0, 0, 1]])
+    matrix = center @ shift @ rotate @ shear_m @ zoom @ uncenter
+
+    out = cv2.warpAffine(img, matrix[:2], (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return out[:, ::-1] if flip else out
+
+def image_seed(key, seed=SEED):
+    '''Seed cố định cho từng ảnh gốc để kết quả tái lập được'''
+    return zlib.crc32(f"{seed}:{key}".encode("utf-8"))
+
+def augment_one(task):
+    '''Chạy trong tiến trình con: đọc ảnh gốc và sinh PER_IMAGE ảnh augment (RGB uint8)'''
+    key, img_path, per_image, seed = task
+    img = cv2.imread(img_path)
+    if img is None:
+        return key, None
+    img = cv2.cvtColor(cv2.resize(img, IMG_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+    rng = np.random.default_rng(image_seed(key, seed))
+    return key, np.stack([random_transform(img, rng) for _ in range(per_image)])
+
+def scan_sources(base_dir):
+    '''Liệt kê ảnh gốc theo lớp: {key "lớp/tên_ảnh": (tên lớp, đường dẫn, dấu vân tay mtime+size)}'''
+    sources = {}
+    for class_name in sorted(os.listdir(base_dir)):
+        class_path = os.path.join(base_dir, class_name)
+        if not os.path.isdir(class_path):
+            continue  # bỏ qua file lạ nếu có
+        for img_name in sorted(os.listdir(class_path)):
+            if not img_name.lower().endswith(IMAGE_EXTS):
+                continue
+            img_path = os.path.join(class_path, img_name)
+            st = os.stat(img_path)
+            sources[f"{class_name}/{img_name}"] = (class_name, img_path, f"{st.st_mtime_ns}-{st.st_size}")
+    return sources
+
+def load_index(output_dir):
+    path = os.path.join(output_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return {"img_size": list(IMG_SIZE), "classes": [], "shards": [], "sources": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_index(output_dir, index):
+    path = os.path.join(output_dir, INDEX_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def write_shard(output_dir, index, images, labels, pending):
+    '''Ghi một shard (ảnh uint8 + nhãn) và cập nhật index cho các ảnh gốc trong shard'''
+    shard_id = len(index["shards"])
+    name = f"shard_{shard_id:05d}"
+    np.save(os.path.join(output_dir, name + ".npy"), np.stack(images))
+    np.save(os.path.join(output_dir, name + "_labels.npy"), np.asarray(labels, dtype=np.int16))
+    index["shards"].append({"file": name + ".npy", "labels": name + "_labels.npy", "count": len(images)})
+    for key, fingerprint, start, count in pending:
+        index["sources"][key] = {"fingerprint": fingerprint, "shard": shard_id, "start": start, "count": count}
+    save_index(output_dir, index)
+
+def open_shards(output_dir, class_names=None, keep_sources=None):
+    '''Mở các shard dạng memmap để huấn luyện đọc trực tiếp
+
+    Trả về list (ảnh memmap, nhãn, chỉ số hàng còn hiệu lực) cho từng shard.
+    class_names: thứ tự lớp mong muốn (vd class_names.json); mặc định theo index.
+    keep_sources: tập key "lớp/tên_ảnh" được dùng (vd chỉ ảnh thuộc tập train); None = tất cả.
+    '''
+    index = load_index(output_dir)
+    classes = index["classes"]
+    remap = np.arange(len(classes)) if class_names is None else \
+        np.array([list(class_names).index(c) for c in classes])
+
+    # Chỉ giữ các hàng đang được index tham chiếu (ảnh gốc bị sửa/xóa sẽ bị loại)
+    live = [[] for _ in index["shards"]]
+    for key, entry in index["sources"].items():
+        if keep_sources is not None and key not in keep_sources:
             continue
+        live[entry["shard"]].extend(range(entry["start"], entry["start"] + entry["count"]))
+
+    shards = []
+    for shard, rows in zip(index["shards"], live):
+        images = np.load(os.path.join(output_dir, shard["file"]), mmap_mode="r")
+        labels = remap[np.load(os.path.join(output_dir, shard["labels"]))]
+        shards.append((images, labels, np.sort(np.asarray(rows, dtype=np.int64))))
+    return shards
+
+def main():
+    parser = argparse.ArgumentParser(description="Augment song song ảnh món ăn, ghi thành các shard .npy")
+    parser.add_argument("--data", default="./data", help="Thư mục dữ liệu gốc (mỗi lớp một thư mục con)")
+    parser.add_argument("--output", default="./data_augmented", help="Thư mục lưu shard + index.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--per-image", type=int, default=PER_IMAGE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    # Đường dẫn dữ liệu gốc và nơi lưu ảnh mới
+    os.makedirs(args.output, exist_ok=True)
+    index = load_index(args.output)
+    sources = scan_sources(args.data)
+
+    # Chỉ augment ảnh gốc mới hoặc đã thay đổi
+    todo = [(key, path, args.per_image, args.seed) for key, (_, path, fp) in sources.items()
+            if index["sources"].get(key, {}).get("fingerprint") != fp]
+    for key in set(index["sources"]) - set(sources):
+        del index["sources"][key]   # ảnh gốc đã bị xóa
+    for class_name, _, _ in sources.values():
+        if class_name not in index["classes"]:
+            index["classes"].append(class_name)
+    print(f"📂 {len(sources)} ảnh gốc, cần augment {len(todo)} ảnh (x{args.per_image})")
+
+    images, labels, pending = [], [], []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for key, aug in pool.map(augment_one, todo, chunksize=16):
+            if aug is None:
+                print(f"⚠️ Không đọc được ảnh: {key}")
+                continue
+            class_name, _, fp = sources[key]
+            pending.append((key, fp, len(images), len(aug)))
+            images.extend(aug)
+            labels.extend([index["classes"].index(class_name)] * len(aug))
+            if len(images) >= SHARD_SIZE:
+                write_shard(args.output, index, images, labels, pending)
+                images, labels, pending = [], [], []
+    if images:
+        write_shard(args.output, index, images, labels, pending)
+    else:
+        save_index(args.output, index)
+
+    print(f"Hoàn thành! Các ảnh mới tạo được lưu tại {args.output} ({len(index['shards'])} shard)")
 
-        img_path = os.path.join(class_path, img_name)
-        img = load_img(img_path, target_size=(128,128))
-        x = img_to_array(img)
-        x = x.reshape((1,) + x.shape)
-
-        # Sinh ra 5 ảnh mới và lưu
-        i = 0
-        for batch in datagen.flow(
-            x, batch_size=1, 
-            save_to_dir=save_path,
-            save_prefix='aug', 
-            save_format='jpg'
-        ):
-            i += 1
-            if i >= 5:  # tạo 5 ảnh mới cho mỗi ảnh gốc
-                break
-
-print("Hoàn thành! Các ảnh mới tạo được lưu tại ./data_augmented")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from detect_tray import perspective_tray, crop_cell
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff")
+
+def list_images(input_dir):
+    '''Liệt kê (có sắp xếp) mọi ảnh khay trong thư mục và các thư mục con'''
+    paths = []
+    for root, _, files in os.walk(input_dir):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTS))
+    return sorted(paths)
+
+def load_done(output_path):
+    '''Đọc file JSONL đã có để tiếp tục từ chỗ dừng (bỏ qua dòng ghi dở)'''
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["image"])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+def detect_and_crop(img_path):
+    '''Chạy trong tiến trình con: chỉnh phối cảnh + cắt ô, trả về dict ô hoặc None
+
+    Chỉ trả về các ô (không trả lại đầu vào) để không phải pickle lại ảnh/bytes gốc từ tiến trình con.
+    Ô giữ nguyên kích thước gốc để mô hình tiền xử lý giống hệt TrayPipeline.run
+    (và mô hình lớn của cascade nhận ô đủ độ phân giải).
+    '''
+    fixed = perspective_tray(img_path)
+    if fixed is None:
+        return None
+    return crop_cell(fixed)
+
+def iter_detected(paths, workers, max_in_flight):
+    '''Chạy detect_and_crop song song trên nhiều lõi, giới hạn số tác vụ đang chờ để tiết kiệm RAM
+
+    Trả về từng (đường dẫn, ô hoặc None, lỗi hoặc None); ảnh lỗi chỉ tính là một ảnh hỏng, không dừng cả lượt.
+    '''
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending = {}
+        it = iter(paths)
+        for path in it:
+            pending[pool.submit(detect_and_crop, path)] = path
+            if len(pending) >= max_in_flight:
+                break
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                path = pending.pop(fut)
+                try:
+                    yield path, fut.result(), None
+                except Exception as e:
+                    print(f"❌ Lỗi xử lý ảnh {path}: {e}")
+                    yield path, None, f"{type(e).__name__}: {e}"
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending[pool.submit(detect_and_crop, nxt)] = nxt
+
+def main():
+    parser = argparse.ArgumentParser(description="Xử lý hàng loạt thư mục ảnh khay cơm, xuất kết quả JSONL")
+    parser.add_argument("input_dir", help="Thư mục chứa ảnh khay (quét cả thư mục con)")
+    parser.add_argument("--output", default="predictions.jsonl", help="File JSONL kết quả (ghi nối tiếp)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Số tiến trình OpenCV")
+    parser.add_argument("--batch-trays", type=int, default=16, help="Số khay gộp cho một lượt chạy mô hình")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--restart", action="store_true", help="Bỏ kết quả cũ, xử lý lại từ đầu")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = load_done(args.output)
+    paths = [p for p in list_images(args.input_dir) if p not in done]
+    print(f"📂 {len(paths)} ảnh cần xử lý ({len(done)} ảnh đã có trong {args.output})")
+    if not paths:
+        return
+
+    from cnn_classification import CNNFoodClassifier
+    from infer_bill import BillGenerator
+    classifier = CNNFoodClassifier()
+    bill_gen = BillGenerator()
+
+    n_ok = n_fail = 0
+    start = time.perf_counter()
+    batch = []
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        def flush():
+            nonlocal n_ok
+            if not batch:
+                return
+            results = classifier.predict_trays([crops for _, crops in batch], top_k=args.top_k)
+            for (img_path, _), predictions in zip(batch, results):
+                bill = bill_gen.calculate_bill(predictions)
+                out.write(json.dumps({"image": img_path, "predictions": predictions, "bill": bill},
+                                     ensure_ascii=False) + "\n")
+            out.flush()
+            n_ok += len(batch)
+            batch.clear()
+
+        for img_path, crops, error in iter_detected(paths, args.workers, args.workers * 4):
+            if crops is None:
+                out.write(json.dumps({"image": img_path, "error": error or "tray_not_found"},
+                                     ensure_ascii=False) + "\n")
+                n_fail += 1
+                continue
+            batch.append((img_path, crops))
+            if len(batch) >= args.batch_trays:
+                flush()
+                elapsed = time.perf_counter() - start
+                print(f"  ... {n_ok + n_fail}/{len(paths)} khay ({(n_ok + n_fail) / elapsed:.1f} khay/giây)")
+        flush()
+
+    elapsed = time.perf_counter() - start
+    print("\n✅ Hoàn thành xử lý hàng loạt:")
+    print(f" + Thành công: {n_ok} khay, không nhận diện được/lỗi: {n_fail} khay")
+    print(f" + Thời gian: {elapsed:.1f} giây — {(n_ok + n_fail) / elapsed:.2f} khay/giây")
+    print(f" + Kết quả: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+import cv2
+import numpy as np
+import infer_bill
+from detect_tray import load_image, perspective_tray, crop_cell
+from cnn_classification import CNNFoodClassifier
+from infer_bill import BillGenerator
+
+HERE = Path(__file__).parent
+RESOLUTIONS = [(800, 600), (1920, 1080), (4000, 3000)]
+DEFAULT_TOLERANCE = 0.25   # cho phép chậm hơn / tốn bộ nhớ hơn baseline tối đa 25%
+PEAK_SLACK_MB = 0.5        # bỏ qua dao động bộ nhớ nhỏ ở các stage gần như không cấp phát
+
+class StubBackend:
+    """Mô hình giả lập rất nhỏ (một phép nhân ma trận) để đo benchmark không cần TensorFlow"""
+
+    def __init__(self, num_classes, img_size=(128, 128), seed=0):
+        self.img_size = img_size
+        self.weights = np.random.default_rng(seed).normal(size=(3 * 16, num_classes)).astype(np.float32)
+
+    def __call__(self, batch):
+        feats = batch.reshape(len(batch), 16, -1, 3).mean(axis=2).reshape(len(batch), -1) / 255.0
+        logits = feats @ self.weights
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+def make_synthetic_tray(width, height, seed=0):
+    '''Vẽ ảnh khay cơm giả lập bằng OpenCV: khay sáng 5 ô (3 trên, 2 dưới) trên nền tối, hơi lệch phối cảnh'''
+    rng = np.random.default_rng(seed)
+    img = rng.integers(30, 70, size=(height, width, 3), dtype=np.uint8)
+
+    # 4 đỉnh khay lệch nhẹ so với hình chữ nhật
+    mx, my = width * 0.1, height * 0.1
+    jitter = lambda: rng.uniform(-0.02, 0.02) * width
+    corners = np.float32([[mx + jitter(), my + jitter()], [width - mx + jitter(), my + jitter()],
+                          [width - mx + jitter(), height - my + jitter()], [mx + jitter(), height - my + jitter()]])
+    tray_w, tray_h = 800, 600
+    tray = np.full((tray_h, tray_w, 3), 200, np.uint8)
+    thickness = 6
+    for x in (266, 532):
+        cv2.line(tray, (x, 0), (x, 250), (150, 150, 150), thickness)
+    cv2.line(tray, (0, 250), (800, 250), (150, 150, 150), thickness)
+    cv2.line(tray, (400, 250), (400, 600), (150, 150, 150), thickness)
+    for cx, cy in [(133, 125), (399, 125), (666, 125), (200, 425), (600, 425)]:
+        color = tuple(int(c) for c in rng.integers(40, 230, 3))
+        cv2.ellipse(tray, (cx, cy), (int(rng.integers(50, 90)), int(rng.integers(40, 80))), 0, 0, 360, color, -1)
+
+    matrix = cv2.getPerspectiveTransform(np.float32([[0, 0], [tray_w, 0], [tray_w, tray_h], [0, tray_h]]), corners)
+    warped = cv2.warpPerspective(tray, matrix, (width, height))
+    mask = cv2.warpPerspective(np.full((tray_h, tray_w), 255, np.uint8), matrix, (width, height))
+    img[mask > 0] = warped[mask > 0]
+    return img
+
+def measure(fn, repeats=20, warmup=2):
+    '''Đo độ trễ p50/p95 (ms) và bộ nhớ đỉnh (MB, tracemalloc) của một stage'''
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    # Đo bộ nhớ ở một lượt riêng để tracemalloc không làm sai lệch thời gian
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "peak_mb": peak / 2**20
+    }
+
+def run_suite(repeats=20):
+    '''Chạy benchmark mọi stage trên ảnh giả lập ở nhiều độ phân giải (hoàn toàn offline)'''
+    class_path = HERE / "class_names.json"
+    with open(class_path, "r", encoding="utf-8") as f:
+        num_classes = len(json.load(f))
+    classifier = CNNFoodClassifier(class_path=class_path, backend=StubBackend(num_classes))
+    bill_gen = BillGenerator(menu_path=HERE / "menu.json", logo_path=HERE / "logo.jpg",
+                             vn_labels_path=HERE / "VN_labels.json", qr_http_fallback=False)
+
+    results = {}
+    for width, height in RESOLUTIONS:
+        tag = f"{width}x{height}"
+        raw = make_synthetic_tray(width, height)
+        encoded = cv2.imencode(".jpg", raw)[1].tobytes()
+        fixed = perspective_tray(raw)
+        if fixed is None:
+            raise RuntimeError(f"Không nhận diện được khay giả lập {tag}")
+
+        results[f"decode@{tag}"] = measure(lambda: cv2.imdecode(np.frombuffer(encoded, np.uint8), cv2.IMREAD_COLOR), repeats)
+        results[f"decode_reduced@{tag}"] = measure(lambda: load_image(encoded), repeats)
+        results[f"perspective_tray@{tag}"] = measure(lambda: perspective_tray(raw), repeats)
+        results[f"perspective_tray_bytes_full@{tag}"] = measure(lambda: perspective_tray(encoded, target_side=None), repeats)
+        results[f"perspective_tray_bytes@{tag}"] = measure(lambda: perspective_tray(encoded), repeats)
+
+    crops = crop_cell(fixed)
+    predictions = classifier.predict_batch(crops)
+    bill = bill_gen.calculate_bill(predictions)
+
+    results["crop_cell"] = measure(lambda: crop_cell(fixed), repeats)
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp_dir:
+        cell_path = os.path.join(tmp_dir, "cell_1.jpg")
+        cv2.imwrite(cell_path, next(iter(crops.values())))
+        results["predict_image"] = measure(lambda: classifier.predict_image(cell_path), repeats)
+    results["predict_batch"] = measure(lambda: classifier.predict_batch(crops), repeats)
+    results["calculate_bill"] = measure(lambda: bill_gen.calculate_bill(predictions), repeats)
+    results["generate_pdf"] = measure(lambda: bill_gen.generate_pdf(bill, BytesIO()), repeats)
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''So sánh p50 và bộ nhớ đỉnh với baseline; trả về (stage, chỉ số, baseline, hiện tại) vượt ngưỡng'''
+    regressions = []
+    for stage, base in baseline.items():
+        cur = results.get(stage)
+        if cur is None:
+            continue
+        if cur["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+            regressions.append((stage, "p50_ms", base["p50_ms"], cur["p50_ms"]))
+        if "peak_mb" in base and cur["peak_mb"] > base["peak_mb"] * (1 + tolerance) + PEAK_SLACK_MB:
+            regressions.append((stage, "peak_mb", base["peak_mb"], cur["peak_mb"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ và bộ nhớ từng stage của pipeline (offline)")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--output", default="bench_results.json", help="File JSON kết quả")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="File baseline để so sánh")
+    parser.add_argument("--save-baseline", action="store_true", help="Ghi kết quả hiện tại làm baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    # Chặn mọi truy cập mạng khi tạo QR: benchmark phải chạy được offline
+    with mock.patch.object(infer_bill, "_fetch_vietqr_png", side_effect=RuntimeError("QR fetch bị chặn trong benchmark")):
+        results = run_suite(args.repeats)
+
+    print(f"{'Stage':<32}{'p50 (ms)':>10}{'p95 (ms)':>10}{'peak (MB)':>11}")
+    for stage, r in results.items():
+        print(f"{stage:<32}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['peak_mb']:>11.2f}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Đã lưu baseline tại: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\n⚠️ Chưa có baseline ({args.baseline}); chạy với --save-baseline để tạo.")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"\n❌ Phát hiện {len(regressions)} chỉ số tệ hơn baseline quá {args.tolerance:.0%}:")
+        for stage, metric, base, cur in regressions:
+            unit = "ms" if metric == "p50_ms" else "MB"
+            change = f" ({cur / base - 1:+.0%})" if base else ""
+            print(f" + {stage} [{metric}]: {base:.2f} {unit} -> {cur:.2f} {unit}{change}")
+        raise SystemExit(1)
+    print("\n✅ Không có stage nào chậm hơn hoặc tốn bộ nhớ hơn baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import time
+import random
+import argparse
+from io import BytesIO
+from pathlib import Path
+from infer_bill import BillGenerator
+
+HERE = Path(__file__).parent
+
+def make_bills(bill_gen, n, seed=0):
+    '''Sinh n hóa đơn giả lập, mỗi hóa đơn 5 món ngẫu nhiên từ menu'''
+    rng = random.Random(seed)
+    classes = list(bill_gen.menu.keys())
+    bills = []
+    for _ in range(n):
+        preds = [{"predicted_class": rng.choice(classes), "confidence": rng.uniform(0.5, 1.0)}
+                 for _ in range(5)]
+        bills.append(bill_gen.calculate_bill(preds))
+    return bills
+
+def bench_single(bill_gen, bills, rebuild_template=False):
+    '''Tạo từng PDF riêng lẻ; rebuild_template=True mô phỏng cách cũ (dựng lại toàn bộ mỗi lần)'''
+    start = time.perf_counter()
+    for bill in bills:
+        if rebuild_template:
+            bill_gen._template = None
+        bill_gen.generate_pdf(bill, BytesIO())
+    return len(bills) / (time.perf_counter() - start)
+
+def bench_bulk(bill_gen, bills):
+    '''Tạo một PDF nhiều trang cho tất cả hóa đơn bằng một lần doc.build'''
+    start = time.perf_counter()
+    bill_gen.generate_bulk_pdf(bills, BytesIO())
+    return len(bills) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo tốc độ tạo hóa đơn PDF (hóa đơn/giây)")
+    parser.add_argument("-n", type=int, default=200, help="Số hóa đơn mỗi lượt đo")
+    args = parser.parse_args()
+
+    bill_gen = BillGenerator(menu_path=HERE / "menu.json", logo_path=HERE / "logo.jpg",
+                             vn_labels_path=HERE / "VN_labels.json", qr_http_fallback=False)
+    bills = make_bills(bill_gen, args.n)
+    bench_single(bill_gen, bills[:5])   # làm nóng font/cache QR
+
+    before = bench_single(bill_gen, bills, rebuild_template=True)
+    after = bench_single(bill_gen, bills)
+    bulk = bench_bulk(bill_gen, bills)
+
+    print(f"Số hóa đơn: {args.n}")
+    print(f" + Trước (dựng lại toàn bộ mỗi hóa đơn): {before:8.1f} hóa đơn/giây")
+    print(f" + Sau (dùng template dựng sẵn):         {after:8.1f} hóa đơn/giây ({after / before:.2f}x)")
+    print(f" + In hàng loạt (một file nhiều trang):  {bulk:8.1f} hóa đơn/giây ({bulk / before:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import os
+import argparse
+import cv2
+import numpy as np
+import metrics
+from detect_tray import OUT_SIZE, load_image, find_tray_corners, tray_homography, cell_rects, crop_cell
+
+CALIB_PATH = "./calibration/fixed_camera.npz"
+
+# Ảnh thu nhỏ để kiểm tra lệch camera: chỉ so sánh dải biên quanh mép khay
+DRIFT_THUMB_WIDTH = 160
+DRIFT_BAND = 4
+
+def edge_thumb(frame):
+    '''Độ lớn gradient trên ảnh thu nhỏ (ít phụ thuộc độ sáng hơn so với giá trị điểm ảnh)'''
+    h, w = frame.shape[:2]
+    size = (DRIFT_THUMB_WIDTH, max(1, round(h * DRIFT_THUMB_WIDTH / w)))
+    gray = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    gray = cv2.GaussianBlur(gray, (3, 3), 0)
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1)
+    return np.abs(gx) + np.abs(gy)
+
+def edge_band(edges, frame_shape, corners):
+    '''Mặt nạ dải biên quanh 4 cạnh khay trên ảnh gradient thu nhỏ'''
+    scale = edges.shape[1] / frame_shape[1]
+    band = np.zeros(edges.shape, np.uint8)
+    cv2.polylines(band, [np.int32(np.round(np.float32(corners) * scale))], True, 255, 2 * DRIFT_BAND + 1)
+    return band > 0
+
+def edge_corr(ref_edges, cur_edges):
+    '''Hệ số tương quan (-1..1) giữa hai dãy độ lớn biên lấy trong cùng một dải'''
+    a, b = ref_edges - ref_edges.mean(), cur_edges - cur_edges.mean()
+    denom = np.sqrt((a * a).sum() * (b * b).sum())
+    return float((a * b).sum() / denom) if denom > 0 else 0.0
+
+def _cell_maps(matrix, out_size):
+    '''Bảng remap (điểm cố định CV_16SC2) từ ảnh camera thẳng tới từng ô của khay đã chỉnh phối cảnh'''
+    inverse = np.linalg.inv(matrix)
+    maps = {}
+    for name, (x0, y0, x1, y1) in cell_rects(out_size).items():
+        xs, ys = np.meshgrid(np.arange(x0, x1, dtype=np.float64), np.arange(y0, y1, dtype=np.float64))
+        src = inverse @ np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)])
+        map_x = (src[0] / src[2]).reshape(xs.shape).astype(np.float32)
+        map_y = (src[1] / src[2]).reshape(xs.shape).astype(np.float32)
+        maps[name] = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    return maps
+
+class TrayCalibration:
+    """Hiệu chuẩn camera cố định: homography khay + bảng remap từng ô + mẫu biên để phát hiện lệch"""
+
+    def __init__(self, corners, frame_shape, out_size=OUT_SIZE, min_corr=0.6, maps=None, band=None, ref_edges=None):
+        self.corners = np.float32(corners)
+        self.frame_shape = tuple(int(v) for v in frame_shape[:2])
+        self.out_size = tuple(int(v) for v in out_size)
+        self.min_corr = min_corr
+        self.matrix = tray_homography(self.corners, self.out_size)
+        self.maps = maps if maps is not None else _cell_maps(self.matrix, self.out_size)
+        self.band = band
+        self.ref_edges = ref_edges
+
+    @classmethod
+    def from_frame(cls, frame, out_size=OUT_SIZE, min_corr=0.6):
+        '''Dò khay một lần trên khung hình mẫu; None nếu không tìm được khay'''
+        corners = find_tray_corners(frame)
+        if corners is None:
+            return None
+        return cls.from_corners(frame, corners, out_size, min_corr)
+
+    @classmethod
+    def from_corners(cls, frame, corners, out_size=OUT_SIZE, min_corr=0.6):
+        '''Hiệu chuẩn từ 4 đỉnh khay đã dò trên khung hình (dựng bảng remap và mẫu biên)'''
+        calib = cls(corners, frame.shape, out_size, min_corr)
+        calib._set_reference(frame)
+        return calib
+
+    def _set_reference(self, frame):
+        # Dải biên quanh 4 cạnh khay trên ảnh thu nhỏ
+        edges = edge_thumb(frame)
+        self.band = edge_band(edges, frame.shape, self.corners)
+        self.ref_edges = edges[self.band]
+
+    def drift_score(self, frame):
+        '''Hệ số tương quan (-1..1) giữa biên hiện tại và biên lúc hiệu chuẩn trong dải quanh mép khay'''
+        if frame.shape[:2] != self.frame_shape:
+            return 0.0
+        return edge_corr(self.ref_edges, edge_thumb(frame)[self.band])
+
+    def matches(self, frame):
+        '''True nếu khay vẫn nằm đúng vị trí đã hiệu chuẩn'''
+        return self.drift_score(frame) >= self.min_corr
+
+    def apply(self, frame):
+        '''Chỉnh phối cảnh bằng một lần remap cho mỗi ô; trả về (khay, dict ô) như perspective_tray + crop_cell'''
+        w, h = self.out_size
+        tray = np.zeros((h, w) + frame.shape[2:], frame.dtype)
+        crops = {}
+        with metrics.timer("remap"):
+            for name, (x0, y0, x1, y1) in cell_rects(self.out_size).items():
+                map1, map2 = self.maps[name]
+                tray[y0:y1, x0:x1] = cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+                crops[name] = tray[y0:y1, x0:x1]
+        return tray, crops
+
+    def save(self, path=CALIB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {f"{kind}_{name}": m for name, pair in self.maps.items() for kind, m in zip(("map1", "map2"), pair)}
+        np.savez_compressed(path, corners=self.corners, frame_shape=np.int32(self.frame_shape),
+                            out_size=np.int32(self.out_size), min_corr=np.float32(self.min_corr),
+                            band=self.band, ref_edges=self.ref_edges, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path=CALIB_PATH):
+        with np.load(path) as data:
+            out_size = tuple(data["out_size"])
+            maps = {name: (data[f"map1_{name}"], data[f"map2_{name}"]) for name in cell_rects(out_size)}
+            return cls(data["corners"], tuple(data["frame_shape"]), out_size, float(data["min_corr"]),
+                       maps, data["band"], data["ref_edges"])
+
+class FixedCamera:
+    """Dùng hiệu chuẩn sẵn có; khi khay lệch thì dò khay + warpPerspective, lệch liên tiếp thì hiệu chuẩn lại"""
+
+    def __init__(self, calibration, path=None, recalibrate_after=3):
+        '''path: nơi lưu lại hiệu chuẩn mới (None = chỉ giữ trong bộ nhớ)'''
+        self.calibration = calibration
+        self.path = path
+        self.recalibrate_after = recalibrate_after
+        self.hits = self.misses = self.recalibrations = 0
+        self._consecutive_misses = 0
+
+    def rectify(self, frame):
+        '''Trả về (khay, dict ô) hoặc None nếu không tìm được khay'''
+        if self.calibration.matches(frame):
+            self.hits += 1
+            self._consecutive_misses = 0
+            metrics.inc("fixed_camera_total", result="hit")
+            return self.calibration.apply(frame)
+
+        self.misses += 1
+        self._consecutive_misses += 1
+        metrics.inc("fixed_camera_total", result="drift")
+        out_size = self.calibration.out_size
+        corners = find_tray_corners(frame)
+        if corners is None:
+            return None
+        if self._consecutive_misses < self.recalibrate_after:
+            # Lệch lẻ tẻ: chỉ warpPerspective một lần, không dựng bảng remap cho một khung hình
+            tray = cv2.warpPerspective(frame, tray_homography(corners, out_size), out_size)
+            return tray, crop_cell(tray)
+
+        # Lệch nhiều khung liên tiếp: camera đã bị dịch, thay hiệu chuẩn
+        calib = TrayCalibration.from_corners(frame, corners, out_size, self.calibration.min_corr)
+        print("⚠️ Camera bị lệch so với lúc hiệu chuẩn, đã hiệu chuẩn lại.")
+        self.calibration = calib
+        self.recalibrations += 1
+        self._consecutive_misses = 0
+        if self.path:
+            calib.save(self.path)
+        return calib.apply(frame)
+
+    def report(self):
+        total = self.hits + self.misses
+        return {
+            "frames": total,
+            "calibrated_hits": self.hits,
+            "drift_fallbacks": self.misses,
+            "recalibrations": self.recalibrations,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+def load_fixed_camera(path=CALIB_PATH, recalibrate_after=3):
+    '''Nạp hiệu chuẩn camera cố định nếu đã có; None nếu chưa hiệu chuẩn'''
+    if not os.path.exists(path):
+        return None
+    return FixedCamera(TrayCalibration.load(path), path, recalibrate_after)
+
+def grab_frame(source):
+    '''Lấy một khung hình từ file ảnh, camera (số) hoặc file video'''
+    if os.path.isfile(str(source)) and not str(source).lower().endswith((".mp4", ".avi", ".mov", ".mkv")):
+        return load_image(source)
+    cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    try:
+        # Bỏ vài khung đầu để camera ổn định phơi sáng
+        frame = None
+        for _ in range(10):
+            ok, img = cap.read()
+            if not ok:
+                break
+            frame = img
+        return frame
+    finally:
+        cap.release()
+
+def main():
+    parser = argparse.ArgumentParser(description="Hiệu chuẩn camera cố định: dò khay một lần, lưu homography và bảng remap")
+    parser.add_argument("--source", default="0", help="Ảnh mẫu, chỉ số camera (vd: 0) hoặc file video")
+    parser.add_argument("--output", default=CALIB_PATH)
+    parser.add_argument("--min-corr", type=float, default=0.6, help="Tương quan biên tối thiểu để coi là chưa lệch")
+    parser.add_argument("--check", default=None, help="Chỉ kiểm tra độ lệch của ảnh/khung hình này so với hiệu chuẩn")
+    args = parser.parse_args()
+
+    if args.check:
+        frame = grab_frame(args.check)
+        if frame is None:
+            print("❌ Không thể đọc khung hình!")
+            return
+        calib = TrayCalibration.load(args.output)
+        score = calib.drift_score(frame)
+        print(f"{'✅' if score >= calib.min_corr else '⚠️'} Tương quan biên: {score:.3f} (ngưỡng {calib.min_corr})")
+        return
+
+    frame = grab_frame(args.source)
+    if frame is None:
+        print("❌ Không thể đọc khung hình!")
+        return
+    calib = TrayCalibration.from_frame(frame, min_corr=args.min_corr)
+    if calib is None:
+        return
+    print(f"✅ Đã lưu hiệu chuẩn tại: {calib.save(args.output)}")
+    print(f" + Khung hình {calib.frame_shape[1]}x{calib.frame_shape[0]}, đỉnh khay: {np.round(calib.corners).astype(int).tolist()}")
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,261 @@
 import os
 import json
+import time
+import threading
+from datetime import datetime
+import cv2
 import numpy as np
-import tensorflow as tf
+import metrics
 
 BASE_DIR = "D:/IR_challenge"
 MODEL_PATH = os.path.join(BASE_DIR, "models", "cnn_food_classifier.h5")
+TFLITE_MODEL_PATH = os.path.join(BASE_DIR, "models", "cnn_food_classifier_float16.tflite")
 CLASS_NAMES_PATH = os.path.join(BASE_DIR, "models", "class_names.json")
+LARGE_MODEL_PATH = os.path.join(BASE_DIR, "models", "cnn_food_classifier_large.h5")
 
-class CNNFoodClassifier:
-    def __init__(self, model_path=MODEL_PATH, class_path=CLASS_NAMES_PATH):
+# Backend suy luận chọn qua cấu hình: "keras" (mặc định) hoặc "tflite"
+BACKEND = os.environ.get("FOOD_CLASSIFIER_BACKEND", "keras")
+
+# Cascade: ô có độ tin cậy top-1 hoặc khoảng cách top-1/top-2 thấp được chạy lại bằng mô hình lớn hơn
+FALLBACK_MODEL = os.environ.get("FOOD_FALLBACK_MODEL") or None
+MIN_CONFIDENCE = float(os.environ.get("FOOD_CASCADE_MIN_CONFIDENCE", "0.7"))
+MIN_MARGIN = float(os.environ.get("FOOD_CASCADE_MIN_MARGIN", "0.2"))
+
+def model_version(model_path):
+    '''Phiên bản mô hình = tên file + thời điểm sửa đổi (ghi vào sổ bán hàng)'''
+    try:
+        mtime = os.path.getmtime(model_path)
+    except OSError:
+        return os.path.basename(str(model_path))
+    return f"{os.path.basename(str(model_path))}@{datetime.fromtimestamp(mtime):%Y%m%d%H%M%S}"
+
+class KerasBackend:
+    """Chạy mô hình .h5 bằng TensorFlow/Keras (cần cài đủ TensorFlow)"""
+
+    def __init__(self, model_path=MODEL_PATH):
+        import tensorflow as tf
         self.model = tf.keras.models.load_model(model_path)
+        self.version = model_version(model_path)
+
+        # Kích thước đầu vào lấy từ mô hình (mặc định 128x128 như notebook)
+        input_shape = self.model.input_shape
+        self.img_size = tuple(input_shape[1:3]) if None not in input_shape[1:3] else (128, 128)
+
+        # Biên dịch một lần hàm lan truyền xuôi, chấp nhận batch có kích thước bất kỳ
+        self._forward = tf.function(
+            lambda x: self.model(x, training=False),
+            input_signature=[tf.TensorSpec([None, *self.img_size, 3], tf.float32)])
+
+    def __call__(self, batch):
+        return self._forward(batch).numpy()
+
+class TFLiteBackend:
+    """Chạy mô hình .tflite (float16/int8) bằng interpreter nhẹ, không cần nạp Keras"""
+
+    def __init__(self, model_path=TFLITE_MODEL_PATH, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=str(model_path), num_threads=num_threads or os.cpu_count())
+        self.version = model_version(model_path)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.img_size = tuple(int(v) for v in self._input["shape"][1:3])
+        self._batch_len = int(self._input["shape"][0])
+        # Interpreter không an toàn khi gọi song song từ nhiều luồng
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self._lock:
+            if len(batch) != self._batch_len:
+                self.interpreter.resize_tensor_input(self._input["index"], [len(batch), *self.img_size, 3])
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_len = len(batch)
+
+            # Lượng tử hóa đầu vào nếu mô hình dùng giao diện int8/uint8
+            dtype = self._input["dtype"]
+            if dtype in (np.int8, np.uint8):
+                scale, zero_point = self._input["quantization"]
+                info = np.iinfo(dtype)
+                batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+            self.interpreter.set_tensor(self._input["index"], batch.astype(dtype))
+            self.interpreter.invoke()
+            out = self.interpreter.get_tensor(self._output["index"])
+
+        if self._output["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = self._output["quantization"]
+            out = (out.astype(np.float32) - zero_point) * scale
+        return out
+
+def load_backend(backend=BACKEND, model_path=None):
+    '''Tạo backend suy luận theo tên cấu hình'''
+    if backend == "keras":
+        return KerasBackend(model_path or MODEL_PATH)
+    if backend == "tflite":
+        return TFLiteBackend(model_path or TFLITE_MODEL_PATH)
+    raise ValueError(f"Backend không hợp lệ: {backend} (chọn 'keras' hoặc 'tflite')")
+
+class CNNFoodClassifier:
+    def __init__(self, model_path=None, class_path=CLASS_NAMES_PATH, backend=BACKEND,
+                 fallback=FALLBACK_MODEL, min_confidence=MIN_CONFIDENCE, min_margin=MIN_MARGIN):
+        '''backend: "keras", "tflite" hoặc một đối tượng backend có sẵn (callable + img_size)
+
+        fallback: mô hình lớn cho cascade — đường dẫn .h5/.tflite hoặc đối tượng backend (None = tắt).
+        min_confidence/min_margin: ô có top-1 hoặc top-1 trừ top-2 thấp hơn ngưỡng sẽ được chạy lại.
+        '''
+        self.backend = load_backend(backend, model_path) if isinstance(backend, str) else backend
         with open(class_path, "r", encoding="utf-8") as f:
             self.class_names = json.load(f)
+        self.img_size = self.backend.img_size
+        self.model_version = getattr(self.backend, "version", type(self.backend).__name__)
 
-    def predict_image(self, image_path, img_size=(128, 128)):
-        '''Dự đoán lớp của một ảnh'''
-        img = tf.keras.utils.load_img(image_path, target_size=img_size)
-        img_array = tf.keras.utils.img_to_array(img)
-        img_array = tf.expand_dims(img_array, 0)
-        preds = self.model.predict(img_array, verbose=0)
+        if isinstance(fallback, str):
+            fallback = load_backend("tflite" if fallback.endswith(".tflite") else "keras", fallback)
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        if fallback is not None:
+            self.model_version += f"+{getattr(fallback, 'version', type(fallback).__name__)}"
+        self._stats_lock = threading.Lock()
+        self.reset_cascade_stats()
 
-        idx = np.argmax(preds[0])
-        confidence = float(preds[0][idx])
-        label = self.class_names[idx]
+    def predict_image(self, image_path, img_size=None):
+        '''Dự đoán lớp của một ảnh
+
+        img_size: (cao, rộng) để resize ảnh khi đọc, như target_size của load_img trước đây;
+        None = đưa thẳng ảnh gốc vào bước tiền xử lý của mô hình.
+        '''
+        img = cv2.imread(str(image_path))
+        if img is None:
+            raise FileNotFoundError(f"Không thể đọc ảnh: {image_path}")
+        if img_size is not None:
+            h, w = img_size
+            img = cv2.resize(img, (w, h), interpolation=cv2.INTER_LINEAR)
+        result = self.predict_batch([img], top_k=1)[0]
         return {
             "path": image_path,
-            "predicted_class": label,
-            "confidence": confidence
+            "predicted_class": result["predicted_class"],
+            "confidence": result["confidence"]
+        }
+
+    def predict_batch(self, images, top_k=3, batch_size=None):
+        '''Dự đoán nhiều ảnh BGR (ndarray từ crop_cell) trong một lượt chạy mô hình
+
+        images: dict {tên ô: ảnh} như crop_cell trả về, hoặc list ảnh.
+        batch_size: chia nhỏ lô nếu cần giới hạn bộ nhớ (None = một lượt).
+        '''
+        if isinstance(images, dict):
+            names, images = list(images.keys()), list(images.values())
+        else:
+            images = list(images)
+            names = [f"cell_{i}" for i in range(1, len(images) + 1)]
+        if not images:
+            return []
+
+        probs, escalated = self._classify(images, batch_size, trays=1)
+        return [self._format_result(name, p, top_k, esc) for name, p, esc in zip(names, probs, escalated)]
+
+    def predict_trays(self, trays, top_k=3, batch_size=None):
+        '''Dự đoán cùng lúc các ô của nhiều khay, trả về một list kết quả cho mỗi khay'''
+        trays = list(trays)
+        names, images, counts = [], [], []
+        for crops in trays:
+            names.extend(crops.keys())
+            images.extend(crops.values())
+            counts.append(len(crops))
+        if not images:
+            return [[] for _ in trays]
+
+        probs, escalated = self._classify(images, batch_size, trays=len(trays))
+        results, start = [], 0
+        for n in counts:
+            results.append([self._format_result(name, p, top_k, esc)
+                            for name, p, esc in zip(names[start:start + n], probs[start:start + n],
+                                                    escalated[start:start + n])])
+            start += n
+        return results
+
+    def _classify(self, images, batch_size=None, trays=1):
+        '''Chạy mô hình nhanh cho mọi ô, sau đó gom các ô không chắc chắn chạy lại bằng mô hình fallback
+
+        Trả về (ma trận xác suất, mảng bool đánh dấu ô đã chuyển lên fallback).
+        '''
+        start = time.perf_counter()
+        with metrics.timer("preprocess"):
+            batch = self._preprocess(images)
+        probs = self._predict_probs(batch, batch_size)
+        escalated = np.zeros(len(probs), dtype=bool)
+
+        if self.fallback is not None and len(probs):
+            top2 = np.sort(probs, axis=1)[:, -2:] if probs.shape[1] > 1 else np.hstack([np.zeros_like(probs), probs])
+            escalated = (top2[:, 1] < self.min_confidence) | (top2[:, 1] - top2[:, 0] < self.min_margin)
+            idx = np.nonzero(escalated)[0]
+            if len(idx):
+                metrics.inc("cascade_escalations_total", int(len(idx)))
+                fb_size = tuple(self.fallback.img_size)
+                with metrics.timer("inference_fallback"):
+                    fb_batch = (batch[idx] if fb_size == tuple(self.img_size)
+                                else self._preprocess([images[i] for i in idx], fb_size))
+                    probs = probs.copy()
+                    probs[idx] = np.asarray(self.fallback(fb_batch))
+
+        with self._stats_lock:
+            self.cascade_stats["trays"] += trays
+            self.cascade_stats["cells"] += len(probs)
+            self.cascade_stats["escalated"] += int(escalated.sum())
+            self.cascade_stats["seconds"] += time.perf_counter() - start
+        return probs, escalated
+
+    def reset_cascade_stats(self):
+        self.cascade_stats = {"trays": 0, "cells": 0, "escalated": 0, "seconds": 0.0}
+
+    def cascade_report(self):
+        '''Tỷ lệ ô phải chạy mô hình fallback và thời gian phân loại trung bình mỗi khay'''
+        s = self.cascade_stats
+        return {
+            "trays": s["trays"],
+            "cells": s["cells"],
+            "escalated": s["escalated"],
+            "escalation_rate": s["escalated"] / s["cells"] if s["cells"] else 0.0,
+            "avg_ms_per_tray": 1000 * s["seconds"] / s["trays"] if s["trays"] else 0.0
+        }
+
+    def _preprocess(self, images, img_size=None):
+        '''Chuyển BGR -> RGB, resize về kích thước mô hình và xếp thành một batch float32'''
+        h, w = img_size or self.img_size
+        batch = np.empty((len(images), h, w, 3), dtype=np.float32)
+        for i, img in enumerate(images):
+            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            batch[i] = cv2.resize(rgb, (w, h), interpolation=cv2.INTER_LINEAR)
+        return batch
+
+    def _predict_probs(self, batch, batch_size=None):
+        '''Chạy backend trên batch đã tiền xử lý, trả về ma trận xác suất'''
+        metrics.observe("inference_batch_size", len(batch), buckets=(1, 2, 5, 10, 20, 50, 100))
+        with metrics.timer("inference"):
+            if not batch_size or len(batch) <= batch_size:
+                return np.asarray(self.backend(batch))
+            return np.concatenate([np.asarray(self.backend(batch[i:i + batch_size]))
+                                   for i in range(0, len(batch), batch_size)])
+
+    def _format_result(self, name, probs, top_k, escalated=False):
+        '''Định dạng kết quả dự đoán của một ảnh (kèm top-k)'''
+        top_idx = np.argsort(probs)[::-1][:max(1, top_k)]
+        idx = int(top_idx[0])
+        metrics.observe("prediction_confidence", float(probs[idx]), buckets=metrics.CONFIDENCE_BUCKETS)
+        result = {
+            "cell": name,
+            "predicted_class": self.class_names[idx],
+            "confidence": float(probs[idx]),
+            "top_k": [{"class": self.class_names[int(i)], "confidence": float(probs[i])}
+                      for i in top_idx]
         }
+        if escalated:
+            result["source"] = "fallback"
+        return result
@@ -0,0 +1,268 @@
+import os
+import json
+import zlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from augment_images import IMG_SIZE, IMAGE_EXTS, open_shards
+
+CACHE_DIR = "./cache/dataset"
+INDEX_FILE = "index.json"
+DHASH_BANDS = 8          # 64 bit chia 8 dải 8 bit: cặp lệch <= 7 bit chắc chắn trùng ít nhất một dải
+MAX_DISTANCE = 6         # khoảng cách Hamming tối đa để coi là gần trùng
+
+def decode_cell(path, img_size=IMG_SIZE):
+    '''Giải mã + resize (bilinear, RGB) giống decode_image của train_cnn.py; None nếu lỗi'''
+    img = cv2.imdecode(np.fromfile(path, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    h, w = img_size
+    return cv2.cvtColor(cv2.resize(img, (w, h), interpolation=cv2.INTER_LINEAR), cv2.COLOR_BGR2RGB)
+
+_DHASH_WEIGHTS = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+
+def _dhash_one(img):
+    gray = cv2.resize(cv2.cvtColor(np.ascontiguousarray(img), cv2.COLOR_RGB2GRAY), (9, 8),
+                      interpolation=cv2.INTER_AREA)
+    return (gray[:, 1:] > gray[:, :-1]).ravel().astype(np.uint64) @ _DHASH_WEIGHTS
+
+def dhash(images):
+    '''dHash 64 bit (so sánh độ sáng các điểm ảnh kề nhau trên ảnh 9x8) cho dãy ảnh RGB, đọc từng ảnh một'''
+    return np.fromiter((_dhash_one(img) for img in images), dtype=np.uint64)
+
+def _popcount(x):
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def near_duplicates(hashes, max_distance=MAX_DISTANCE):
+    '''Tìm các cặp (i, j, khoảng cách) gần trùng bằng LSH theo dải bit, chỉ so sánh trong cùng bucket'''
+    pairs = {}
+    for band in range(DHASH_BANDS):
+        keys = (hashes >> np.uint64(8 * band)) & np.uint64(0xFF)
+        order = np.argsort(keys, kind="stable")
+        bounds = np.nonzero(np.diff(keys[order]))[0] + 1
+        for group in np.split(order, bounds):
+            if len(group) < 2:
+                continue
+            for k, i in enumerate(group[:-1]):
+                rest = group[k + 1:]
+                dist = _popcount(hashes[rest] ^ hashes[i])
+                for j, d in zip(rest[dist <= max_distance], dist[dist <= max_distance]):
+                    a, b = (int(i), int(j)) if i < j else (int(j), int(i))
+                    pairs[(a, b)] = int(d)
+    return sorted((a, b, d) for (a, b), d in pairs.items())
+
+def folder_fingerprint(folder):
+    '''Danh sách ảnh và dấu vân tay (tên + mtime + size) của một thư mục lớp'''
+    files, parts = [], []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(IMAGE_EXTS):
+            st = os.stat(os.path.join(folder, name))
+            files.append(name)
+            parts.append(f"{name}:{st.st_mtime_ns}:{st.st_size}")
+    return files, f"{zlib.crc32(chr(10).join(parts).encode('utf-8')):08x}-{len(files)}"
+
+def load_index(cache_dir):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return {"img_size": list(IMG_SIZE), "segments": {}, "excluded": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_index(cache_dir, index):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def remove_unused(cache_dir, index):
+    '''Xóa các file segment không còn được chỉ mục tham chiếu; file đang bị tiến trình khác memmap
+    (Windows không cho xóa) thì để lại, lần build sau xóa tiếp'''
+    used = {f for seg in index["segments"].values() for f in (seg["file"], seg["dhash"])}
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.startswith("seg_") and name.endswith(".npy") and name not in used:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+def build(roots, cache_dir=CACHE_DIR, workers=None):
+    '''Giải mã các thư mục lớp (roots/<lớp>/*.jpg) thành segment memmap uint8; chỉ làm lại thư mục đã đổi
+
+    Trả về (index, danh sách segment đã dựng lại).
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    index = load_index(cache_dir)
+    if tuple(index["img_size"]) != tuple(IMG_SIZE):
+        index = {"img_size": list(IMG_SIZE), "segments": {}, "excluded": []}
+
+    seen, rebuilt = set(), []
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=ctx) as pool:
+        for root in roots:
+            # Tên thư mục + hash đường dẫn tuyệt đối: hai nguồn cùng tên (vd a/data, b/data) không đè nhau
+            root_path = os.path.abspath(root)
+            tag = f"{os.path.basename(root_path)}_{zlib.crc32(root_path.encode('utf-8')):08x}"
+            for class_name in sorted(os.listdir(root)):
+                folder = os.path.join(root, class_name)
+                if not os.path.isdir(folder):
+                    continue
+                key = f"{tag}/{class_name}"
+                seen.add(key)
+                files, fingerprint = folder_fingerprint(folder)
+                if index["segments"].get(key, {}).get("fingerprint") == fingerprint:
+                    continue   # thư mục không đổi, giữ nguyên segment cũ
+
+                # Tên segment kèm dấu vân tay: ghi ra file mới thay vì ghi đè/os.replace lên segment cũ,
+                # vì trên Windows không thay được file đang bị tiến trình khác memmap
+                name = f"seg_{zlib.crc32(key.encode('utf-8')):08x}_{fingerprint}"
+                paths = [os.path.join(folder, f) for f in files]
+                decoded = list(pool.map(decode_cell, paths, chunksize=32))
+                ok = [i for i, img in enumerate(decoded) if img is not None]
+                images = np.lib.format.open_memmap(os.path.join(cache_dir, name + ".npy"), mode="w+",
+                                                   dtype=np.uint8, shape=(len(ok), *IMG_SIZE, 3))
+                for row, i in enumerate(ok):
+                    images[row] = decoded[i]
+                images.flush()
+                hashes = dhash(images)
+                del images, decoded
+                np.save(os.path.join(cache_dir, name + "_dhash.npy"), hashes)
+
+                index["segments"][key] = {"file": name + ".npy", "dhash": name + "_dhash.npy", "root": root,
+                                          "class": class_name, "fingerprint": fingerprint,
+                                          "files": [files[i] for i in ok]}
+                rebuilt.append(key)
+                save_index(cache_dir, index)   # chỉ mục trỏ sang segment mới khi đã ghi xong
+
+    # Thư mục đã bị xóa khỏi nguồn
+    for key in set(index["segments"]) - seen:
+        index["segments"].pop(key)
+    save_index(cache_dir, index)
+    # Segment cũ (đã dựng lại hoặc thư mục đã xóa) chỉ bị xóa sau khi chỉ mục không còn trỏ tới
+    remove_unused(cache_dir, index)
+    return index, rebuilt
+
+class DatasetCache:
+    """Đọc cache đã dựng: ảnh memmap (nhiều tiến trình dùng chung page cache, không sao chép) + nhãn/offset"""
+
+    def __init__(self, cache_dir=CACHE_DIR, class_names=None, include_excluded=False):
+        '''class_names: thứ tự lớp mong muốn (vd class_names.json); mặc định sắp xếp theo tên'''
+        self.cache_dir = cache_dir
+        index = load_index(cache_dir)
+        keys = sorted(index["segments"])
+        segments = [index["segments"][k] for k in keys]
+        self.class_names = list(class_names) if class_names is not None else \
+            sorted({seg["class"] for seg in segments})
+
+        self.segments = [np.load(os.path.join(cache_dir, seg["file"]), mmap_mode="r") for seg in segments]
+        counts = np.array([len(s) for s in self.segments], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.labels = np.repeat([self.class_names.index(seg["class"]) for seg in segments], counts).astype(np.int32)
+        self.paths = [os.path.join(seg["root"], seg["class"], f) for seg in segments for f in seg["files"]]
+        self.hashes = np.concatenate([np.load(os.path.join(cache_dir, seg["dhash"])) for seg in segments]) \
+            if segments else np.empty(0, np.uint64)
+
+        # Ảnh gần trùng đã loại (đường dẫn tuyệt đối), train_cnn.py --dataset-cache bỏ chúng khỏi tập train
+        self.excluded = set() if include_excluded else {os.path.abspath(p) for p in index.get("excluded", [])}
+        self.keep = np.array([i for i, p in enumerate(self.paths) if os.path.abspath(p) not in self.excluded],
+                             dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keep)
+
+    def __getitem__(self, i):
+        '''Ảnh (view memmap) và nhãn của mẫu thứ i (bỏ qua các ảnh đã loại)'''
+        row = int(self.keep[i])
+        return self.image(row), self.labels[row]
+
+    def image(self, row):
+        '''Ảnh (view memmap) ở hàng toàn cục row, như lookup() trả về'''
+        seg = int(np.searchsorted(self.offsets, row, side="right")) - 1
+        return self.segments[seg][row - self.offsets[seg]]
+
+    def lookup(self, paths):
+        '''Chỉ số hàng (toàn cục) của các đường dẫn ảnh; -1 nếu không có trong cache'''
+        where = {os.path.abspath(p): i for i, p in enumerate(self.paths)}
+        return np.array([where.get(os.path.abspath(str(p)), -1) for p in paths], dtype=np.int64)
+
+def validation_paths(roots):
+    '''Tập ảnh kiểm định theo đúng cách chia của train_cnn.py (cần TensorFlow, chỉ nạp khi dùng)'''
+    from train_cnn import list_split
+    val = set()
+    for root in roots:
+        paths, _, _ = list_split(root, "validation")
+        val.update(os.path.normpath(str(p)) for p in paths)
+    return val
+
+def find_duplicates(cache, val_paths=None, augmented_dir=None, max_distance=MAX_DISTANCE):
+    '''Phân loại các cặp gần trùng: khác lớp (cross_class), lệch train/val (train_val), cùng lớp (same_class)'''
+    hashes, labels, paths = cache.hashes, cache.labels, list(cache.paths)
+    if augmented_dir:
+        # Ảnh augment đã ở dạng shard memmap: chỉ cần băm, không giải mã lại
+        for s, (images, shard_labels, rows) in enumerate(open_shards(augmented_dir, cache.class_names)):
+            hashes = np.concatenate([hashes, dhash(images[r] for r in rows)])
+            labels = np.concatenate([labels, shard_labels[rows]])
+            paths.extend(f"{augmented_dir}#shard{s}:{r}" for r in rows)
+
+    report = {"cross_class": [], "train_val": [], "same_class": []}
+    for i, j, d in near_duplicates(hashes, max_distance):
+        pair = {"a": paths[i], "b": paths[j], "distance": d}
+        if labels[i] != labels[j]:
+            report["cross_class"].append(pair)
+        elif val_paths is not None and (os.path.normpath(paths[i]) in val_paths) != (os.path.normpath(paths[j]) in val_paths):
+            report["train_val"].append(pair)
+        else:
+            report["same_class"].append(pair)
+    return report
+
+def drop_list(report, kinds, val_paths=None):
+    '''Ảnh cần loại: khác lớp thì loại cả hai (nhãn mơ hồ), train/val thì loại bản ở train, cùng lớp thì loại bản sau'''
+    drop = set()
+    for kind in kinds:
+        for pair in report[kind]:
+            if kind == "cross_class":
+                drop.update((pair["a"], pair["b"]))
+            elif kind == "train_val":
+                drop.add(pair["b"] if os.path.normpath(pair["a"]) in val_paths else pair["a"])
+            else:
+                drop.add(pair["b"])
+    return sorted(p for p in drop if "#shard" not in p)
+
+def main():
+    parser = argparse.ArgumentParser(description="Dựng cache ảnh đã giải mã (memmap) và chỉ mục ảnh gần trùng")
+    parser.add_argument("--roots", nargs="+", default=["./data"], help="Các thư mục dữ liệu (mỗi lớp một thư mục con)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--augmented-dir", default=None, help="Thư mục shard của augment_images.py (chỉ kiểm tra trùng)")
+    parser.add_argument("--max-distance", type=int, default=MAX_DISTANCE, help="Khoảng cách Hamming tối đa của dHash")
+    parser.add_argument("--check-split", action="store_true", help="Kiểm tra trùng giữa train/val (cần TensorFlow)")
+    parser.add_argument("--drop", nargs="*", default=[], choices=["cross_class", "train_val", "same_class"],
+                        help="Loại các ảnh gần trùng thuộc nhóm này khỏi cache")
+    args = parser.parse_args()
+
+    index, rebuilt = build(args.roots, args.cache_dir, args.workers)
+    print(f"✅ Cache: {len(index['segments'])} thư mục, dựng lại {len(rebuilt)} thư mục")
+
+    cache = DatasetCache(args.cache_dir, include_excluded=True)
+    val_paths = validation_paths(args.roots) if args.check_split or "train_val" in args.drop else None
+    report = find_duplicates(cache, val_paths, args.augmented_dir, args.max_distance)
+    with open(os.path.join(args.cache_dir, "duplicates.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f" + {len(cache)} ảnh, {sum(len(s) * s[0].nbytes for s in cache.segments if len(s)) / 2**20:.0f} MB memmap")
+    for kind, pairs in report.items():
+        print(f" + Gần trùng {kind}: {len(pairs)} cặp")
+
+    index = load_index(args.cache_dir)
+    index["excluded"] = drop_list(report, args.drop, val_paths) if args.drop else []
+    save_index(args.cache_dir, index)
+    if args.drop:
+        print(f"🗑️ Đã loại {len(index['excluded'])} ảnh khỏi cache (danh sách trong {INDEX_FILE})")
+    print(f"📂 Chi tiết: {os.path.join(args.cache_dir, 'duplicates.json')}")
+
+if __name__ == "__main__":
+    main()
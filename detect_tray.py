@@ -1,103 +1,235 @@
 import cv2
 import numpy as np
-from utils import line_angle, intersection
-
-def perspective_tray(img_path):
-    # Đọc và xử lý ảnh cơ bản
-    raw = cv2.imread(img_path)
-    if raw is None:
-        print("❌ Không thể đọc ảnh đầu vào!")
+import metrics
+from utils import line_angles, intersections
+
+# Ảnh nhỏ dùng để dò khay và kích thước khay sau chỉnh phối cảnh
+PROXY_SIZE = (800, 600)
+OUT_SIZE = (800, 600)
+
+# Tọa độ cắt (x, y, w, h) theo khay chuẩn 800x600, tự co giãn theo kích thước thực
+REGIONS = {
+    "top_left": (0, 0, 266, 250),
+    "top_mid": (266, 0, 266, 250),
+    "top_right": (532, 0, 268, 250),
+    "bottom_left": (0, 250, 400, 350),
+    "bottom_right": (400, 250, 400, 350)
+}
+
+TRAY_NOT_FOUND = "❌ Không thể xác định khay! Đảm bảo ít nhất 3 góc khay nằm trong khung hình!\n"
+
+# Cạnh dài tối thiểu cần giữ khi giải mã: ảnh JPEG lớn hơn nhiều được giải mã ở 1/2, 1/4 hoặc 1/8
+# ngay trong libjpeg (khay sau chỉnh phối cảnh chỉ 800x600 nên không mất chi tiết cần thiết)
+DECODE_TARGET_SIDE = 1600
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def jpeg_size(buf):
+    '''Đọc (w, h) từ header JPEG mà không giải mã; None nếu không phải JPEG hợp lệ'''
+    buf = memoryview(buf).cast("B")
+    if bytes(buf[:2]) != b"\xff\xd8":
         return None
+    i = 2
+    while i + 9 <= len(buf):
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:   # byte đệm
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            h = int.from_bytes(buf[i + 5:i + 7], "big")
+            w = int.from_bytes(buf[i + 7:i + 9], "big")
+            return w, h
+        i += 2 + int.from_bytes(buf[i + 2:i + 4], "big")
+    return None
+
+def decode_flag(buf, target_side=DECODE_TARGET_SIDE):
+    '''Chọn cờ imdecode: giảm độ phân giải lớn nhất mà cạnh dài vẫn >= target_side'''
+    size = jpeg_size(buf) if target_side else None
+    if size is not None:
+        for factor, flag in _REDUCED_FLAGS:
+            if max(size) / factor >= target_side:
+                return flag
+    return cv2.IMREAD_COLOR
+
+def load_image(src, target_side=DECODE_TARGET_SIDE):
+    '''Đọc ảnh BGR từ đường dẫn, bytes đã mã hóa (jpg/png) hoặc ndarray có sẵn
+
+    target_side: cạnh dài tối thiểu khi giải mã JPEG ở độ phân giải giảm (None = giải mã đầy đủ).
+    '''
+    if isinstance(src, np.ndarray):
+        return src
+    if not isinstance(src, (bytes, bytearray, memoryview)):
+        try:
+            src = np.fromfile(str(src), np.uint8)
+        except OSError:
+            return None
+    buf = np.frombuffer(src, np.uint8)
+    if not buf.size:
+        return None
+    return cv2.imdecode(buf, decode_flag(buf, target_side))
 
-    if raw.shape[0] > raw.shape[1]:
-        raw = cv2.rotate(raw, cv2.ROTATE_90_CLOCKWISE)
-    img = cv2.resize(raw, (800, 600))
+def _orient_proxy(raw):
+    '''Tạo ảnh nhỏ 800x600 để dò khay và xác định hướng khay (3 ô trên – 2 ô dưới)'''
+    rotated_90 = raw.shape[0] > raw.shape[1]
+    img = cv2.rotate(raw, cv2.ROTATE_90_CLOCKWISE) if rotated_90 else raw
+    img = cv2.resize(img, PROXY_SIZE)
 
-    # Xác định hướng khay (3 ô trên – 2 ô dưới)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     blur = cv2.GaussianBlur(gray, (7, 7), 0)
     _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
     h = thresh.shape[0]
-    upper = thresh[:h // 2, :]
-    lower = thresh[h // 2:, :]
-
-    bright_upper = np.sum(upper == 255)
-    bright_lower = np.sum(lower == 255)
+    bright_upper = np.count_nonzero(thresh[:h // 2, :])
+    bright_lower = np.count_nonzero(thresh[h // 2:, :])
     mean_upper = np.mean(blur[:h // 2, :])
     mean_lower = np.mean(blur[h // 2:, :])
 
-    if bright_upper > bright_lower * 1.1 or mean_upper > mean_lower * 1.05:
+    rotated_180 = bright_upper > bright_lower * 1.1 or mean_upper > mean_lower * 1.05
+    if rotated_180:
         img = cv2.rotate(img, cv2.ROTATE_180)
-
-    # Phát hiện biên và các đường thẳng biên
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blur, 60, 160)
-    edges = cv2.dilate(edges, np.ones((5, 5), np.uint8), iterations=1)
-
-    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=100, 
+    return img, rotated_90, rotated_180
+
+def _order_corners(pts):
+    '''Sắp xếp 4 đỉnh theo thứ tự trên-trái, trên-phải, dưới-phải, dưới-trái'''
+    pts = pts.reshape(4, 2).astype(np.float32)
+    s = pts.sum(axis=1)
+    d = pts[:, 1] - pts[:, 0]
+    return np.float32([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]])
+
+def _quad_from_contours(edges, min_area_ratio=0.25):
+    '''Cách nhanh: tìm tứ giác lồi lớn nhất bằng findContours + approxPolyDP'''
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = min_area_ratio * edges.shape[0] * edges.shape[1]
+    for c in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(c) < min_area:
+            break
+        approx = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return _order_corners(approx)
+    return None
+
+def _quad_from_hough(edges):
+    '''Dự phòng: tìm 4 cạnh biên bằng HoughLinesP, phân loại và giao điểm tính vector hóa'''
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=100,
                             minLineLength=200, maxLineGap=20)
     if lines is None:
-        print("❌ Không thể xác định khay! Đảm bảo ít nhất 3 góc khay nằm trong khung hình!\n")
         return None
 
-    horizontals, verticals = [], []
-    for l in lines:
-        ang = line_angle(l)
-        if abs(ang) < 25 or abs(ang) > 155:
-            horizontals.append(l)
-        elif 65 < abs(ang) < 115:
-            verticals.append(l)
-
-    if not horizontals or not verticals:
-        print("❌ Không thể xác định khay! Đảm bảo ít nhất 3 góc khay nằm trong khung hình!\n")
+    segs = lines.reshape(-1, 4).astype(np.float64)
+    ang = np.abs(line_angles(segs))
+    horizontals = segs[(ang < 25) | (ang > 155)]
+    verticals = segs[(ang > 65) & (ang < 115)]
+    if not len(horizontals) or not len(verticals):
         return None
 
     # Tìm 4 cạnh và 4 đỉnh của tứ giác biên
-    top = min(horizontals, key=lambda l: min(l[0][1], l[0][3]))
-    bottom = max(horizontals, key=lambda l: max(l[0][1], l[0][3]))
-    left = min(verticals, key=lambda l: min(l[0][0], l[0][2]))
-    right = max(verticals, key=lambda l: max(l[0][0], l[0][2]))
-
-    corners = [
-        intersection(top, left),
-        intersection(top, right),
-        intersection(bottom, right),
-        intersection(bottom, left)]
+    top = horizontals[np.argmin(np.minimum(horizontals[:, 1], horizontals[:, 3]))]
+    bottom = horizontals[np.argmax(np.maximum(horizontals[:, 1], horizontals[:, 3]))]
+    left = verticals[np.argmin(np.minimum(verticals[:, 0], verticals[:, 2]))]
+    right = verticals[np.argmax(np.maximum(verticals[:, 0], verticals[:, 2]))]
+
+    corners = intersections(np.stack([top, top, bottom, bottom]),
+                            np.stack([left, right, right, left]))
+    if np.isnan(corners).any():
+        return None
+    return corners.astype(np.float32)
+
+def _proxy_to_raw(corners, raw_shape, rotated_90, rotated_180):
+    '''Đổi tọa độ đỉnh từ ảnh nhỏ về ảnh gốc độ phân giải đầy đủ'''
+    pw, ph = PROXY_SIZE
+    pts = corners.astype(np.float64).copy()
+    if rotated_180:
+        pts = np.column_stack([(pw - 1) - pts[:, 0], (ph - 1) - pts[:, 1]])
+
+    raw_h, raw_w = raw_shape[:2]
+    frame_w, frame_h = (raw_h, raw_w) if rotated_90 else (raw_w, raw_h)
+    pts[:, 0] = (pts[:, 0] + 0.5) * frame_w / pw - 0.5
+    pts[:, 1] = (pts[:, 1] + 0.5) * frame_h / ph - 0.5
+
+    if rotated_90:
+        # Ngược phép xoay 90° theo chiều kim đồng hồ: (x', y') -> (y', h - 1 - x')
+        pts = np.column_stack([pts[:, 1], (raw_h - 1) - pts[:, 0]])
+    return pts.astype(np.float32)
+
+def find_tray_corners(raw):
+    '''Tìm 4 đỉnh khay (trên-trái, trên-phải, dưới-phải, dưới-trái) trên ảnh gốc
+
+    Dò trên ảnh nhỏ 800x600; trả về tọa độ theo ảnh gốc hoặc None nếu không tìm được.
+    '''
+    with metrics.timer("orientation"):
+        proxy, rotated_90, rotated_180 = _orient_proxy(raw)
+
+    # Phát hiện biên rồi thử tứ giác từ contour trước, Hough sau
+    with metrics.timer("edges"):
+        gray = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY)
+        blur = cv2.GaussianBlur(gray, (5, 5), 0)
+        edges = cv2.Canny(blur, 60, 160)
+        edges = cv2.dilate(edges, np.ones((5, 5), np.uint8), iterations=1)
+
+    with metrics.timer("quad_contour"):
+        corners = _quad_from_contours(edges)
+    method = "contour"
+    if corners is None:
+        method = "hough"
+        with metrics.timer("quad_hough"):
+            corners = _quad_from_hough(edges)
 
     # Kiểm tra tính hợp lệ
-    valid = [c for c in corners if c is not None]
-    if len(valid) != 4 or len(np.unique(valid, axis=0)) < 4:
-        print("❌ Không thể xác định khay! Đảm bảo ít nhất 3 góc khay nằm trong khung hình!\n")
+    if corners is None or len(np.unique(np.round(corners), axis=0)) < 4:
+        metrics.inc("tray_detect_failures_total", reason="no_quad")
+        print(TRAY_NOT_FOUND)
         return None
 
-    distance = np.linalg.norm(np.array(corners[1]) - np.array(corners[0]))
+    distance = np.linalg.norm(corners[1] - corners[0])
     if distance < 400:
+        metrics.inc("tray_detect_failures_total", reason="corners_too_close")
         print("❌ Khoảng cách đỉnh quá nhỏ, khay có thể bị che hoặc lệch góc!\n")
         return None
 
-    # Chỉnh phối cảnh khay
-    pts1 = np.float32(corners)
-    pts2 = np.float32([[0, 0], [800, 0], [800, 600], [0, 600]])
+    metrics.inc("tray_detect_total", method=method)
 
-    matrix = cv2.getPerspectiveTransform(pts1, pts2)
-    img_output = cv2.warpPerspective(img, matrix, (800, 600))
+    return _proxy_to_raw(corners, raw.shape, rotated_90, rotated_180)
+
+def tray_homography(corners, out_size=OUT_SIZE):
+    '''Ma trận phối cảnh đưa 4 đỉnh khay về khung chữ nhật out_size (w, h)'''
+    w, h = out_size
+    pts2 = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    return cv2.getPerspectiveTransform(np.float32(corners), pts2)
+
+def perspective_tray(img_path, out_size=OUT_SIZE, target_side=DECODE_TARGET_SIDE):
+    # Đọc và xử lý ảnh cơ bản (đường dẫn, bytes hoặc ndarray; JPEG lớn được giải mã ở độ phân giải giảm)
+    with metrics.timer("decode"):
+        raw = load_image(img_path, target_side)
+    if raw is None:
+        metrics.inc("tray_detect_failures_total", reason="unreadable_image")
+        print("❌ Không thể đọc ảnh đầu vào!")
+        return None
+
+    corners = find_tray_corners(raw)
+    if corners is None:
+        return None
+
+    # Chỉnh phối cảnh khay trực tiếp từ ảnh gốc (ảnh ô sắc nét hơn)
+    with metrics.timer("warp"):
+        matrix = tray_homography(corners, out_size)
+        img_output = cv2.warpPerspective(raw, matrix, out_size)
 
     #cv2.imshow("Output Image", img_output)
     return img_output
 
+def cell_rects(size):
+    '''Tọa độ (x0, y0, x1, y1) của 5 ô trên khay kích thước size (w, h)'''
+    # Co giãn tọa độ cắt theo kích thước khay thực tế
+    sx, sy = size[0] / OUT_SIZE[0], size[1] / OUT_SIZE[1]
+    return {name: (round(x * sx), round(y * sy), round((x + w) * sx), round((y + h) * sy))
+            for name, (x, y, w, h) in REGIONS.items()}
+
 def crop_cell(img):
     '''Cắt khay sau điều chỉnh phối cảnh thành 5 ô chứa thức ăn'''
-    # Tọa độ cắt (x, y, w, h)
-    regions = {
-        "top_left": (0, 0, 266, 250),
-        "top_mid": (266, 0, 266, 250),
-        "top_right": (532, 0, 268, 250),
-        "bottom_left": (0, 250, 400, 350),
-        "bottom_right": (400, 250, 400, 350)
-    }
-
     # Cắt và lưu trong bộ nhớ (chưa ghi tệp)
-    crops = {name: img[y:y+h, x:x+w] for name, (x, y, w, h) in regions.items()}
-    return crops
\ No newline at end of file
+    crops = {}
+    for name, (x0, y0, x1, y1) in cell_rects((img.shape[1], img.shape[0])).items():
+        crops[name] = img[y0:y1, x0:x1]
+    return crops
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import Sequential
+from tensorflow.keras.layers import (Rescaling, Conv2D, SeparableConv2D, MaxPooling2D, BatchNormalization,
+                                     GlobalAveragePooling2D, Dropout, Dense)
+from cnn_classification import MODEL_PATH
+from train_cnn import list_split, make_dataset, dataset_cache_path, BATCH_SIZE
+
+# Các mô hình học trò: (kiểu kiến trúc, kích thước đầu vào)
+STUDENTS = {
+    "gap_128": ("gap", (128, 128)),
+    "gap_96": ("gap", (96, 96)),
+    "dws_128": ("dws", (128, 128)),
+    "dws_96": ("dws", (96, 96)),
+}
+CELLS_PER_TRAY = 5
+
+def build_student(kind, num_classes, img_size):
+    '''gap: 3 tầng tích chập như notebook nhưng gộp trung bình thay cho Flatten + Dense lớn
+    dws: tích chập tách kênh (depthwise-separable) + BatchNorm, nhẹ hơn nhiều
+    '''
+    layers = [Rescaling(1./255, input_shape=(*img_size, 3))]
+    if kind == "gap":
+        for filters in (32, 64, 128):
+            layers += [Conv2D(filters, 3, activation='relu', padding='same'), MaxPooling2D()]
+    elif kind == "dws":
+        layers += [Conv2D(24, 3, strides=2, padding='same', activation='relu'), BatchNormalization()]
+        for filters in (48, 96, 160):
+            layers += [SeparableConv2D(filters, 3, padding='same', activation='relu'), BatchNormalization(),
+                       MaxPooling2D()]
+    else:
+        raise ValueError(f"Kiến trúc không hợp lệ: {kind}")
+    layers += [GlobalAveragePooling2D(), Dropout(0.3), Dense(num_classes, activation='softmax', dtype='float32')]
+    return Sequential(layers)
+
+class Distiller(tf.keras.Model):
+    """Chưng cất tri thức: học trò học cả nhãn thật và phân phối mềm (nhiệt độ T) của mô hình thầy"""
+
+    def __init__(self, student, teacher, temperature=4.0, alpha=0.1):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.temperature = temperature
+        self.alpha = alpha
+        self.student_size = tuple(student.input_shape[1:3])
+        self.ce = tf.keras.losses.SparseCategoricalCrossentropy()
+        self.kl = tf.keras.losses.KLDivergence()
+        self.acc = tf.keras.metrics.SparseCategoricalAccuracy(name="accuracy")
+        self.loss_tracker = tf.keras.metrics.Mean(name="loss")
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.acc]
+
+    def _soften(self, probs):
+        # Mô hình chỉ xuất softmax: log(p) / T tương đương logits / T
+        return tf.nn.softmax(tf.math.log(probs + 1e-7) / self.temperature)
+
+    def _student_input(self, x):
+        if tuple(x.shape[1:3]) == self.student_size:
+            return x
+        return tf.image.resize(x, self.student_size, antialias=True)
+
+    def call(self, x, training=False):
+        return self.student(self._student_input(x), training=training)
+
+    def train_step(self, data):
+        x, y = data
+        teacher_probs = self.teacher(x, training=False)
+        with tf.GradientTape() as tape:
+            student_probs = self.student(self._student_input(x), training=True)
+            hard = self.ce(y, student_probs)
+            soft = self.kl(self._soften(teacher_probs), self._soften(student_probs)) * self.temperature ** 2
+            loss = self.alpha * hard + (1 - self.alpha) * soft
+        grads = tape.gradient(loss, self.student.trainable_variables)
+        self.optimizer.apply_gradients(zip(grads, self.student.trainable_variables))
+        self.loss_tracker.update_state(loss)
+        self.acc.update_state(y, student_probs)
+        return {m.name: m.result() for m in self.metrics}
+
+    def test_step(self, data):
+        x, y = data
+        student_probs = self.student(self._student_input(x), training=False)
+        self.loss_tracker.update_state(self.ce(y, student_probs))
+        self.acc.update_state(y, student_probs)
+        return {m.name: m.result() for m in self.metrics}
+
+def cpu_ms_per_tray(model, repeats=50, warmup=5):
+    '''Độ trễ trung vị (ms) trên CPU cho một batch 5 ô, giống một lượt predict_batch'''
+    h, w = model.input_shape[1:3]
+    batch = tf.constant(np.random.default_rng(0).uniform(0, 255, (CELLS_PER_TRAY, h, w, 3)).astype(np.float32))
+    with tf.device("/CPU:0"):
+        forward = tf.function(lambda x: model(x, training=False))
+        for _ in range(warmup):
+            forward(batch).numpy()
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            forward(batch).numpy()
+            times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+def pareto_front(rows):
+    '''Đánh dấu các mô hình không bị mô hình nào khác vừa nhanh hơn vừa chính xác hơn'''
+    best = -1.0
+    for row in sorted(rows, key=lambda r: (r["cpu_ms_per_tray"], -r["val_accuracy"])):
+        row["pareto"] = row["val_accuracy"] > best
+        best = max(best, row["val_accuracy"])
+    return rows
+
+def main():
+    cwd = Path.cwd()
+    candidate_dirs = [cwd / 'data', cwd.parent / 'data']
+    default_data = next((p for p in candidate_dirs if p.exists()), candidate_dirs[0])
+
+    parser = argparse.ArgumentParser(description="Chưng cất mô hình hiện tại thành các mô hình nhỏ, so sánh độ chính xác và độ trễ CPU")
+    parser.add_argument("--data", default=str(default_data), help="Thư mục dataset (mỗi lớp một thư mục con)")
+    parser.add_argument("--teacher", default=MODEL_PATH, help="Mô hình thầy (.h5)")
+    parser.add_argument("--students", nargs="*", default=list(STUDENTS), choices=list(STUDENTS))
+    parser.add_argument("--output-dir", default=os.path.join(os.path.dirname(MODEL_PATH), "students"))
+    parser.add_argument("--cache-dir", default="./cache/tfdata", help="Thư mục cache ảnh đã giải mã (dùng chung với train_cnn.py)")
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.1, help="Trọng số của nhãn thật (phần còn lại cho nhãn mềm)")
+    args = parser.parse_args()
+
+    teacher = tf.keras.models.load_model(args.teacher)
+    teacher.trainable = False
+    teacher_size = tuple(teacher.input_shape[1:3])
+
+    train_paths, train_labels, class_names = list_split(args.data, "training")
+    val_paths, val_labels, _ = list_split(args.data, "validation")
+    os.makedirs(args.cache_dir, exist_ok=True)
+    train_ds = make_dataset(train_paths, train_labels,
+                            dataset_cache_path(args.cache_dir, "train", train_paths, teacher_size),
+                            training=True, img_size=teacher_size, batch_size=args.batch_size)
+
+    def val_dataset(size):
+        # Ảnh kiểm định resize thẳng về kích thước học trò, giống lúc suy luận thật
+        return make_dataset(val_paths, val_labels, dataset_cache_path(args.cache_dir, "val", val_paths, size),
+                            img_size=size, batch_size=args.batch_size)
+
+    teacher.compile(loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    _, teacher_acc = teacher.evaluate(val_dataset(teacher_size), verbose=0)
+    rows = [{"model": "teacher", "img_size": list(teacher_size), "params": int(teacher.count_params()),
+             "val_accuracy": float(teacher_acc), "cpu_ms_per_tray": cpu_ms_per_tray(teacher),
+             "path": str(args.teacher)}]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name in args.students:
+        kind, size = STUDENTS[name]
+        print(f"\n🎓 Chưng cất {name} ({kind}, {size[0]}x{size[1]})")
+        student = build_student(kind, len(class_names), size)
+        distiller = Distiller(student, teacher, args.temperature, args.alpha)
+        distiller.compile(optimizer='adam')
+        distiller.fit(train_ds, epochs=args.epochs, verbose=2)
+
+        student.compile(loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        _, acc = student.evaluate(val_dataset(size), verbose=0)
+        path = os.path.join(args.output_dir, f"{name}.h5")
+        student.save(path)
+        rows.append({"model": name, "img_size": list(size), "params": int(student.count_params()),
+                     "val_accuracy": float(acc), "cpu_ms_per_tray": cpu_ms_per_tray(student), "path": path})
+
+    rows = pareto_front(rows)
+    with open(os.path.join(args.output_dir, "class_names.json"), "w", encoding="utf-8") as f:
+        json.dump(class_names, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(args.output_dir, "zoo.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'Mô hình':<12}{'Ảnh':>9}{'Tham số':>12}{'Val acc':>10}{'CPU ms/khay':>13}  Pareto")
+    for r in sorted(rows, key=lambda r: r["cpu_ms_per_tray"]):
+        size = f"{r['img_size'][0]}x{r['img_size'][1]}"
+        print(f"{r['model']:<12}{size:>9}{r['params']:>12,}{r['val_accuracy']:>10.2%}{r['cpu_ms_per_tray']:>13.2f}  "
+              f"{'★' if r['pareto'] else ''}")
+    print(f"\nBảng kết quả lưu tại: {os.path.join(args.output_dir, 'zoo.json')}")
+
+if __name__ == "__main__":
+    main()
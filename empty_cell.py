@@ -0,0 +1,157 @@
+import os
+import json
+import argparse
+import cv2
+import numpy as np
+import metrics
+from cnn_classification import MODEL_PATH
+
+EMPTY_CLASS = "khay_trong"
+EMPTY_MODEL_PATH = os.path.join(os.path.dirname(MODEL_PATH), "empty_cell.json")
+FEATURE_NAMES = ["sat_mean", "sat_std", "val_std", "log_laplacian_var", "edge_density"]
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+
+def cell_features(img):
+    '''Đặc trưng màu/kết cấu rẻ của một ô (BGR): ô trống thường ít màu, phẳng và ít cạnh'''
+    small = cv2.resize(img, (64, 64), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    sat, val = hsv[..., 1].astype(np.float32), hsv[..., 2].astype(np.float32)
+    lap_var = cv2.Laplacian(gray, cv2.CV_32F).var()
+    edges = cv2.Canny(gray, 50, 150)
+    return np.array([sat.mean(), sat.std(), val.std(), np.log1p(lap_var),
+                     np.count_nonzero(edges) / edges.size], dtype=np.float64)
+
+class EmptyCellDetector:
+    """Bộ lọc nhanh ô trống: điểm tuyến tính (LDA) trên đặc trưng màu/kết cấu, ngưỡng theo độ chính xác"""
+
+    def __init__(self, params, threshold=None):
+        self.mean = np.array(params["mean"])
+        self.std = np.array(params["std"])
+        self.weights = np.array(params["weights"])
+        self.threshold = params["threshold"] if threshold is None else threshold
+        self.precision = params.get("precision", 1.0)
+        self.cells = self.skipped = 0
+
+    @classmethod
+    def load(cls, path=EMPTY_MODEL_PATH, threshold=None):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), threshold)
+
+    def score(self, img):
+        '''Điểm càng cao càng giống ô trống'''
+        return float(((cell_features(img) - self.mean) / self.std) @ self.weights)
+
+    def is_empty(self, img):
+        self.cells += 1
+        empty = self.score(img) >= self.threshold
+        if empty:
+            self.skipped += 1
+            metrics.inc("empty_fast_path_total")
+        return empty
+
+    def split(self, crops):
+        '''Tách các ô trống (không cần chạy CNN) khỏi các ô cần phân loại
+
+        Trả về (dict kết quả cho ô trống, dict ô còn lại).
+        '''
+        empty, rest = {}, {}
+        for name, img in crops.items():
+            if self.is_empty(img):
+                empty[name] = {
+                    "cell": name,
+                    "predicted_class": EMPTY_CLASS,
+                    "confidence": self.precision,
+                    "top_k": [{"class": EMPTY_CLASS, "confidence": self.precision}],
+                    "source": "empty_fast_path"
+                }
+            else:
+                rest[name] = img
+        return empty, rest
+
+    def report(self):
+        '''Số ô đã kiểm tra và số lượt suy luận CNN tiết kiệm được'''
+        return {
+            "cells": self.cells,
+            "skipped_inferences": self.skipped,
+            "skip_rate": self.skipped / self.cells if self.cells else 0.0
+        }
+
+def load_detector(path=EMPTY_MODEL_PATH, threshold=None):
+    '''Nạp bộ lọc ô trống nếu đã hiệu chuẩn; None nếu chưa có file'''
+    if not os.path.exists(path):
+        return None
+    return EmptyCellDetector.load(path, threshold)
+
+def calibrate(data_dir, target_precision=0.995, max_per_class=300, seed=123):
+    '''Hiệu chuẩn trên dữ liệu huấn luyện: LDA tách khay_trong với các lớp khác, chọn ngưỡng đạt precision'''
+    rng = np.random.default_rng(seed)
+    feats, is_empty = [], []
+    for class_name in sorted(os.listdir(data_dir)):
+        class_path = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_path):
+            continue
+        files = sorted(f for f in os.listdir(class_path) if f.lower().endswith(IMAGE_EXTS))
+        if len(files) > max_per_class:
+            files = list(rng.choice(files, max_per_class, replace=False))
+        for f in files:
+            img = cv2.imread(os.path.join(class_path, f))
+            if img is not None:
+                feats.append(cell_features(img))
+                is_empty.append(class_name == EMPTY_CLASS)
+
+    X, y = np.array(feats), np.array(is_empty)
+    if not y.any() or y.all():
+        raise ValueError(f"Cần ảnh của cả lớp {EMPTY_CLASS} và các lớp khác để hiệu chuẩn")
+
+    mean, std = X.mean(axis=0), X.std(axis=0) + 1e-6
+    Z = (X - mean) / std
+    pos, neg = Z[y], Z[~y]
+    within = np.cov(pos, rowvar=False) + np.cov(neg, rowvar=False) + 1e-3 * np.eye(Z.shape[1])
+    weights = np.linalg.solve(within, pos.mean(axis=0) - neg.mean(axis=0))
+    scores = Z @ weights
+
+    # Ngưỡng thấp nhất (bắt được nhiều ô trống nhất) mà vẫn đạt precision mong muốn
+    order = np.argsort(-scores)
+    tp = np.cumsum(y[order])
+    precision = tp / np.arange(1, len(order) + 1)
+    ok = np.nonzero(precision >= target_precision)[0]
+    if len(ok):
+        cut = ok[-1]
+        threshold = float(scores[order][cut])
+        prec, recall = float(precision[cut]), float(tp[cut] / y.sum())
+    else:
+        threshold, prec, recall = float(scores.max()) + 1.0, 1.0, 0.0
+
+    return {
+        "features": FEATURE_NAMES,
+        "mean": mean.tolist(),
+        "std": std.tolist(),
+        "weights": weights.tolist(),
+        "threshold": threshold,
+        "target_precision": target_precision,
+        "precision": prec,
+        "recall": recall,
+        "num_empty": int(y.sum()),
+        "num_other": int((~y).sum())
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Hiệu chuẩn bộ lọc nhanh ô trống (bỏ qua CNN)")
+    parser.add_argument("--data", default="./data", help="Thư mục dữ liệu (mỗi lớp một thư mục con)")
+    parser.add_argument("--precision", type=float, default=0.995, help="Độ chính xác tối thiểu khi báo ô trống")
+    parser.add_argument("--output", default=EMPTY_MODEL_PATH)
+    args = parser.parse_args()
+
+    params = calibrate(args.data, args.precision)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(params, f, ensure_ascii=False, indent=2)
+
+    share = params["recall"] * params["num_empty"] / (params["num_empty"] + params["num_other"])
+    print(f"✅ Đã lưu bộ lọc ô trống tại: {args.output}")
+    print(f" + Precision: {params['precision']:.4f} (mục tiêu {args.precision}), recall: {params['recall']:.4f}")
+    print(f" + Ước tính bỏ qua {share:.1%} lượt suy luận CNN trên tập hiệu chuẩn")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import argparse
+import numpy as np
+import tensorflow as tf
+from cnn_classification import BASE_DIR, MODEL_PATH, TFLiteBackend
+
+# Tham số chia tập giống train_cnn.ipynb để kiểm tra trên đúng tập Val
+IMG_SIZE = (128, 128)
+VALIDATION_SPLIT = 0.2
+SEED = 123
+
+def load_split(data_dir, subset, img_size=IMG_SIZE, batch_size=32):
+    '''Đọc tập train/val theo cùng cách chia 80/20 của notebook'''
+    return tf.keras.utils.image_dataset_from_directory(
+        data_dir, validation_split=VALIDATION_SPLIT, subset=subset, seed=SEED,
+        image_size=img_size, batch_size=batch_size, label_mode='int')
+
+def export_tflite(model, output_path, quant="float16", data_dir=None, num_calib=200):
+    '''Chuyển mô hình Keras sang TFLite với lượng tử hóa float16 hoặc int8'''
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quant == "int8":
+        if data_dir is None:
+            raise ValueError("Lượng tử hóa int8 cần --data để lấy ảnh hiệu chuẩn")
+        calib_ds = load_split(data_dir, 'training', model.input_shape[1:3], batch_size=1)
+
+        def representative_dataset():
+            for images, _ in calib_ds.take(num_calib):
+                yield [tf.cast(images, tf.float32)]
+
+        converter.representative_dataset = representative_dataset
+    elif quant != "dynamic":
+        raise ValueError(f"Kiểu lượng tử hóa không hợp lệ: {quant}")
+
+    tflite_model = converter.convert()
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+    return output_path
+
+def check_parity(model, tflite_path, data_dir):
+    '''So sánh độ chính xác mô hình Keras và TFLite trên tập Val'''
+    backend = TFLiteBackend(tflite_path)
+    val_ds = load_split(data_dir, 'validation', model.input_shape[1:3])
+
+    n = keras_correct = lite_correct = agree = 0
+    max_diff = 0.0
+    for images, labels in val_ds:
+        images = images.numpy().astype(np.float32)
+        labels = labels.numpy()
+        keras_probs = model(images, training=False).numpy()
+        lite_probs = backend(images)
+
+        keras_pred = keras_probs.argmax(axis=1)
+        lite_pred = lite_probs.argmax(axis=1)
+        keras_correct += int((keras_pred == labels).sum())
+        lite_correct += int((lite_pred == labels).sum())
+        agree += int((keras_pred == lite_pred).sum())
+        max_diff = max(max_diff, float(np.abs(keras_probs - lite_probs).max()))
+        n += len(labels)
+
+    return {
+        "num_images": n,
+        "keras_accuracy": keras_correct / n,
+        "tflite_accuracy": lite_correct / n,
+        "agreement": agree / n,
+        "max_prob_diff": max_diff
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất mô hình phân loại món ăn sang TFLite lượng tử hóa")
+    parser.add_argument("--model", default=MODEL_PATH, help="Đường dẫn mô hình .h5")
+    parser.add_argument("--quant", choices=["float16", "int8", "dynamic"], default="float16")
+    parser.add_argument("--output", default=None, help="Đường dẫn file .tflite đầu ra")
+    parser.add_argument("--data", default=os.path.join(BASE_DIR, "data"), help="Thư mục dataset (hiệu chuẩn/kiểm tra)")
+    parser.add_argument("--no-check", action="store_true", help="Bỏ qua kiểm tra độ chính xác trên tập Val")
+    parser.add_argument("--max-drop", type=float, default=0.01, help="Mức giảm độ chính xác tối đa cho phép")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(os.path.dirname(args.model), f"cnn_food_classifier_{args.quant}.tflite")
+    model = tf.keras.models.load_model(args.model)
+    export_tflite(model, output, args.quant, args.data)
+    print(f"✅ Đã xuất mô hình TFLite ({args.quant}) tại: {output} ({os.path.getsize(output) / 1024:.0f} KB)")
+
+    if args.no_check:
+        return
+
+    report = check_parity(model, output, args.data)
+    print(f" + Số ảnh Val:           {report['num_images']}")
+    print(f" + Độ chính xác Keras:   {report['keras_accuracy']:.4f}")
+    print(f" + Độ chính xác TFLite:  {report['tflite_accuracy']:.4f}")
+    print(f" + Tỷ lệ trùng nhãn:     {report['agreement']:.4f}")
+    print(f" + Chênh lệch xác suất:  {report['max_prob_diff']:.4f}")
+
+    drop = report['keras_accuracy'] - report['tflite_accuracy']
+    if drop > args.max_drop:
+        print(f"❌ Độ chính xác giảm {drop:.2%}, vượt ngưỡng {args.max_drop:.2%}!")
+        raise SystemExit(1)
+    print("✅ Mô hình TFLite đạt yêu cầu tương đương mô hình Keras.")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import os
+import copy
 import json
 import platform
 import random
 import string
-import requests
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
 from datetime import datetime
@@ -11,18 +12,53 @@ from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4, portrait
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 from reportlab.graphics.barcode import createBarcodeDrawing
+import metrics
+from vietqr import ACCOUNT_NO, ACCOUNT_NAME, qr_drawing
+
+@lru_cache(maxsize=64)
+def _fetch_vietqr_png(amount):
+    '''Tải ảnh QR từ img.vietqr.io (chỉ dùng khi bật chế độ HTTP/dự phòng)'''
+    import requests
+    qr_url = ("https://img.vietqr.io/image/sacombank-050134744526-compact2.png"
+              f"?amount={int(amount)}"
+              "&addInfo=THANH+TOAN+CHO+UEH+SMART+CANTEEN"
+              "&accountName=UEH+SMART+CANTEEN")
+    response = requests.get(qr_url, timeout=15)
+    response.raise_for_status()
+    return response.content
+
+def new_bill_id():
+    '''Mã hóa đơn duy nhất, tăng dần theo thời gian: mili-giây (base36) + 4 ký tự ngẫu nhiên'''
+    alphabet = string.digits + string.ascii_uppercase
+    ms, stamp = int(datetime.now().timestamp() * 1000), ''
+    while ms:
+        ms, r = divmod(ms, 36)
+        stamp = alphabet[r] + stamp
+    return stamp + ''.join(random.choices(alphabet, k=4))
+
+# Khổ giấy in nhiệt của hóa đơn
+RECEIPT_WIDTH, RECEIPT_HEIGHT = 50*mm, 150*mm
+RECEIPT_SIDE_MARGIN = 2*mm
 
 class BillGenerator:
     """Lớp để tạo hóa đơn PDF từ kết quả phân loại món ăn"""
     _font_registered = False
 
-    def __init__(self, menu_path=None, logo_path=None, vn_labels_path=None):
-        '''Khởi tạo BillGenerator'''
+    def __init__(self, menu_path=None, logo_path=None, vn_labels_path=None,
+                 qr_mode="offline", qr_http_fallback=True):
+        '''Khởi tạo BillGenerator
+
+        qr_mode: "offline" (tự sinh VietQR) hoặc "http" (tải từ img.vietqr.io).
+        qr_http_fallback: khi sinh offline lỗi thì thử tải qua HTTP.
+        '''
+        self.qr_mode = qr_mode
+        self.qr_http_fallback = qr_http_fallback
+
         # Thư mục gốc dự án (parent của file này)
         base_dir = Path(__file__).parent.parent
 
@@ -50,6 +86,9 @@ class BillGenerator:
         # Đăng ký font hỗ trợ tiếng Việt
         self._register_vietnamese_font()
 
+        # Phần tĩnh của hóa đơn, dựng một lần khi tạo PDF đầu tiên
+        self._template = None
+
 
     @classmethod
     def _register_vietnamese_font(cls):
@@ -143,22 +182,14 @@ class BillGenerator:
         return {
             'items': items,
             'total': total,
+            'id': new_bill_id(),
             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
 
-    def generate_pdf(self, bill, output_path=None):
-        '''Tạo file PDF hóa đơn'''
-        if output_path is None:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            output_dir = Path(__file__).parent.parent / 'bills'
-            output_dir.mkdir(parents=True, exist_ok=True)
-            output_path = output_dir / f'bill_{timestamp}.pdf'
-
-        receipt_width, receipt_height = 50*mm, 150*mm
-
-        doc = SimpleDocTemplate(str(output_path), pagesize=(receipt_width, receipt_height),
-                                rightMargin=2*mm, leftMargin=2*mm, topMargin=3*mm, bottomMargin=3*mm)
-        story = []
+    def _build_template(self):
+        '''Dựng một lần các phần tĩnh của hóa đơn (styles, logo, header, dòng kẻ, lời cảm ơn)'''
+        if self._template is not None:
+            return self._template
 
         # Styles
         vn_font = self._vietnamese_font
@@ -176,7 +207,7 @@ class BillGenerator:
 
         # Logo và info
         logo_path = Path(self.logo_path)
-        usable_width = receipt_width - doc.leftMargin - doc.rightMargin
+        usable_width = RECEIPT_WIDTH - 2*RECEIPT_SIDE_MARGIN
 
         logo_width, logo_height = 11*mm, 7*mm
         logo_img = Image(str(logo_path), width=logo_width, height=logo_height)
@@ -199,28 +230,52 @@ class BillGenerator:
             ('TOPPADDING', (0, 0), (-1, -1), 0),
             ('BOTTOMPADDING', (0, 0), (-1, -1), 0),]))
 
-        story.append(header_table)
-        story.append(Spacer(1, 1*mm))
-
-        # Tiêu đề hóa đơn
-        story.append(Spacer(1, 3*mm))
-        story.append(Paragraph("PHIẾU THANH TOÁN", title_style))
-        story.append(Paragraph("."*85, small_style))
-        story.append(Spacer(1, 0.5*mm))
+        dots = Paragraph("."*85, small_style)
+        self._template = {
+            'usable_width': usable_width,
+            'normal_style': normal_style,
+            'bold_style': bold_style,
+            'small_style': small_style,
+            'dots': dots,
+            # Header + tiêu đề hóa đơn
+            'header': [header_table, Spacer(1, 1*mm), Spacer(1, 3*mm),
+                       Paragraph("PHIẾU THANH TOÁN", title_style), dots, Spacer(1, 0.5*mm)],
+            'items_title': [Paragraph("<b>DANH SÁCH MÓN ĂN</b>", bold_style), Spacer(1, 0.5*mm)],
+            'vat_note': Paragraph("(Đã bao gồm thuế GTGT)", small_style),
+            'account_note': Paragraph(f'<para align="center">{ACCOUNT_NAME} - Sacombank {ACCOUNT_NO}</para>', small_style),
+            # Lời cảm ơn
+            'footer': [dots, Spacer(1, 2*mm),
+                       Paragraph('<para align="center">Cảm ơn quý khách & Hẹn gặp lại</para>', small_style),
+                       Spacer(1, 1*mm)],
+        }
+        return self._template
+
+    def _new_doc(self, target):
+        '''Tạo SimpleDocTemplate khổ giấy in nhiệt 50x150mm'''
+        return SimpleDocTemplate(target, pagesize=(RECEIPT_WIDTH, RECEIPT_HEIGHT),
+                                 rightMargin=RECEIPT_SIDE_MARGIN, leftMargin=RECEIPT_SIDE_MARGIN,
+                                 topMargin=3*mm, bottomMargin=3*mm)
+
+    def _bill_story(self, bill):
+        '''Ghép phần tĩnh của template với phần thay đổi (món, tổng, mã hóa đơn, QR)'''
+        tpl = self._build_template()
+        usable_width = tpl['usable_width']
+        normal_style, bold_style, small_style = tpl['normal_style'], tpl['bold_style'], tpl['small_style']
+        dots = tpl['dots']
+        story = list(tpl['header'])
 
         # Thông tin hóa đơn
-        random_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+        random_id = bill.get('id') or new_bill_id()
         timestamp = bill.get('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
         story.append(Paragraph(f"Thu ngân:   &nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;2025POS01", small_style))
         story.append(Paragraph(f"Thời gian:  &nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;{timestamp}", small_style))
         story.append(Paragraph(f"Mã hóa đơn: &nbsp;&nbsp; {random_id}", small_style))
         story.append(Paragraph(f"Số món:     &nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;{len(bill.get('items', []))}", small_style))
-        story.append(Paragraph("."*85, small_style))
+        story.append(dots)
         story.append(Spacer(1, 1*mm))
 
         # Danh sách món ăn
-        story.append(Paragraph("<b>DANH SÁCH MÓN ĂN</b>", bold_style))
-        story.append(Spacer(1, 0.5*mm))
+        story.extend(tpl['items_title'])
 
         table_data = []
         col_w_name = usable_width * 0.7
@@ -258,29 +313,20 @@ class BillGenerator:
         story.append(table)
         story.append(Spacer(1, 0.5*mm))
 
-        story.append(Paragraph("."*85, small_style))
+        story.append(dots)
         story.append(Spacer(1, 0.5*mm))
 
         # Tổng tiền
         total_str = f"{bill.get('total', 0):,}"
         total_text = f"<b>Tổng cộng: &nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;{total_str} VND</b>"
         story.append(Paragraph(total_text, bold_style))
-        story.append(Paragraph("(Đã bao gồm thuế GTGT)", small_style))
-        story.append(Paragraph("."*85, small_style))
+        story.append(tpl['vat_note'])
+        story.append(dots)
         story.append(Spacer(1, 0.5*mm))
 
-        # Sinh QR code tự động qua VietQR.io
+        # Sinh QR code VietQR (offline, cache theo số tiền; HTTP chỉ là dự phòng)
         total_amount = float(bill.get('total', 0))
-        qr_url = ("https://img.vietqr.io/image/sacombank-050134744526-compact2.png"
-                  f"?amount={int(total_amount)}"
-                  "&addInfo=THANH+TOAN+CHO+UEH+SMART+CANTEEN"
-                  "&accountName=UEH+SMART+CANTEEN")
-
-        response = requests.get(qr_url, timeout=15)
-        response.raise_for_status()
-
-        qr_bytes = BytesIO(response.content)
-        qr_img = Image(qr_bytes, width=30*mm, height=35*mm)
+        qr_img = self._qr_flowable(int(total_amount))
 
         qr_table = Table([[qr_img]], colWidths=[usable_width], hAlign='CENTER')
         qr_table.setStyle(TableStyle([
@@ -292,15 +338,11 @@ class BillGenerator:
         ]))
         story.append(Spacer(1, 1*mm))
         story.append(qr_table)
+        story.append(tpl['account_note'])
         story.append(Spacer(1, 0.5*mm))
 
-        story.append(Paragraph("."*85, small_style))
-        story.append(Spacer(1, 2*mm))
-
         # Lời cảm ơn
-        footer_text = "Cảm ơn quý khách & Hẹn gặp lại"
-        story.append(Paragraph(f'<para align="center">{footer_text}</para>', small_style))
-        story.append(Spacer(1, 1*mm))
+        story.extend(tpl['footer'])
 
         # Barcode (Code128) để tra cứu hóa đơn
         bc = createBarcodeDrawing('Code128', value=random_id, barHeight=5*mm, humanReadable=False)
@@ -316,21 +358,59 @@ class BillGenerator:
         story.append(Spacer(1, 1*mm))
         story.append(bc_table)
         story.append(Spacer(1, 2*mm))
+        return story
 
-        # Xuất file PDF và tự động mở
-        doc.build(story)
-        '''
-        abs_path = os.path.abspath(output_path)
-        system = platform.system()
-        if system == "Windows":
-            os.startfile(abs_path)
+    def generate_pdf(self, bill, output_path=None):
+        '''Tạo file PDF hóa đơn (output_path có thể là đường dẫn hoặc file-like như BytesIO)'''
+        if output_path is None:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            output_dir = Path(__file__).parent.parent / 'bills'
+            output_dir.mkdir(parents=True, exist_ok=True)
+            output_path = output_dir / f'bill_{timestamp}_{bill.get("id", new_bill_id())}.pdf'
+
+        target = output_path if hasattr(output_path, 'write') else str(output_path)
+        story = self._bill_story(bill)
+        with metrics.timer("pdf_build"):
+            self._new_doc(target).build(story)
+        return output_path if target is output_path else str(output_path)
+
+    def generate_bulk_pdf(self, bills, output_path):
+        '''Xuất nhiều hóa đơn vào một file PDF nhiều trang (mỗi hóa đơn một trang) bằng một lần build'''
+        story = []
+        for i, bill in enumerate(bills):
+            if i:
+                story.append(PageBreak())
+            story.extend(self._bill_story(bill))
+
+        target = output_path if hasattr(output_path, 'write') else str(output_path)
+        with metrics.timer("pdf_build_bulk"):
+            self._new_doc(target).build(story)
+        return output_path if target is output_path else str(output_path)
+
+    def _qr_flowable(self, amount):
+        '''Trả về flowable mã QR thanh toán cho số tiền'''
+        if self.qr_mode == "offline":
             try:
-                if tmp_qr.exists():
-                    tmp_qr.unlink()
+                with metrics.timer("qr_offline"):
+                    return qr_drawing(amount, ACCOUNT_NO, 30*mm)
             except Exception:
-                pass
-        '''
-        return str(output_path)
+                metrics.inc("qr_offline_failures_total")
+                if not self.qr_http_fallback:
+                    raise
+        with metrics.timer("qr_http"):
+            return Image(BytesIO(_fetch_vietqr_png(amount)), width=30*mm, height=35*mm)
+
+    def clone(self):
+        '''Bản sao dùng riêng cho một luồng (flowable trong template không an toàn khi build song song)'''
+        other = copy.copy(self)
+        other._template = None
+        return other
+
+    def render_pdf_bytes(self, bill):
+        '''Tạo hóa đơn PDF hoàn toàn trong bộ nhớ, trả về bytes'''
+        buffer = BytesIO()
+        self.generate_pdf(bill, buffer)
+        return buffer.getvalue()
 
 
     def generate_bill_from_predictions(self, predictions, output_path=None):
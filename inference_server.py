@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from batch_process import detect_and_crop
+
+MAX_BODY_BYTES = 20 * 1024 * 1024
+HTTP_STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+               422: "Unprocessable Entity", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class MicroBatcher:
+    """Gộp các ô từ nhiều request đồng thời thành batch động cho mô hình"""
+
+    def __init__(self, classifier, max_batch_size=32, max_wait_ms=5, top_k=3, max_pending_batches=4):
+        '''max_pending_batches: hàng đợi chứa tối đa chừng này batch ô; đầy thì từ chối request (503)'''
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.top_k = top_k
+        self.queue = asyncio.Queue(maxsize=max_batch_size * max_pending_batches)
+        # Mô hình chạy trên một luồng riêng để không chặn event loop
+        self._model_thread = ThreadPoolExecutor(max_workers=1)
+        self.batches = self.items = 0
+
+    async def predict(self, crops):
+        '''Đưa các ô của một khay vào hàng đợi, chờ kết quả theo đúng thứ tự ô
+
+        Hàng đợi không đủ chỗ cho cả khay thì báo asyncio.QueueFull ngay (không xếp một phần khay).
+        '''
+        if self.queue.maxsize - self.queue.qsize() < len(crops):
+            raise asyncio.QueueFull
+        loop = asyncio.get_running_loop()
+        futures = []
+        for name, img in crops.items():
+            fut = loop.create_future()
+            self.queue.put_nowait((name, img, fut))
+            futures.append(fut)
+        return await asyncio.gather(*futures)
+
+    async def run(self):
+        '''Vòng lặp gom batch: lấy tới max_batch_size ô hoặc chờ tối đa max_wait'''
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images = {i: img for i, (_, img, _) in enumerate(batch)}
+            try:
+                results = await loop.run_in_executor(
+                    self._model_thread, self.classifier.predict_batch, images, self.top_k)
+            except Exception as e:
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (name, _, fut), result in zip(batch, results):
+                result["cell"] = name
+                if not fut.done():
+                    fut.set_result(result)
+
+class InferenceServer:
+    """Dịch vụ HTTP asyncio: POST /predict với nội dung là ảnh khay (jpg/png)"""
+
+    def __init__(self, classifier, bill_gen, workers=None, max_batch_size=32, max_wait_ms=5, top_k=3):
+        self.classifier = classifier
+        self.bill_gen = bill_gen
+        self.batcher = MicroBatcher(classifier, max_batch_size, max_wait_ms, top_k)
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                        mp_context=multiprocessing.get_context("spawn"))
+
+    async def process(self, image_bytes):
+        '''detect -> crop (tiến trình con) -> phân loại (batch động) -> tính tiền'''
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        crops = await loop.run_in_executor(self.pool, detect_and_crop, image_bytes)
+        t1 = time.perf_counter()
+        if crops is None:
+            return 422, {"error": "tray_not_found", "timing": {"detect_ms": (t1 - t0) * 1000}}
+
+        try:
+            predictions = await self.batcher.predict(crops)
+        except asyncio.QueueFull:
+            return 503, {"error": "overloaded"}
+        t2 = time.perf_counter()
+        bill = self.bill_gen.calculate_bill(predictions)
+        t3 = time.perf_counter()
+
+        return 200, {
+            "predictions": predictions,
+            "bill": bill,
+            "timing": {
+                "detect_ms": (t1 - t0) * 1000,
+                "classify_ms": (t2 - t1) * 1000,
+                "bill_ms": (t3 - t2) * 1000,
+                "total_ms": (t3 - t0) * 1000
+            }
+        }
+
+    async def handle(self, reader, writer):
+        '''Xử lý một kết nối HTTP/1.1 đơn giản (một request rồi đóng)'''
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+            if len(request_line) < 2:
+                status, body = 400, {"error": "bad_request"}
+            elif request_line[0] == "GET" and request_line[1] == "/health":
+                status, body = 200, {"status": "ok", "batches": self.batcher.batches,
+                                     "items": self.batcher.items}
+            elif request_line[0] == "POST" and request_line[1] == "/predict":
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = None
+                if length is None:
+                    status, body = 400, {"error": "bad_content_length"}
+                elif length <= 0:
+                    status, body = 400, {"error": "empty_body"}
+                elif length > MAX_BODY_BYTES:
+                    status, body = 413, {"error": "payload_too_large"}
+                else:
+                    status, body = await self.process(await reader.readexactly(length))
+            else:
+                status, body = 404, {"error": "not_found"}
+        except Exception as e:
+            # Chi tiết lỗi chỉ ghi ở phía máy chủ, không trả về cho client
+            print(f"❌ Lỗi xử lý request: {type(e).__name__}: {e}")
+            status, body = 500, {"error": "internal_error"}
+
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        writer.write((f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+                      "Content-Type: application/json; charset=utf-8\r\n"
+                      f"Content-Length: {len(payload)}\r\n"
+                      "Connection: close\r\n\r\n").encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        batch_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"🚀 Dịch vụ nhận diện khay đang chạy tại http://{host}:{port} (POST /predict)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Dịch vụ HTTP nhận diện khay cơm dùng chung cho nhiều quầy")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Số tiến trình OpenCV")
+    parser.add_argument("--max-batch", type=int, default=32, help="Số ô tối đa mỗi batch mô hình")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="Thời gian chờ tối đa để gom batch")
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    from cnn_classification import CNNFoodClassifier
+    from infer_bill import BillGenerator
+    server = InferenceServer(CNNFoodClassifier(), BillGenerator(), args.workers,
+                             args.max_batch, args.max_wait_ms, args.top_k)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nĐã dừng dịch vụ.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import time
+import atexit
+import sqlite3
+import threading
+from pathlib import Path
+
+LEDGER_PATH = Path(__file__).parent.parent / "bills" / "ledger.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bills (
+    id            TEXT PRIMARY KEY,
+    created_at    TEXT NOT NULL,
+    total         INTEGER NOT NULL,
+    num_items     INTEGER NOT NULL,
+    model_version TEXT,
+    pdf_path      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bills_created_at ON bills(created_at);
+CREATE TABLE IF NOT EXISTS bill_items (
+    bill_id    TEXT NOT NULL REFERENCES bills(id),
+    position   INTEGER NOT NULL,
+    class      TEXT,
+    name       TEXT,
+    price      INTEGER NOT NULL,
+    quantity   INTEGER NOT NULL,
+    confidence REAL,
+    PRIMARY KEY (bill_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_items_class ON bill_items(class);
+"""
+
+class SalesLedger:
+    """Sổ bán hàng SQLite (WAL): ghi hóa đơn theo lô, tra cứu theo mã và thống kê doanh thu"""
+
+    def __init__(self, db_path=LEDGER_PATH, batch_size=20, flush_interval=5.0):
+        '''batch_size/flush_interval: ghi xuống đĩa khi đủ số hóa đơn hoặc quá số giây chờ
+
+        flush_interval được đảm bảo bằng một timer nền, kể cả khi không còn hóa đơn mới nào được ghi.
+        '''
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+        self._last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    def record(self, bill, model_version=None, pdf_path=None):
+        '''Thêm một hóa đơn (từ BillGenerator.calculate_bill) vào hàng đợi ghi'''
+        with self._lock:
+            self._pending.append((bill, model_version, None if pdf_path is None else str(pdf_path)))
+            due = (len(self._pending) >= self.batch_size
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+            if not due:
+                self._arm_timer()
+        if due:
+            self.flush()
+
+    def _arm_timer(self):
+        # Hóa đơn lẻ cuối ca (hoặc lô ghi lỗi) vẫn được ghi sau tối đa flush_interval giây
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        '''Ghi mọi hóa đơn đang chờ trong một transaction
+
+        Hóa đơn chỉ rời hàng đợi khi transaction commit thành công; lỗi thì giữ lại để lần sau ghi tiếp.
+        Trả về True nếu không còn hóa đơn nào chờ ghi.
+        '''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._last_flush = time.monotonic()
+            pending = list(self._pending)
+            if not pending or self._conn is None:
+                return not pending
+            bills, items = [], []
+            for bill, model_version, pdf_path in pending:
+                bill_items = bill.get("items", [])
+                bills.append((bill["id"], bill["timestamp"], int(bill.get("total", 0)), len(bill_items),
+                              model_version, pdf_path))
+                items.extend((bill["id"], pos, it.get("class"), it.get("name"), int(it.get("price", 0)),
+                              int(it.get("quantity", 1)), float(it.get("confidence", 0.0)))
+                             for pos, it in enumerate(bill_items, 1))
+            try:
+                with self._conn:
+                    # OR IGNORE: ghi lại một hóa đơn đã có (thử lại, xuất lại) không làm hỏng cả lô
+                    self._conn.executemany("INSERT OR IGNORE INTO bills VALUES (?, ?, ?, ?, ?, ?)", bills)
+                    self._conn.executemany("INSERT OR IGNORE INTO bill_items VALUES (?, ?, ?, ?, ?, ?, ?)", items)
+            except sqlite3.Error as e:
+                print(f"❌ Không thể ghi {len(pending)} hóa đơn vào sổ bán hàng (sẽ thử lại): {e}")
+                self._arm_timer()
+                return False
+            del self._pending[:len(pending)]
+            return True
+
+    def close(self):
+        if self._conn is None:
+            return
+        if not self.flush():
+            print(f"⚠️ Còn {len(self._pending)} hóa đơn chưa ghi được vào sổ bán hàng khi đóng")
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _query(self, sql, params=()):
+        self.flush()
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def get_bill(self, bill_id):
+        '''Tra cứu một hóa đơn theo mã (mã vạch Code128 in trên hóa đơn)'''
+        rows = self._query("SELECT * FROM bills WHERE id = ?", (bill_id,))
+        if not rows:
+            return None
+        bill = rows[0]
+        bill["items"] = self._query("SELECT class, name, price, quantity, confidence FROM bill_items "
+                                    "WHERE bill_id = ? ORDER BY position", (bill_id,))
+        return bill
+
+    def bills_between(self, start, end):
+        '''Danh sách hóa đơn trong khoảng thời gian [start, end) dạng "YYYY-MM-DD[ HH:MM:SS]"'''
+        return self._query("SELECT * FROM bills WHERE created_at >= ? AND created_at < ? ORDER BY created_at",
+                           (start, end))
+
+    def daily_revenue(self, start="0000", end="9999"):
+        '''Doanh thu và số hóa đơn theo ngày'''
+        return self._query("SELECT substr(created_at, 1, 10) AS day, COUNT(*) AS bills, SUM(total) AS revenue "
+                           "FROM bills WHERE created_at >= ? AND created_at < ? GROUP BY day ORDER BY day",
+                           (start, end))
+
+    def dish_totals(self, start="0000", end="9999"):
+        '''Số lượng, doanh thu và độ tin cậy trung bình theo từng món'''
+        return self._query("SELECT i.class, i.name, SUM(i.quantity) AS quantity, SUM(i.price * i.quantity) AS revenue, "
+                           "AVG(i.confidence) AS avg_confidence "
+                           "FROM bill_items i JOIN bills b ON b.id = i.bill_id "
+                           "WHERE b.created_at >= ? AND b.created_at < ? "
+                           "GROUP BY i.class ORDER BY revenue DESC", (start, end))
+
+def main():
+    import json
+    import argparse
+    parser = argparse.ArgumentParser(description="Tra cứu sổ bán hàng (hóa đơn, doanh thu theo ngày/món)")
+    parser.add_argument("--db", default=str(LEDGER_PATH))
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("lookup", help="Tra cứu hóa đơn theo mã").add_argument("bill_id")
+    for name in ("daily", "dishes"):
+        p = sub.add_parser(name, help="Doanh thu theo ngày" if name == "daily" else "Thống kê theo món")
+        p.add_argument("--start", default="0000", help="Từ ngày YYYY-MM-DD")
+        p.add_argument("--end", default="9999", help="Đến trước ngày YYYY-MM-DD")
+    args = parser.parse_args()
+
+    with SalesLedger(args.db) as ledger:
+        if args.command == "lookup":
+            result = ledger.get_bill(args.bill_id)
+        elif args.command == "daily":
+            result = ledger.daily_revenue(args.start, args.end)
+        else:
+            result = ledger.dish_totals(args.start, args.end)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
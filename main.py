@@ -1,19 +1,76 @@
+import time
+_T0 = time.perf_counter()   # mốc khởi động, đặt trước mọi import nặng
+
 import os
-import cv2
+import json
+import argparse
+import threading
 import datetime
+import metrics
 from tkinter import Tk, filedialog, messagebox
-from detect_tray import perspective_tray, crop_cell
-from cnn_classification import CNNFoodClassifier
-from infer_bill import BillGenerator
 
 # Thư mục xuất
 CROP_DIR = "./data_crop"
-os.makedirs(CROP_DIR, exist_ok=True)
+STARTUP_LOG = "./logs/startup.jsonl"
+
+class PipelineLoader(threading.Thread):
+    """Nạp TensorFlow/ReportLab, mô hình và chạy thử một batch giả trên luồng nền"""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.pipeline = None
+        self.error = None
+        self.ready_at = None
+
+    def run(self):
+        try:
+            import numpy as np
+            from empty_cell import load_detector
+            from ledger import SalesLedger
+            from pipeline import TrayPipeline, DiskSink, BILL_DIR
+
+            # Ảnh từng ô + predictions.json và hóa đơn PDF được lưu qua DiskSink
+            pipeline = TrayPipeline(sink=DiskSink(crop_dir=CROP_DIR, bill_dir=BILL_DIR),
+                                    empty_detector=load_detector(), ledger=SalesLedger())
+
+            # Làm nóng: biên dịch đồ thị mô hình và dựng sẵn template hóa đơn
+            h, w = pipeline.classifier.img_size
+            pipeline.classifier.predict_batch([np.zeros((h, w, 3), np.uint8)] * 5)
+            pipeline.bill_gen._build_template()
+            pipeline.classifier.reset_cascade_stats()
+            self.pipeline = pipeline
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready_at = time.perf_counter()
+
+def report_startup(timings):
+    '''In và ghi lại (JSONL) thời gian khởi động để theo dõi cold-start'''
+    print("\n⏱️ Thời gian khởi động:")
+    for name, seconds in timings.items():
+        print(f" + {name:<22}{seconds:6.2f} giây")
+        metrics.observe("startup_seconds", seconds, buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 60), phase=name)
+    os.makedirs(os.path.dirname(STARTUP_LOG), exist_ok=True)
+    with open(STARTUP_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"time": datetime.datetime.now().isoformat(timespec="seconds"), **timings}) + "\n")
 
 # Chương trình chính
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nhận diện và tính tiền phần ăn từ ảnh khay cơm")
+    parser.add_argument("--metrics", default=None, help="Ghi số liệu thời gian từng stage ra file (.json hoặc .prom)")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+
+    os.makedirs(CROP_DIR, exist_ok=True)
+
+    # Nạp mô hình song song trong lúc người dùng đọc hướng dẫn và chọn ảnh
+    loader = PipelineLoader()
+    loader.start()
+
     root = Tk()
     root.withdraw()
+    first_dialog = time.perf_counter() - _T0
 
     # Hướng dẫn người dùng
     user_choice = messagebox.askquestion(
@@ -38,48 +95,51 @@ if __name__ == "__main__":
         exit()
 
     try:
-        # Bước 1: Phát hiện & chỉnh phối cảnh khay
-        fixed = perspective_tray(img_path)
-        if fixed is None:
-            print("❌ Không thể xác định khay! Vui lòng chụp lại ảnh khay cơm!\n")
-            exit()
+        # Chờ mô hình (thường đã sẵn sàng khi người dùng chọn xong ảnh)
+        wait_start = time.perf_counter()
+        loader.join()
+        model_wait = time.perf_counter() - wait_start
+        if loader.error is not None:
+            raise loader.error
+        pipeline = loader.pipeline
 
-        # Bước 2: Cắt khay ra thành 5 ô thức ăn
-        cropped = crop_cell(fixed)
-        if not cropped:
-            print("❌ Không thể cắt ảnh khay! Vui lòng chụp lại ảnh khay cơm!\n")
+        # Bước 1-4: Phát hiện khay, cắt 5 ô, phân loại và tính tiền (trong bộ nhớ)
+        result = pipeline.run(img_path)
+        if result is None:
+            print("❌ Không thể xác định khay! Vui lòng chụp lại ảnh khay cơm!\n")
             exit()
 
-        # Bước 3: Tạo thư mục con và lưu ảnh từng ô
-        subfolder = os.path.join(CROP_DIR, f"crop_{datetime.datetime.now().strftime('%H-%M-%S_%d-%m')}")
-        os.makedirs(subfolder, exist_ok=True)
-
-        for i, (_, crop_img) in enumerate(cropped.items(), start=1):
-            save_path = os.path.join(subfolder, f"cell_{i}.jpg")
-            success = cv2.imwrite(save_path, crop_img)
-
-        # Bước 4: Dự đoán món ăn bằng mô hình CNN đã huấn luyện
-        classifier = CNNFoodClassifier()
-        results = []
-
-        for filename in os.listdir(subfolder):
-            if filename.lower().endswith((".jpg", ".jpeg", ".png")):
-                img_path = os.path.join(subfolder, filename)
-                result = classifier.predict_image(img_path)
-                results.append(result)
-        
         print("\n✅ Kết quả phân loại 5 ô:")
-        for r in results:
-            print(f" + {os.path.basename(r['path'])}: {r['predicted_class']} ({r['confidence']:.1%})")
+        for r in result["predictions"]:
+            print(f" + {r['cell']}: {r['predicted_class']} ({r['confidence']:.1%})")
+        if pipeline.empty_detector is not None:
+            report = pipeline.empty_detector.report()
+            print(f"   (Bỏ qua CNN cho {report['skipped_inferences']}/{report['cells']} ô trống)")
+        if pipeline.classifier.fallback is not None:
+            report = pipeline.classifier.cascade_report()
+            print(f"   (Chạy lại bằng mô hình lớn {report['escalated']}/{report['cells']} ô, "
+                  f"{report['avg_ms_per_tray']:.0f} ms/khay)")
 
-        # Bước 5: Xuất hóa đơn PDF
-        bill_gen = BillGenerator()
-        bill, pdf_path = bill_gen.generate_bill_from_predictions(results)
+        # Bước 5: Hiển thị tổng tiền ngay, hóa đơn PDF được tạo trên luồng nền
+        pdf_future = pipeline.submit_pdf(result["bill"])
+        print(f"\n💰 Tổng cộng: {result['bill']['total']:,} VND (đang tạo hóa đơn PDF...)")
+        _, pdf_path = pdf_future.result()
         print(f"\n📂 Hóa đơn đã được tạo thành công và lưu tại: {pdf_path}")
 
+        report_startup({
+            "first_dialog": first_dialog,
+            "model_ready": loader.ready_at - _T0,
+            "model_wait": model_wait,
+            "first_result": time.perf_counter() - _T0,
+        })
+
     except Exception as e:
         print(f"❌ Lỗi xử lý: {e}")
         exit()
+    finally:
+        if args.metrics:
+            print(f"📊 Số liệu hiệu năng đã lưu tại: {metrics.dump(args.metrics)}")
 
+    import cv2
     cv2.waitKey(0)
-    cv2.destroyAllWindows()
\ No newline at end of file
+    cv2.destroyAllWindows()
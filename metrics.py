@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+
+# Tắt mặc định; bật bằng biến môi trường FOOD_METRICS=1 hoặc gọi enable()
+ENABLED = os.environ.get("FOOD_METRICS", "0") == "1"
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+CONFIDENCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1.0)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+class Histogram:
+    """Histogram tích lũy kiểu Prometheus (đếm theo ngưỡng trên của từng bucket)"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # bucket cuối là +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe("stage_latency_ms", (time.perf_counter() - self.start) * 1000, stage=self.stage)
+        return False
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _NoopTimer()
+
+def enable(flag=True):
+    '''Bật/tắt thu thập số liệu lúc chạy'''
+    global ENABLED
+    ENABLED = flag
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def timer(stage):
+    '''Đo thời gian một stage: `with metrics.timer("warp"): ...` (gần như không tốn gì khi tắt)'''
+    return _Timer(stage) if ENABLED else _NOOP
+
+def inc(name, value=1, **labels):
+    '''Tăng bộ đếm, ví dụ inc("tray_detect_failures_total", reason="no_quad")'''
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, buckets=LATENCY_BUCKETS_MS, **labels):
+    '''Ghi một giá trị vào histogram'''
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = Histogram(buckets)
+        hist.observe(value)
+
+def snapshot():
+    '''Ảnh chụp số liệu hiện tại dạng dict (xuất JSON được)'''
+    with _lock:
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(_counters.items())],
+            "histograms": [{"name": name, "labels": dict(labels), "buckets": list(h.buckets),
+                            "counts": list(h.counts), "sum": h.sum, "count": h.count}
+                           for (name, labels), h in sorted(_histograms.items())]
+        }
+
+def _fmt_labels(labels, extra=None):
+    items = list(labels.items()) + ([extra] if extra else [])
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+def to_prometheus():
+    '''Xuất số liệu theo định dạng văn bản của Prometheus'''
+    snap = snapshot()
+    lines = []
+    for c in snap["counters"]:
+        lines.append(f"{c['name']}{_fmt_labels(c['labels'])} {c['value']}")
+    for h in snap["histograms"]:
+        cumulative = 0
+        for bound, n in zip(list(h["buckets"]) + ["+Inf"], h["counts"]):
+            cumulative += n
+            lines.append(f"{h['name']}_bucket{_fmt_labels(h['labels'], ('le', bound))} {cumulative}")
+        lines.append(f"{h['name']}_sum{_fmt_labels(h['labels'])} {h['sum']}")
+        lines.append(f"{h['name']}_count{_fmt_labels(h['labels'])} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+def dump(path):
+    '''Ghi số liệu ra file: .prom/.txt theo Prometheus, còn lại JSON'''
+    with open(path, "w", encoding="utf-8") as f:
+        if str(path).endswith((".prom", ".txt")):
+            f.write(to_prometheus())
+        else:
+            json.dump(snapshot(), f, ensure_ascii=False, indent=2)
+    return path
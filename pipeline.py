@@ -0,0 +1,156 @@
+import os
+import datetime
+import threading
+from pathlib import Path
+import cv2
+from detect_tray import load_image, perspective_tray, crop_cell
+from render_queue import PdfRenderQueue
+from utils import save_bill_json
+
+# Thư mục mặc định khi bật ghi đĩa
+CROP_DIR = "./data_crop"
+BILL_DIR = Path(__file__).parent.parent / "bills"
+
+class DiskSink:
+    """Ghi kết quả pipeline ra đĩa — chỉ dùng khi chủ động truyền vào TrayPipeline"""
+
+    def __init__(self, crop_dir=None, bill_dir=None):
+        '''crop_dir: nơi lưu ảnh từng ô + predictions.json; bill_dir: nơi lưu PDF (None = không lưu)'''
+        self.crop_dir = crop_dir
+        self.bill_dir = Path(bill_dir) if bill_dir else None
+
+    def save_tray(self, result):
+        '''Lưu ảnh 5 ô và predictions.json vào thư mục con crop_<giờ>_<ngày>'''
+        if not self.crop_dir:
+            return None
+        subfolder = os.path.join(self.crop_dir, f"crop_{datetime.datetime.now().strftime('%H-%M-%S_%d-%m')}")
+        os.makedirs(subfolder, exist_ok=True)
+
+        for i, (_, crop_img) in enumerate(result["crops"].items(), start=1):
+            cv2.imwrite(os.path.join(subfolder, f"cell_{i}.jpg"), crop_img)
+        save_bill_json(subfolder, result["predictions"], result["bill"])
+        return subfolder
+
+    def save_pdf(self, pdf_bytes, bill_id=None):
+        '''Lưu hóa đơn PDF dạng bytes vào bill_dir (tên file kèm mã hóa đơn để không trùng)'''
+        if not self.bill_dir:
+            return None
+        self.bill_dir.mkdir(parents=True, exist_ok=True)
+        suffix = f"_{bill_id}" if bill_id else ""
+        pdf_path = self.bill_dir / f"bill_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}.pdf"
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+        return str(pdf_path)
+
+class TrayPipeline:
+    """Pipeline phát hiện khay -> cắt ô -> phân loại -> tính hóa đơn, chạy hoàn toàn trong bộ nhớ"""
+
+    def __init__(self, classifier=None, bill_gen=None, sink=None, top_k=3, empty_detector=None, ledger=None,
+                 fixed_camera=None):
+        '''classifier/bill_gen có thể truyền sẵn; nếu không sẽ tự khởi tạo mặc định
+
+        empty_detector: EmptyCellDetector để bỏ qua CNN với ô trống (None = luôn chạy CNN).
+        ledger: SalesLedger để lưu các hóa đơn đã xuất (None = không lưu).
+        fixed_camera: FixedCamera (calibration.py) để bỏ qua bước dò khay với camera cố định.
+        '''
+        if classifier is None:
+            from cnn_classification import CNNFoodClassifier
+            classifier = CNNFoodClassifier()
+        if bill_gen is None:
+            from infer_bill import BillGenerator
+            bill_gen = BillGenerator()
+        self.classifier = classifier
+        self.bill_gen = bill_gen
+        self.sink = sink
+        self.top_k = top_k
+        self.empty_detector = empty_detector
+        self.ledger = ledger
+        self.fixed_camera = fixed_camera
+        # Tạo sẵn (luồng của pool chỉ khởi động khi có hóa đơn): nhiều phiên dùng chung pipeline không tạo trùng hàng đợi
+        self._render_queue = PdfRenderQueue(self._render_in_worker)
+        self._local = threading.local()
+
+    def run(self, image):
+        '''Xử lý một ảnh khay (bytes đã mã hóa, ndarray BGR hoặc đường dẫn)
+
+        Trả về dict gồm tray, crops, predictions, bill; None nếu không nhận diện được khay.
+        '''
+        if self.fixed_camera is not None:
+            raw = load_image(image)
+            if raw is None:
+                print("❌ Không thể đọc ảnh đầu vào!")
+                return None
+            rectified = self.fixed_camera.rectify(raw)
+            return None if rectified is None else self.classify_tray(*rectified)
+
+        fixed = perspective_tray(image)
+        if fixed is None:
+            return None
+        return self.classify_tray(fixed)
+
+    def classify_tray(self, fixed, crops=None):
+        '''Cắt ô (nếu chưa có), phân loại và tính tiền cho khay đã chỉnh phối cảnh'''
+        if crops is None:
+            crops = crop_cell(fixed)
+        if not crops:
+            return None
+
+        predictions = self.classify_crops(crops)
+        bill = self.bill_gen.calculate_bill(predictions)
+        result = {"tray": fixed, "crops": crops, "predictions": predictions, "bill": bill}
+        if self.sink is not None:
+            result["crop_folder"] = self.sink.save_tray(result)
+        return result
+
+    def classify_crops(self, crops):
+        '''Phân loại các ô; ô trống rõ ràng được gán khay_trong ngay, không chạy CNN'''
+        if self.empty_detector is None:
+            return self.classifier.predict_batch(crops, top_k=self.top_k)
+
+        empty, rest = self.empty_detector.split(crops)
+        predicted = {r["cell"]: r for r in self.classifier.predict_batch(rest, top_k=self.top_k)} if rest else {}
+        return [empty[name] if name in empty else predicted[name] for name in crops]
+
+    def classify_many(self, trays):
+        '''Phân loại các ô của nhiều khay trong một lượt chạy mô hình; trả về list predictions cho mỗi khay'''
+        if self.empty_detector is None:
+            return self.classifier.predict_trays(trays, top_k=self.top_k)
+
+        splits = [self.empty_detector.split(crops) for crops in trays]
+        predicted = self.classifier.predict_trays([rest for _, rest in splits], top_k=self.top_k)
+        results = []
+        for crops, (empty, _), preds in zip(trays, splits, predicted):
+            by_name = {r["cell"]: r for r in preds}
+            results.append([empty[name] if name in empty else by_name[name] for name in crops])
+        return results
+
+    def render_pdf(self, bill, bill_gen=None, issue=True):
+        '''Tạo hóa đơn PDF trong bộ nhớ; trả về (bytes, đường dẫn nếu sink có lưu)
+
+        issue=False chỉ tạo bytes (vd tạo sẵn để xem trước), chưa lưu file và chưa ghi sổ bán hàng.
+        '''
+        pdf_bytes = (bill_gen or self.bill_gen).render_pdf_bytes(bill)
+        pdf_path = self.issue_bill(bill, pdf_bytes) if issue else None
+        return pdf_bytes, pdf_path
+
+    def issue_bill(self, bill, pdf_bytes):
+        '''Xuất hóa đơn đã tạo: lưu PDF qua sink và ghi vào sổ bán hàng; trả về đường dẫn PDF'''
+        pdf_path = self.sink.save_pdf(pdf_bytes, bill.get("id")) if self.sink is not None else None
+        if self.ledger is not None:
+            self.ledger.record(bill, getattr(self.classifier, "model_version", None), pdf_path)
+        return pdf_path
+
+    def submit_pdf(self, bill, timeout=None, issue=True):
+        '''Tạo PDF trên luồng nền; trả về Future cho (bytes, đường dẫn) để hiển thị tổng tiền ngay
+
+        issue=False: chỉ tạo bytes, gọi issue_bill() khi người dùng thực sự xuất hóa đơn.
+        '''
+        return self._render_queue.submit((bill, issue), timeout)
+
+    def _render_in_worker(self, job):
+        # Mỗi luồng render dùng BillGenerator riêng (template ReportLab không chia sẻ giữa các luồng)
+        bill, issue = job
+        bill_gen = getattr(self._local, "bill_gen", None)
+        if bill_gen is None:
+            bill_gen = self._local.bill_gen = self.bill_gen.clone()
+        return self.render_pdf(bill, bill_gen, issue)
@@ -0,0 +1,246 @@
+import os
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from detect_tray import perspective_tray, crop_cell
+
+_STOP = object()
+
+def _detect_job(image):
+    '''Chạy trong tiến trình con: chỉnh phối cảnh khay, trả về (khay, số giây xử lý)'''
+    start = time.perf_counter()
+    tray = perspective_tray(image)
+    return tray, time.perf_counter() - start
+
+class _Job:
+    __slots__ = ("future", "submitted", "tray", "crops", "result")
+
+    def __init__(self):
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.tray = self.crops = self.result = None
+
+class PipelinedExecutor:
+    """Chạy chồng các stage cho hàng khay: dò khay (process pool) -> mô hình (một luồng, gom batch) -> hóa đơn
+
+    Ở trạng thái ổn định, thông lượng bị giới hạn bởi stage chậm nhất thay vì tổng các stage.
+    """
+
+    def __init__(self, pipeline, workers=None, max_in_flight=16, max_batch_trays=8, render_pdf=True,
+                 detect_fn=_detect_job):
+        '''
+        pipeline: TrayPipeline cung cấp classifier, bill_gen, sink, ledger, empty_detector.
+        max_in_flight: số khay tối đa đang nằm trong pipeline; submit() chờ khi vượt quá.
+        max_batch_trays: số khay tối đa gom vào một lượt chạy mô hình.
+        render_pdf: tạo hóa đơn PDF ở stage cuối (False = chỉ tính tiền và lưu qua sink).
+        detect_fn: hàm cấp module (chạy trong tiến trình con) nhận ảnh, trả về (khay hoặc None, số giây).
+        '''
+        self.pipeline = pipeline
+        self.detect_fn = detect_fn
+        self.workers = workers or os.cpu_count()
+        self.max_batch_trays = max_batch_trays
+        self.render_pdf = render_pdf
+
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        # Số phần tử trong hàng đợi luôn <= max_in_flight nhờ semaphore, put() không bao giờ phải chờ
+        self._infer_queue = queue.Queue(maxsize=max_in_flight)
+        self._bill_queue = queue.Queue(maxsize=max_in_flight)
+
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._detecting = 0
+        self._busy = {"detect": 0.0, "inference": 0.0, "billing": 0.0}
+        self._done = {"detect": 0, "inference": 0, "billing": 0}
+        self._batches = 0
+
+        self._infer_thread = threading.Thread(target=self._inference_loop, name="pipelined-inference", daemon=True)
+        self._bill_thread = threading.Thread(target=self._billing_loop, name="pipelined-billing", daemon=True)
+        self._infer_thread.start()
+        self._bill_thread.start()
+
+    def submit(self, image, timeout=None):
+        '''Đưa một ảnh khay (đường dẫn, bytes hoặc ndarray) vào pipeline; trả về Future cho kết quả
+
+        Kết quả giống TrayPipeline.run (thêm "pdf" = (bytes, đường dẫn) nếu render_pdf), None nếu không thấy khay.
+        '''
+        acquired = self._slots.acquire() if timeout is None else self._slots.acquire(timeout=timeout)
+        if not acquired:
+            raise TimeoutError("Pipeline đang quá tải")
+        job = _Job()
+        with self._lock:
+            self._detecting += 1
+        try:
+            self._pool.submit(self.detect_fn, image).add_done_callback(lambda f: self._on_detected(job, f))
+        except Exception:
+            with self._lock:
+                self._detecting -= 1
+            self._finish(job, error=True)
+            raise
+        return job.future
+
+    def _on_detected(self, job, fut):
+        with self._lock:
+            self._detecting -= 1
+        try:
+            tray, seconds = fut.result()
+        except Exception as e:
+            self._finish(job, exc=e)
+            return
+        with self._lock:
+            self._busy["detect"] += seconds
+            self._done["detect"] += 1
+        if tray is None:
+            self._finish(job, None)
+            return
+        # Cắt ô ở tiến trình chính: chỉ là các view trên khay, tránh truyền điểm ảnh hai lần giữa tiến trình
+        job.tray, job.crops = tray, crop_cell(tray)
+        self._infer_queue.put(job)
+
+    def _inference_loop(self):
+        while True:
+            job = self._infer_queue.get()
+            if job is _STOP:
+                self._bill_queue.put(_STOP)
+                return
+            # Gom mọi khay đang chờ (tối đa max_batch_trays) vào một lượt chạy mô hình
+            batch, stop = [job], False
+            while len(batch) < self.max_batch_trays:
+                try:
+                    nxt = self._infer_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            start = time.perf_counter()
+            try:
+                all_predictions = self.pipeline.classify_many([j.crops for j in batch])
+                for j, predictions in zip(batch, all_predictions):
+                    bill = self.pipeline.bill_gen.calculate_bill(predictions)
+                    j.result = {"tray": j.tray, "crops": j.crops, "predictions": predictions, "bill": bill}
+            except Exception as e:
+                for j in batch:
+                    self._finish(j, exc=e)
+                batch = []
+            with self._lock:
+                self._busy["inference"] += time.perf_counter() - start
+                self._done["inference"] += len(batch)
+                self._batches += 1
+
+            for j in batch:
+                self._bill_queue.put(j)
+            if stop:
+                self._bill_queue.put(_STOP)
+                return
+
+    def _billing_loop(self):
+        # Luồng hóa đơn dùng BillGenerator riêng (template ReportLab không chia sẻ giữa các luồng)
+        bill_gen = self.pipeline.bill_gen.clone() if self.render_pdf else None
+        while True:
+            job = self._bill_queue.get()
+            if job is _STOP:
+                return
+            start = time.perf_counter()
+            try:
+                if self.pipeline.sink is not None:
+                    job.result["crop_folder"] = self.pipeline.sink.save_tray(job.result)
+                if self.render_pdf:
+                    job.result["pdf"] = self.pipeline.render_pdf(job.result["bill"], bill_gen)
+            except Exception as e:
+                self._finish(job, exc=e)
+                continue
+            finally:
+                with self._lock:
+                    self._busy["billing"] += time.perf_counter() - start
+                    self._done["billing"] += 1
+            self._finish(job, job.result)
+
+    def _finish(self, job, result=None, exc=None, error=False):
+        if exc is not None:
+            job.future.set_exception(exc)
+        elif not error:
+            job.future.set_result(result)
+        self._slots.release()
+
+    def stats(self):
+        '''Độ dài hàng đợi và mức sử dụng từng stage (tỷ lệ thời gian bận trên thời gian chạy)'''
+        wall = time.perf_counter() - self._started
+        with self._lock:
+            return {
+                "uptime_s": wall,
+                "queue_depth": {
+                    "detect": self._detecting,
+                    "inference": self._infer_queue.qsize(),
+                    "billing": self._bill_queue.qsize()
+                },
+                "completed": dict(self._done),
+                "inference_batches": self._batches,
+                "avg_batch_trays": self._done["inference"] / self._batches if self._batches else 0.0,
+                "utilisation": {
+                    "detect": self._busy["detect"] / (wall * self.workers),
+                    "inference": self._busy["inference"] / wall,
+                    "billing": self._busy["billing"] / wall
+                }
+            }
+
+    def close(self):
+        '''Chờ xử lý hết các khay đã nhận rồi dừng các luồng và process pool'''
+        self._pool.shutdown(wait=True)
+        self._infer_queue.put(_STOP)
+        self._infer_thread.join()
+        self._bill_thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    from batch_process import list_images
+    from pipeline import TrayPipeline, DiskSink, BILL_DIR
+
+    parser = argparse.ArgumentParser(description="Xử lý hàng khay theo kiểu pipeline chồng stage (dò khay / mô hình / hóa đơn)")
+    parser.add_argument("input_dir", help="Thư mục chứa ảnh khay")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Số tiến trình dò khay")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="Số khay tối đa đang xử lý")
+    parser.add_argument("--batch-trays", type=int, default=8, help="Số khay tối đa gom vào một lượt mô hình")
+    parser.add_argument("--no-pdf", action="store_true", help="Không tạo hóa đơn PDF")
+    parser.add_argument("--save-pdf", action="store_true", help="Lưu hóa đơn PDF vào thư mục bills/")
+    args = parser.parse_args()
+
+    paths = list_images(args.input_dir)
+    print(f"📂 {len(paths)} ảnh khay")
+    pipeline = TrayPipeline(sink=DiskSink(bill_dir=BILL_DIR) if args.save_pdf else None)
+
+    start = time.perf_counter()
+    n_ok = n_fail = 0
+    with PipelinedExecutor(pipeline, args.workers, args.max_in_flight, args.batch_trays,
+                           render_pdf=not args.no_pdf) as executor:
+        futures = [executor.submit(p) for p in paths]
+        for i, fut in enumerate(futures, 1):
+            if fut.result() is None:
+                n_fail += 1
+            else:
+                n_ok += 1
+            if i % 20 == 0:
+                s = executor.stats()
+                print(f"  ... {i}/{len(paths)} khay, hàng đợi {s['queue_depth']}")
+        stats = executor.stats()
+
+    elapsed = time.perf_counter() - start
+    print("\n✅ Hoàn thành:")
+    print(f" + Thành công: {n_ok} khay, không nhận diện được: {n_fail} khay")
+    print(f" + Thông lượng: {(n_ok + n_fail) / elapsed:.2f} khay/giây ({elapsed:.1f} giây)")
+    print(f" + Trung bình {stats['avg_batch_trays']:.1f} khay/lượt mô hình")
+    for stage, u in stats["utilisation"].items():
+        print(f" + Mức sử dụng {stage:<10}{u:6.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Chỉ thử lại lỗi tạm thời (mạng chập chờn, thao tác I/O bị ngắt hoặc tạm bận).
+# Lỗi cố định như FileNotFoundError, PermissionError có thử lại cũng không khỏi nên báo ngay.
+TRANSIENT_ERRORS = (TimeoutError, ConnectionError, InterruptedError, BlockingIOError)
+try:
+    # Tải QR dự phòng (infer_bill._fetch_vietqr_png) báo lỗi mạng bằng ngoại lệ riêng của requests
+    import requests
+    TRANSIENT_ERRORS += (requests.ConnectionError, requests.Timeout)
+except ImportError:
+    pass
+
+class PdfRenderQueue:
+    """Hàng đợi tạo PDF nền: pool luồng giới hạn, thử lại lỗi tạm thời, chặn khi tồn đọng quá nhiều"""
+
+    def __init__(self, render_fn, max_workers=2, max_pending=8, retries=2, backoff=0.5):
+        '''
+        render_fn: hàm nhận bill, trả về kết quả tạo PDF (vd TrayPipeline.render_pdf).
+        max_pending: số hóa đơn tối đa đang chờ/đang tạo; vượt quá thì submit() phải chờ.
+        retries/backoff: số lần thử lại và thời gian chờ (giây, tăng gấp đôi mỗi lần).
+        '''
+        self.render_fn = render_fn
+        self.retries = retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf-render")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, bill, timeout=None):
+        '''Đưa hóa đơn vào hàng đợi, trả về Future; chờ tối đa timeout giây nếu hàng đợi đầy'''
+        acquired = self._slots.acquire() if timeout is None else self._slots.acquire(timeout=timeout)
+        if not acquired:
+            raise TimeoutError("Hàng đợi tạo hóa đơn PDF đang quá tải")
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._executor.submit(self._render, bill)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _render(self, bill):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.render_fn(bill)
+            except TRANSIENT_ERRORS:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    @property
+    def pending(self):
+        '''Số hóa đơn đang chờ hoặc đang được tạo'''
+        return self._pending
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
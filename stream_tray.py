@@ -0,0 +1,183 @@
+import time
+import argparse
+from collections import deque
+import cv2
+import numpy as np
+from detect_tray import OUT_SIZE, find_tray_corners, tray_homography
+from calibration import edge_thumb, edge_band, edge_corr
+
+# Ảnh thu nhỏ dùng để đo chuyển động / thay đổi khung hình (rất rẻ)
+THUMB_SIZE = (64, 48)
+
+class TrayStreamer:
+    """Xử lý luồng camera/video: giữ homography khay gần nhất, tự phân loại khi khay đứng yên"""
+
+    def __init__(self, pipeline, motion_threshold=4.0, change_threshold=12.0, stable_frames=8, out_size=OUT_SIZE,
+                 retry_frames=10, reuse_corr=0.6):
+        '''
+        motion_threshold: chênh lệch trung bình giữa 2 khung liên tiếp để coi là đang chuyển động.
+        change_threshold: chênh lệch so với khung lúc dò khay gần nhất để coi là khay mới.
+        stable_frames: số khung đứng yên liên tiếp trước khi tự động phân loại.
+        retry_frames: khi chưa bắt được khay, chỉ dò lại sau mỗi chừng này khung đứng yên.
+        reuse_corr: tương quan biên tối thiểu quanh mép khay cũ để dùng lại homography thay vì dò lại.
+        Mỗi lần có chuyển động rồi đứng yên trở lại đều tính là khay mới.
+        '''
+        self.pipeline = pipeline
+        self.fixed_camera = getattr(pipeline, "fixed_camera", None)
+        self.motion_threshold = motion_threshold
+        self.change_threshold = change_threshold
+        self.stable_frames = stable_frames
+        self.out_size = out_size
+        self.retry_frames = retry_frames
+        self.reuse_corr = reuse_corr
+
+        self.corners = None
+        self.matrix = None
+        self._band = self._ref_edges = None
+        self._since_attempt = retry_frames
+        self.ref_thumb = None
+        self.prev_thumb = None
+        self.stable_count = 0
+        self.moved = False
+        self.classified = False
+        self.detections = 0
+        self.reused = 0
+
+    def _thumb(self, frame):
+        small = cv2.resize(frame, THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+    def process_frame(self, frame):
+        '''Xử lý một khung hình; trả về kết quả pipeline khi vừa phân loại xong một khay, ngược lại None'''
+        thumb = self._thumb(frame)
+        motion = np.inf if self.prev_thumb is None else np.abs(thumb - self.prev_thumb).mean()
+        self.prev_thumb = thumb
+
+        if motion > self.motion_threshold:
+            self.stable_count = 0
+            self.moved = True
+            return None
+        self.stable_count += 1
+        if self.stable_count < self.stable_frames:
+            return None
+
+        # Khay mới sau mỗi chu kỳ chuyển động -> đứng yên, hoặc khi khung hình đổi dần quá ngưỡng
+        changed = self.moved or self.ref_thumb is None or \
+            np.abs(thumb - self.ref_thumb).mean() > self.change_threshold
+        if changed:
+            self.moved = False
+            self.ref_thumb = thumb
+            self.classified = False
+
+        if self.classified:
+            return None
+
+        # Chưa bắt được khay: chỉ thử lại sau mỗi retry_frames khung đứng yên (khay mới thì thử ngay)
+        self._since_attempt += 1
+        if not changed and self._since_attempt < self.retry_frames:
+            return None
+        self._since_attempt = 0
+
+        # Camera cố định đã hiệu chuẩn: remap thẳng từng ô, chỉ dò lại khi khay bị lệch
+        if self.fixed_camera is not None:
+            misses = self.fixed_camera.misses
+            rectified = self.fixed_camera.rectify(frame)
+            self.detections += self.fixed_camera.misses - misses   # chỉ đếm lần thực sự dò khay
+            if rectified is None:
+                self.corners = None
+                return None
+            self.classified = True
+            self.corners = self.fixed_camera.calibration.corners
+            return self.pipeline.classify_tray(*rectified)
+
+        if not self._same_place(frame):
+            self.detections += 1
+            self.corners = find_tray_corners(frame)
+            if self.corners is None:
+                self.matrix = self._band = self._ref_edges = None
+                return None
+            self.matrix = tray_homography(self.corners, self.out_size)
+            edges = edge_thumb(frame)
+            self._band = edge_band(edges, frame.shape, self.corners)
+            self._ref_edges = edges[self._band]
+        else:
+            self.reused += 1
+
+        fixed = cv2.warpPerspective(frame, self.matrix, self.out_size)
+        self.classified = True
+        return self.pipeline.classify_tray(fixed)
+
+    def _same_place(self, frame):
+        '''Khay mới nằm đúng chỗ khay trước (biên quanh mép khay cũ còn khớp): dùng lại homography, bỏ qua dò khay'''
+        if self.matrix is None:
+            return False
+        return edge_corr(self._ref_edges, edge_thumb(frame)[self._band]) >= self.reuse_corr
+
+    def draw_overlay(self, frame, fps):
+        '''Vẽ khung khay đang theo dõi và FPS lên khung hình để hiển thị'''
+        view = frame.copy()
+        if self.corners is not None:
+            cv2.polylines(view, [np.int32(self.corners)], True, (0, 200, 0) if self.classified else (0, 200, 255), 3)
+        cv2.putText(view, f"{fps:.1f} FPS", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        return view
+
+def run_stream(source, pipeline, target_fps=15, display=True, **kwargs):
+    '''Đọc khung hình từ camera (số) hoặc file video và xử lý liên tục trong ngân sách FPS'''
+    cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not cap.isOpened():
+        print(f"❌ Không thể mở nguồn video: {source}")
+        return
+
+    streamer = TrayStreamer(pipeline, **kwargs)
+    budget = 1.0 / target_fps
+    stamps = deque(maxlen=30)
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            start = time.perf_counter()
+            result = streamer.process_frame(frame)
+            if result is not None:
+                bill = result["bill"]
+                print(f"\n✅ Khay mới ({bill['timestamp']}):")
+                for item in bill["items"]:
+                    print(f" + {item['name']}: {item['price']:,} VND ({item['confidence']:.1%})")
+                print(f"   Tổng cộng: {bill['total']:,} VND")
+
+            stamps.append(time.perf_counter())
+            fps = (len(stamps) - 1) / (stamps[-1] - stamps[0]) if len(stamps) > 1 else 0.0
+            if display:
+                cv2.imshow("UEH Smart Canteen - Camera", streamer.draw_overlay(frame, fps))
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+
+            # Vượt ngân sách thời gian: bỏ qua các khung đã cũ thay vì xử lý dồn
+            elapsed = time.perf_counter() - start
+            for _ in range(int(elapsed // budget)):
+                if not cap.grab():
+                    break
+    finally:
+        cap.release()
+        if display:
+            cv2.destroyAllWindows()
+    print(f"\nĐã dò khay {streamer.detections} lần, dùng lại homography {streamer.reused} lần.")
+    if streamer.fixed_camera is not None:
+        print(f"Camera cố định: {streamer.fixed_camera.report()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Nhận diện khay cơm liên tục từ camera hoặc video")
+    parser.add_argument("--source", default="0", help="Chỉ số camera (vd: 0) hoặc đường dẫn file video")
+    parser.add_argument("--fps", type=float, default=15, help="Ngân sách khung hình/giây")
+    parser.add_argument("--stable-frames", type=int, default=8, help="Số khung đứng yên trước khi phân loại")
+    parser.add_argument("--no-display", action="store_true", help="Không mở cửa sổ xem trước")
+    parser.add_argument("--calibration", default=None, help="File hiệu chuẩn camera cố định (calibration.py)")
+    args = parser.parse_args()
+
+    from pipeline import TrayPipeline
+    from calibration import CALIB_PATH, load_fixed_camera
+    pipeline = TrayPipeline(fixed_camera=load_fixed_camera(args.calibration or CALIB_PATH))
+    run_stream(args.source, pipeline, args.fps, not args.no_display, stable_frames=args.stable_frames)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+import batch_process
+import pipeline as pipeline_module
+from detect_tray import OUT_SIZE
+from inference_server import InferenceServer
+from pipeline import TrayPipeline
+
+class RecordingClassifier:
+    """Ghi lại các ô mô hình nhận được để so sánh giữa các đường xử lý"""
+
+    img_size = (128, 128)
+    model_version = "test"
+    fallback = None
+
+    def __init__(self):
+        self.seen = []
+
+    def predict_batch(self, images, top_k=3):
+        names = list(images)
+        self.seen.extend(images[name] for name in names)
+        return [{"cell": name, "predicted_class": "com", "confidence": 1.0} for name in names]
+
+class FakeBillGen:
+    def calculate_bill(self, predictions):
+        return {"items": [], "total": 0}
+
+@pytest.fixture
+def tray(monkeypatch):
+    w, h = OUT_SIZE
+    fixed = np.random.default_rng(0).integers(0, 256, (h, w, 3), dtype=np.uint8)
+    # Bỏ qua bước dò khay thật: cả hai đường xử lý nhận cùng một khay đã chỉnh phối cảnh
+    monkeypatch.setattr(batch_process, "perspective_tray", lambda image: fixed)
+    monkeypatch.setattr(pipeline_module, "perspective_tray", lambda image: fixed)
+    return fixed
+
+def test_server_crops_match_tray_pipeline(tray):
+    reference = RecordingClassifier()
+    TrayPipeline(classifier=reference, bill_gen=FakeBillGen()).run(b"tray")
+
+    served = RecordingClassifier()
+    server = InferenceServer(served, FakeBillGen(), workers=1)
+    server.pool.shutdown()
+    server.pool = ThreadPoolExecutor(max_workers=1)   # chạy cùng tiến trình để dùng khay giả lập
+
+    async def serve_once():
+        batch_task = asyncio.create_task(server.batcher.run())
+        try:
+            return await server.process(b"tray")
+        finally:
+            batch_task.cancel()
+
+    status, body = asyncio.run(serve_once())
+    server.pool.shutdown()
+
+    assert status == 200
+    assert len(served.seen) == len(reference.seen) == 5
+    for a, b in zip(served.seen, reference.seen):
+        assert a.shape == b.shape and np.array_equal(a, b)
@@ -0,0 +1,39 @@
+import time
+import sqlite3
+from ledger import SalesLedger, SCHEMA
+
+def make_bill(bill_id):
+    return {"id": bill_id, "timestamp": "2025-01-01 12:00:00", "total": 30000,
+            "items": [{"class": "com_trang", "name": "Cơm trắng", "price": 30000, "quantity": 1, "confidence": 0.9}]}
+
+def test_failed_flush_keeps_rows(tmp_path):
+    db = tmp_path / "ledger.sqlite3"
+    ledger = SalesLedger(db, batch_size=100, flush_interval=60)
+    ledger.record(make_bill("A1"))
+
+    # Bảng bị mất giữa chừng: transaction lỗi, hóa đơn phải còn trong hàng đợi
+    other = sqlite3.connect(str(db))
+    other.execute("DROP TABLE bill_items")
+    other.commit()
+    assert ledger.flush() is False
+    assert len(ledger._pending) == 1
+
+    other.executescript(SCHEMA)
+    other.close()
+    assert ledger.flush() is True
+    assert ledger.get_bill("A1")["total"] == 30000
+    ledger.close()
+
+def test_flush_interval_without_new_records(tmp_path):
+    ledger = SalesLedger(tmp_path / "ledger.sqlite3", batch_size=100, flush_interval=0.05)
+    ledger.record(make_bill("B1"))
+    time.sleep(0.3)
+    assert not ledger._pending
+    ledger.close()
+
+def test_record_same_bill_twice(tmp_path):
+    with SalesLedger(tmp_path / "ledger.sqlite3", batch_size=1) as ledger:
+        ledger.record(make_bill("C1"))
+        ledger.record(make_bill("C1"))
+        assert not ledger._pending
+        assert len(ledger.bills_between("2025", "2026")) == 1
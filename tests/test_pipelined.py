@@ -0,0 +1,46 @@
+import time
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from pipelined import PipelinedExecutor
+
+def fake_detect(image):
+    '''Dò khay giả lập (chạy trong tiến trình con): trả về khay 800x600 trống'''
+    return np.zeros((600, 800, 3), np.uint8), 0.0
+
+class _BillGen:
+    def calculate_bill(self, predictions):
+        return {"items": [], "total": len(predictions)}
+
+class SlowPipeline:
+    """Stage mô hình chậm để hàng đợi đầy"""
+
+    sink = None
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.bill_gen = _BillGen()
+
+    def classify_many(self, trays):
+        time.sleep(self.delay)
+        return [[{"cell": name} for name in crops] for crops in trays]
+
+def test_submit_blocks_instead_of_failing_when_full():
+    max_in_flight, n_jobs = 2, 7
+    with PipelinedExecutor(SlowPipeline(), workers=1, max_in_flight=max_in_flight, max_batch_trays=1,
+                           render_pdf=False, detect_fn=fake_detect) as executor:
+        futures = [executor.submit(i) for i in range(n_jobs)]   # vượt max_in_flight: phải chờ, không lỗi
+        results = [f.result(timeout=60) for f in futures]
+    assert all(r is not None and r["bill"]["total"] == 5 for r in results)
+
+def test_submit_timeout_raises_when_full():
+    executor = PipelinedExecutor(SlowPipeline(delay=1.0), workers=1, max_in_flight=1, max_batch_trays=1,
+                                 render_pdf=False, detect_fn=fake_detect)
+    try:
+        executor.submit(0)
+        with pytest.raises(TimeoutError):
+            executor.submit(1, timeout=0.01)
+    finally:
+        executor.close()
@@ -0,0 +1,71 @@
+import threading
+import pytest
+from render_queue import PdfRenderQueue
+
+def test_submit_blocks_when_full():
+    release = threading.Event()
+
+    def render(bill):
+        release.wait(5)
+        return bill
+
+    q = PdfRenderQueue(render, max_workers=1, max_pending=1, retries=0)
+    first = q.submit(1)
+    done = []
+    # Hàng đợi đầy: submit thứ hai phải chờ chứ không báo lỗi ngay
+    t = threading.Thread(target=lambda: done.append(q.submit(2).result(5)))
+    t.start()
+    t.join(0.2)
+    assert t.is_alive() and not done
+    release.set()
+    t.join(5)
+    assert first.result(5) == 1 and done == [2]
+    q.shutdown()
+
+def test_submit_timeout_when_full():
+    release = threading.Event()
+    q = PdfRenderQueue(lambda bill: release.wait(5), max_workers=1, max_pending=1)
+    q.submit(1)
+    with pytest.raises(TimeoutError):
+        q.submit(2, timeout=0.01)
+    release.set()
+    q.shutdown()
+
+def test_retries_only_transient_errors():
+    calls = []
+
+    def flaky(bill):
+        calls.append(bill)
+        if len(calls) < 2:
+            raise ConnectionError("mạng chập chờn")
+        return "ok"
+
+    q = PdfRenderQueue(flaky, retries=2, backoff=0)
+    assert q.submit(1).result(5) == "ok" and len(calls) == 2
+
+    calls.clear()
+
+    def missing(bill):
+        calls.append(bill)
+        raise FileNotFoundError("thiếu font")
+
+    q2 = PdfRenderQueue(missing, retries=2, backoff=0)
+    with pytest.raises(FileNotFoundError):
+        q2.submit(1).result(5)
+    assert len(calls) == 1
+    q.shutdown()
+    q2.shutdown()
+
+def test_retries_requests_connection_error():
+    requests = pytest.importorskip("requests")
+    calls = []
+
+    def flaky(bill):
+        calls.append(bill)
+        if len(calls) < 2:
+            raise requests.ConnectionError("img.vietqr.io không phản hồi")
+        return "ok"
+
+    q = PdfRenderQueue(flaky, retries=2, backoff=0)
+    assert q.submit(1).result(5) == "ok" and len(calls) == 2
+    q.shutdown()
@@ -0,0 +1,13 @@
+import pytest
+
+pytest.importorskip("reportlab")
+
+from vietqr import qr_modules, qr_drawing
+
+def test_qr_encoded_once_drawing_fresh_per_call():
+    qr_modules.cache_clear()
+    a, b = qr_drawing(35000), qr_drawing(35000)
+    assert a is not b                      # Drawing không dùng chung giữa các hóa đơn
+    assert qr_modules.cache_info().misses == 1 and qr_modules.cache_info().hits == 1
+    modules = qr_modules(35000)
+    assert len(modules) == len(modules[0]) >= 21 and any(any(row) for row in modules)
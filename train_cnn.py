@@ -0,0 +1,304 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import Sequential
+from tensorflow.keras.layers import (Rescaling, Conv2D, MaxPooling2D, Flatten, Dropout, Dense,
+                                     BatchNormalization, GlobalAveragePooling2D)
+from cnn_classification import MODEL_PATH, LARGE_MODEL_PATH
+
+# Thiết lập tham số (giống train_cnn.ipynb)
+IMG_SIZE = (128, 128)
+BATCH_SIZE = 32
+EPOCHS = 15
+SEED = 123
+VALIDATION_SPLIT = 0.2
+IMAGE_FORMATS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png')
+AUTOTUNE = tf.data.AUTOTUNE
+
+def list_split(data_dir, subset, seed=SEED, validation_split=VALIDATION_SPLIT):
+    '''Liệt kê ảnh và chia train/val giống hệt image_dataset_from_directory của notebook
+
+    Trả về (đường dẫn, nhãn, tên lớp) của tập subset ("training" hoặc "validation").
+    '''
+    class_names = sorted(d.name for d in Path(data_dir).iterdir() if d.is_dir())
+    paths, labels = [], []
+    for label, class_name in enumerate(class_names):
+        for root, _, files in sorted(os.walk(Path(data_dir) / class_name)):
+            for f in sorted(files):
+                if f.lower().endswith(IMAGE_FORMATS):
+                    paths.append(os.path.join(root, f))
+                    labels.append(label)
+
+    # Xáo trộn với cùng seed cho đường dẫn và nhãn như Keras
+    paths, labels = np.array(paths), np.array(labels)
+    np.random.RandomState(seed).shuffle(paths)
+    np.random.RandomState(seed).shuffle(labels)
+
+    num_val = int(validation_split * len(paths))
+    if subset == "training":
+        return paths[:-num_val], labels[:-num_val], class_names
+    return paths[-num_val:], labels[-num_val:], class_names
+
+def decode_image(path, label, img_size=IMG_SIZE):
+    '''Giải mã và resize ảnh (bilinear như Keras), lưu dạng uint8 để cache gọn'''
+    img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    img = tf.image.resize(img, img_size)
+    return tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8), label
+
+def augment_image(img, label):
+    '''Augment nhẹ trên luồng tf.data (chạy song song)'''
+    img = tf.image.random_flip_left_right(img)
+    img = tf.image.random_brightness(img, 0.1 * 255)
+    return img, label
+
+def shard_dataset(augmented_dir, class_names, train_paths, img_size=IMG_SIZE):
+    '''Đọc các shard .npy do augment_images.py tạo ra dưới dạng tf.data (memmap, không giải mã lại)
+
+    Chỉ lấy ảnh augment từ ảnh gốc thuộc train_paths, tránh lọt ảnh kiểm định vào tập train.
+    '''
+    from augment_images import open_shards
+    keep = {f"{Path(p).parent.name}/{Path(p).name}" for p in train_paths}
+    shards = open_shards(augmented_dir, class_names, keep_sources=keep)
+
+    def gen():
+        for images, labels, rows in shards:
+            for i in rows:
+                yield images[i], labels[i]
+
+    count = sum(len(rows) for _, _, rows in shards)
+    ds = tf.data.Dataset.from_generator(gen, output_signature=(
+        tf.TensorSpec((*img_size, 3), tf.uint8), tf.TensorSpec((), tf.int32)))
+    return ds.apply(tf.data.experimental.assert_cardinality(count)), count
+
+def memmap_dataset(dataset_cache, paths, labels, img_size=IMG_SIZE):
+    '''Đọc ảnh đã giải mã sẵn từ DatasetCache (dataset_cache.py) thay vì giải mã lại
+
+    None nếu cache thiếu ảnh nào đó hoặc khác kích thước ảnh (khi đó giải mã như bình thường).
+    '''
+    rows = dataset_cache.lookup(paths)
+    if not len(rows) or (rows < 0).any() or \
+            tuple(dataset_cache.image(int(rows[0])).shape[:2]) != tuple(img_size):
+        return None
+
+    def gen():
+        for row, label in zip(rows, labels):
+            yield dataset_cache.image(int(row)), label
+
+    ds = tf.data.Dataset.from_generator(gen, output_signature=(
+        tf.TensorSpec((*img_size, 3), tf.uint8), tf.TensorSpec((), tf.int32)))
+    return ds.apply(tf.data.experimental.assert_cardinality(len(rows)))
+
+def dataset_cache_path(cache_dir, split, paths, img_size=IMG_SIZE, seed=SEED):
+    '''Đường dẫn cache tf.data khóa theo (danh sách ảnh, tập, seed, kích thước ảnh)
+
+    Dữ liệu hoặc tham số thay đổi sẽ ra thư mục cache mới thay vì đọc nhầm cache cũ.
+    Xóa các .lockfile do lần chạy bị ngắt giữa chừng để lại (tf.data sẽ từ chối ghi cache).
+    '''
+    key = json.dumps([sorted(str(p) for p in paths), split, seed, list(img_size)])
+    path = os.path.join(cache_dir, f"{split}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}")
+    for lockfile in glob.glob(glob.escape(path) + "*.lockfile"):
+        os.remove(lockfile)
+    return path
+
+def make_dataset(paths, labels, cache_path=None, training=False, augment=False,
+                 extra=None, img_size=IMG_SIZE, batch_size=BATCH_SIZE, seed=SEED, decoded=None):
+    '''Pipeline tf.data: giải mã song song -> cache đã giải mã trên đĩa -> (augment) -> batch -> prefetch
+
+    extra: (dataset, số ảnh) từ shard_dataset, chỉ trộn vào khi training=True.
+    decoded: dataset ảnh đã giải mã (memmap_dataset), dùng thay cho bước giải mã + cache.
+    '''
+    if decoded is not None:
+        ds = decoded
+    else:
+        ds = tf.data.Dataset.from_tensor_slices((paths, labels.astype(np.int32)))
+        ds = ds.map(lambda p, l: decode_image(p, l, img_size), num_parallel_calls=AUTOTUNE, deterministic=False)
+        # Cache ra đĩa: ảnh chỉ được giải mã một lần cho mọi epoch (và các lần chạy sau)
+        ds = ds.cache(cache_path) if cache_path else ds.cache()
+    if training:
+        ds = ds.shuffle(4096, seed=seed, reshuffle_each_iteration=True)
+        if extra is not None:
+            # Trộn ảnh gốc với shard augment theo tỷ lệ số lượng
+            extra_ds, n_extra = extra
+            extra_ds = extra_ds.shuffle(4096, seed=seed, reshuffle_each_iteration=True)
+            ds = tf.data.Dataset.sample_from_datasets(
+                [ds, extra_ds], weights=[len(paths), n_extra], seed=seed)
+        if augment:
+            ds = ds.map(augment_image, num_parallel_calls=AUTOTUNE, deterministic=False)
+    ds = ds.map(lambda x, y: (tf.cast(x, tf.float32), y), num_parallel_calls=AUTOTUNE)
+    return ds.batch(batch_size).prefetch(AUTOTUNE)
+
+def build_large_model(num_classes, img_size=IMG_SIZE):
+    '''Mô hình lớn hơn cho cascade: 4 khối tích chập kép + BatchNorm, gộp trung bình toàn cục'''
+    layers = [Rescaling(1./255, input_shape=(*img_size, 3))]
+    for filters in (32, 64, 128, 256):
+        layers += [Conv2D(filters, 3, padding='same', activation='relu'),
+                   BatchNormalization(),
+                   Conv2D(filters, 3, padding='same', activation='relu'),
+                   BatchNormalization(),
+                   MaxPooling2D()]
+    layers += [GlobalAveragePooling2D(),
+               Dropout(0.4),
+               Dense(256, activation='relu'),
+               Dense(num_classes, activation='softmax', dtype='float32')]
+    model = Sequential(layers)
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+def build_model(num_classes, img_size=IMG_SIZE, arch="small"):
+    '''Mô hình CNN giống notebook; tầng đầu ra luôn float32 để ổn định khi dùng mixed precision
+
+    arch="large": mô hình fallback cho cascade (xem build_large_model).
+    '''
+    if arch == "large":
+        return build_large_model(num_classes, img_size)
+    model = Sequential([Rescaling(1./255, input_shape=(*img_size, 3)),      # Chuẩn hóa giá trị pixel từ [0, 255] → [0, 1]
+                        Conv2D(32, 3, activation='relu', padding='same'),   # Tầng tích chập đầu: 32 bộ lọc
+                        MaxPooling2D(),                                     # Lấy đặc trưng nổi bật nhất, giảm kích cỡ ảnh
+                        Conv2D(64, 3, activation='relu', padding='same'),   # Tầng tích chập hai: 64 bộ lọc
+                        MaxPooling2D(),
+                        Conv2D(128, 3, activation='relu', padding='same'),  # Tầng tích chập ba: 128 bộ lọc
+                        MaxPooling2D(),
+                        Flatten(),                                          # Chuyển tensor 3D về vector 1D để đưa vào Dense
+                        Dropout(0.5),                                       # Bỏ ngẫu nhiên 50% neuron để tránh overfitting
+                        Dense(128, activation='relu'),
+                        Dense(num_classes, activation='softmax', dtype='float32')])  # Tầng đầu ra
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+def cpu_supports_bf16():
+    '''Kiểm tra CPU có lệnh bfloat16 (AVX512-BF16/AMX) để mixed precision thực sự nhanh hơn'''
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+def setup_mixed_precision(mode):
+    '''Bật mixed precision: "on", "off" hoặc "auto" (chỉ bật khi phần cứng hỗ trợ)'''
+    gpus = tf.config.list_physical_devices('GPU')
+    if mode == "off" or (mode == "auto" and not gpus and not cpu_supports_bf16()):
+        return "float32"
+    policy = "mixed_float16" if gpus else "mixed_bfloat16"
+    tf.keras.mixed_precision.set_global_policy(policy)
+    return policy
+
+def float32_copy(model, num_classes, img_size=IMG_SIZE, arch="small"):
+    '''Dựng lại kiến trúc dưới policy float32 và chép trọng số sang
+
+    Mô hình huấn luyện bằng mixed precision lưu kèm dtype policy bf16/fp16 ở từng tầng; máy quầy
+    không hỗ trợ bf16 sẽ suy luận chậm hơn. Trọng số vốn đã là float32 nên chép thẳng được.
+    '''
+    tf.keras.mixed_precision.set_global_policy("float32")
+    clean = build_model(num_classes, img_size, arch)
+    clean.set_weights(model.get_weights())
+    return clean
+
+class ThroughputLogger(tf.keras.callbacks.Callback):
+    """Ghi lại thời gian mỗi epoch và tốc độ huấn luyện (ảnh/giây)"""
+
+    def __init__(self, num_images):
+        super().__init__()
+        self.num_images = num_images
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._start
+        print(f"⏱️ Epoch {epoch + 1}: {elapsed:.1f} giây, {self.num_images / elapsed:.0f} ảnh/giây")
+
+def main():
+    cwd = Path.cwd()
+    candidate_dirs = [cwd / 'data', cwd.parent / 'data']
+    default_data = next((p for p in candidate_dirs if p.exists()), candidate_dirs[0])
+
+    parser = argparse.ArgumentParser(description="Huấn luyện mô hình CNN nhận diện món ăn")
+    parser.add_argument("--data", default=str(default_data), help="Thư mục dataset (mỗi lớp một thư mục con)")
+    parser.add_argument("--augmented-dir", default=None, help="Thư mục shard do augment_images.py tạo (thêm vào tập train)")
+    parser.add_argument("--arch", choices=["small", "large"], default="small",
+                        help="small: mô hình nhanh như notebook; large: mô hình fallback cho cascade")
+    parser.add_argument("--output", default=None, help="Đường dẫn lưu mô hình .h5 (mặc định theo --arch)")
+    parser.add_argument("--cache-dir", default="./cache/tfdata", help="Thư mục cache ảnh đã giải mã")
+    parser.add_argument("--dataset-cache", default=None,
+                        help="Thư mục cache của dataset_cache.py: đọc ảnh memmap và bỏ ảnh gần trùng đã loại khỏi tập train")
+    parser.add_argument("--checkpoint-dir", default="./checkpoints", help="Thư mục checkpoint để tiếp tục huấn luyện")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--augment", action="store_true", help="Augment nhẹ trên luồng dữ liệu")
+    parser.add_argument("--mixed-precision", choices=["auto", "on", "off"], default="auto")
+    args = parser.parse_args()
+
+    policy = setup_mixed_precision(args.mixed_precision)
+    print(f"Đường dẫn folder chứa dataset là DATA_DIR: {args.data} (precision: {policy})")
+
+    train_paths, train_labels, class_names = list_split(args.data, "training")
+    val_paths, val_labels, _ = list_split(args.data, "validation")
+
+    train_decoded = val_decoded = None
+    if args.dataset_cache:
+        from dataset_cache import DatasetCache
+        dcache = DatasetCache(args.dataset_cache, class_names)
+        keep = np.array([os.path.abspath(p) not in dcache.excluded for p in train_paths], dtype=bool)
+        if not keep.all():
+            print(f"🗑️ Bỏ {int((~keep).sum())} ảnh gần trùng khỏi tập train (danh sách excluded của dataset_cache.py)")
+            train_paths, train_labels = train_paths[keep], train_labels[keep]
+        train_decoded = memmap_dataset(dcache, train_paths, train_labels.astype(np.int32))
+        val_decoded = memmap_dataset(dcache, val_paths, val_labels.astype(np.int32))
+        if train_decoded is None or val_decoded is None:
+            print("⚠️ Cache dataset_cache.py chưa đủ ảnh hoặc khác kích thước, giải mã lại từ ảnh gốc")
+
+    extra, n_extra = None, 0
+    if args.augmented_dir:
+        extra = shard_dataset(args.augmented_dir, class_names, train_paths)
+        n_extra = extra[1]
+    print(f"Xác định được {len(class_names)} lớp; train: {len(train_paths) + n_extra} ảnh, val: {len(val_paths)} ảnh")
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    train_ds = make_dataset(train_paths, train_labels, dataset_cache_path(args.cache_dir, "train", train_paths),
+                            training=True, augment=args.augment, extra=extra, batch_size=args.batch_size,
+                            decoded=train_decoded)
+    val_ds = make_dataset(val_paths, val_labels, dataset_cache_path(args.cache_dir, "val", val_paths),
+                          batch_size=args.batch_size, decoded=val_decoded)
+
+    model = build_model(len(class_names), arch=args.arch)
+    model.summary()
+
+    # Checkpoint: BackupAndRestore cho phép chạy lại lệnh để tiếp tục từ epoch bị ngắt
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    best_path = os.path.join(args.checkpoint_dir, "best.keras")
+    callbacks = [
+        tf.keras.callbacks.BackupAndRestore(os.path.join(args.checkpoint_dir, "backup")),
+        tf.keras.callbacks.ModelCheckpoint(best_path, monitor="val_accuracy", save_best_only=True),
+        ThroughputLogger(len(train_paths) + n_extra),
+    ]
+    model.fit(train_ds, validation_data=val_ds, epochs=args.epochs, callbacks=callbacks, verbose=1)
+
+    # Lưu epoch tốt nhất (không phải epoch cuối), dạng float32 cho máy suy luận
+    if os.path.exists(best_path):
+        model = tf.keras.models.load_model(best_path)
+    model = float32_copy(model, len(class_names), arch=args.arch)
+
+    val_loss, val_accuracy = model.evaluate(val_ds, verbose=0)
+    print(f"\nĐộ mất mát trên tập Val: {val_loss:.4f}")
+    print(f"Độ chính xác trên tập Val: {val_accuracy:.4f} ({val_accuracy*100:.2f}%)")
+
+    # Lưu lại mô hình CNN và tên lớp đã huấn luyện
+    model_save_path = Path(args.output or (LARGE_MODEL_PATH if args.arch == "large" else MODEL_PATH))
+    model_save_path.parent.mkdir(parents=True, exist_ok=True)
+    model.save(str(model_save_path))
+    print(f"Lưu model tại: {model_save_path}")
+
+    class_names_path = model_save_path.parent / 'class_names.json'
+    with open(class_names_path, 'w', encoding='utf-8') as f:
+        json.dump(class_names, f, ensure_ascii=False, indent=2)
+    print(f"Lưu class names tại: {class_names_path}")
+
+if __name__ == "__main__":
+    main()
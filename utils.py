@@ -3,21 +3,26 @@ import numpy as np
 import json
 import os
 
-def line_angle(line):
-    '''Tính độ nghiêng của đường thẳng'''
-    x1, y1, x2, y2 = line[0]
-    return np.degrees(np.arctan2(y2 - y1, x2 - x1))
+def line_angles(segments):
+    '''Tính độ nghiêng (độ) của nhiều đoạn thẳng cùng lúc, segments dạng (N, 4)'''
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    return np.degrees(np.arctan2(segments[:, 3] - segments[:, 1], segments[:, 2] - segments[:, 0]))
 
-def intersection(line1, line2):
-    '''Tìm giao điểm của hai đường thẳng'''
-    x1, y1, x2, y2 = line1[0]
-    x3, y3, x4, y4 = line2[0]
+def intersections(lines1, lines2):
+    '''Tìm giao điểm từng cặp đường thẳng (N, 4) x (N, 4); trả về (N, 2), NaN nếu song song'''
+    a = np.asarray(lines1, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(lines2, dtype=np.float64).reshape(-1, 4)
+    x1, y1, x2, y2 = a.T
+    x3, y3, x4, y4 = b.T
     denom = (x1 - x2)*(y3 - y4) - (y1 - y2)*(x3 - x4)
-    if denom == 0:
-        return None
-    px = ((x1*y2 - y1*x2)*(x3 - x4) - (x1 - x2)*(x3*y4 - y3*x4)) / denom
-    py = ((x1*y2 - y1*x2)*(y3 - y4) - (y1 - y2)*(x3*y4 - y3*x4)) / denom
-    return int(px), int(py)
+    det_a = x1*y2 - y1*x2
+    det_b = x3*y4 - y3*x4
+    with np.errstate(divide='ignore', invalid='ignore'):
+        px = (det_a*(x3 - x4) - (x1 - x2)*det_b) / denom
+        py = (det_a*(y3 - y4) - (y1 - y2)*det_b) / denom
+    out = np.column_stack([px, py])
+    out[denom == 0] = np.nan
+    return out
 
 def print_bill(bill):
     """Nicely print bill to console."""
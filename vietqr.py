@@ -0,0 +1,76 @@
+from functools import lru_cache
+from reportlab.lib import colors
+from reportlab.graphics.shapes import Drawing, Rect
+from reportlab.graphics.barcode import qrencoder
+
+# Thông tin tài khoản nhận thanh toán (Sacombank - mã BIN NAPAS 970403)
+BANK_BIN = "970403"
+ACCOUNT_NO = "050134744526"
+ACCOUNT_NAME = "UEH SMART CANTEEN"
+ADD_INFO = "THANH TOAN CHO UEH SMART CANTEEN"
+QR_BORDER = 2   # vùng trắng quanh mã (số module), như barBorder của QrCodeWidget
+
+def _tlv(tag, value):
+    '''Mã hóa một trường EMVCo dạng ID - độ dài - giá trị'''
+    return f"{tag}{len(value):02d}{value}"
+
+def crc16_ccitt(data):
+    '''CRC-16/CCITT-FALSE (đa thức 0x1021, giá trị đầu 0xFFFF) theo chuẩn EMVCo'''
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return crc
+
+@lru_cache(maxsize=1024)
+def build_payload(amount, account=ACCOUNT_NO, bank_bin=BANK_BIN, add_info=ADD_INFO):
+    '''Tạo chuỗi VietQR (EMVCo MPM) chuyển khoản nhanh NAPAS 247 tới tài khoản'''
+    beneficiary = _tlv("00", bank_bin) + _tlv("01", account)
+    merchant_info = (_tlv("00", "A000000727")          # GUID NAPAS
+                     + _tlv("01", beneficiary)
+                     + _tlv("02", "QRIBFTTA"))          # Dịch vụ chuyển nhanh tới tài khoản
+    amount = int(amount)
+    payload = (_tlv("00", "01")                          # Phiên bản payload
+               + _tlv("01", "12" if amount > 0 else "11")  # QR động khi có số tiền
+               + _tlv("38", merchant_info)
+               + _tlv("53", "704")                       # VND
+               + (_tlv("54", str(amount)) if amount > 0 else "")
+               + _tlv("58", "VN")
+               + (_tlv("62", _tlv("08", add_info)) if add_info else "")
+               + "6304")
+    return payload + f"{crc16_ccitt(payload.encode('ascii')):04X}"
+
+@lru_cache(maxsize=256)
+def qr_modules(amount, account=ACCOUNT_NO):
+    '''Mã hóa QR (bước tốn thời gian) một lần cho mỗi (số tiền, tài khoản): ma trận module dạng tuple bất biến'''
+    qr = qrencoder.QRCode(None, qrencoder.QRErrorCorrectLevel.L)
+    qr.addData(build_payload(amount, account))
+    qr.make()
+    n = qr.getModuleCount()
+    return tuple(tuple(bool(qr.isDark(r, c)) for c in range(n)) for r in range(n))
+
+def qr_drawing(amount, account=ACCOUNT_NO, size=85):
+    '''Vẽ mã QR (Drawing của ReportLab) cho số tiền từ ma trận module đã cache
+
+    Mỗi lần gọi tạo Drawing mới vì drawOn() gắn/xóa canv trên chính đối tượng,
+    không thể dùng chung giữa các luồng tạo PDF.
+    '''
+    modules = qr_modules(amount, account)
+    unit = size / (len(modules) + 2 * QR_BORDER)
+    drawing = Drawing(size, size)
+    for r, row in enumerate(modules):
+        y = size - (r + QR_BORDER + 1) * unit
+        c = 0
+        while c < len(row):
+            if not row[c]:
+                c += 1
+                continue
+            start = c
+            while c < len(row) and row[c]:
+                c += 1
+            # Gộp các module tối liền nhau trên một hàng thành một hình chữ nhật
+            drawing.add(Rect((start + QR_BORDER) * unit, y, (c - start) * unit, unit,
+                             fillColor=colors.black, strokeColor=None, strokeWidth=0))
+    return drawing